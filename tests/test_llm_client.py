@@ -0,0 +1,100 @@
+"""
+LLMClient retries, coalescing and stream safety against the local fake LLM server.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from utility.llm_client import LLMClient
+from vectordatabases.comparison.fake_llm_server import fake_answer, serve
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def start(**settings):
+        server, url = serve(**settings)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_injected_errors_are_retried(make_server):
+    server, url = make_server(first_token_ms=0, token_ms=0, tokens=5, error_rate=0.3, seed=1)
+    prompts = [f"Question number {i}" for i in range(20)]
+
+    async def scenario():
+        llm = LLMClient.from_credentials("openai", url, "fake", max_retries=8, backoff=0.001)
+        try:
+            return await asyncio.gather(*(llm.ainvoke(prompt) for prompt in prompts)), llm.stats()
+        finally:
+            await llm.aclose()
+
+    answers, stats = asyncio.run(scenario())
+    assert answers == ["".join(fake_answer(prompt, 5)) for prompt in prompts]
+    assert server.stats["errors"] > 0
+    assert stats["retries"] == server.stats["errors"]
+    assert stats["requests"] == server.stats["completions"]
+
+
+def test_identical_concurrent_prompts_share_one_request(make_server):
+    server, url = make_server(first_token_ms=200, token_ms=5, tokens=10)
+    prompt = "What is a vector database?"
+
+    async def scenario():
+        llm = LLMClient.from_credentials("openai", url, "fake")
+        try:
+            return await asyncio.gather(*(llm.ainvoke(prompt) for _ in range(8))), llm.stats()
+        finally:
+            await llm.aclose()
+
+    answers, stats = asyncio.run(scenario())
+    assert answers == ["".join(fake_answer(prompt, 10))] * 8
+    assert server.stats["completions"] == 1
+    assert stats["requests"] == 1
+    assert stats["coalesced"] == 7
+
+
+class _BrokenStreamClient:
+    """Completions client whose streams fail, retryably, after their first token."""
+
+    def __init__(self):
+        self.completions = SimpleNamespace(create=self.create)
+        self.calls = 0
+
+    async def create(self, **request):
+        self.calls += 1
+
+        async def stream():
+            yield SimpleNamespace(choices=[SimpleNamespace(text="partial")])
+            raise openai.APIConnectionError(
+                request=httpx.Request("POST", "http://127.0.0.1/v1/completions"))
+
+        return stream()
+
+    async def close(self):
+        pass
+
+
+def test_stream_is_not_retried_after_a_token():
+    client = _BrokenStreamClient()
+    llm = LLMClient(client, "fake", backoff=0.001)
+
+    async def scenario():
+        tokens = []
+        with pytest.raises(openai.APIConnectionError):
+            async for token in llm.astream("A prompt"):
+                tokens.append(token)
+        return tokens
+
+    assert asyncio.run(scenario()) == ["partial"]
+    assert client.calls == 1
+    assert llm.stats()["retries"] == 0
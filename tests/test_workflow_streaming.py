@@ -0,0 +1,93 @@
+"""
+Streaming of the RAG workflow against the local fake LLM server.
+
+The server streams its first token after FIRST_TOKEN_MS and the others every
+TOKEN_MS, so the timings of ``stream_answer`` can be checked end to end
+through the real OpenAI client (``utility.llm_client.LLMClient``).
+"""
+import asyncio
+import time
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from utility.answer_cache import SemanticAnswerCache
+from utility.llm_client import LLMClient
+from vectordatabases.comparison.fake_llm_server import serve
+from vectordatabases.faiss.faissworkflows import build_workflow, load_stores, stream_answer
+
+FIRST_TOKEN_MS = 300
+TOKEN_MS = 15
+TOKENS = 20
+QUERY = "What is Faiss used for?"
+
+
+@pytest.fixture
+def server():
+    server, url = serve(first_token_ms=FIRST_TOKEN_MS, token_ms=TOKEN_MS, tokens=TOKENS)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+def make_app(url: str, storage_dir, answer_cache=None):
+    embeddings = DeterministicFakeEmbedding(size=64)
+    vector_store, bm25_retriever = load_stores(embeddings, storage_dir=str(storage_dir),
+                                               answer_cache=answer_cache)
+    llm = LLMClient.from_credentials("openai", url, "fake")
+    app = build_workflow(vector_store, bm25_retriever, llm, answer_cache=answer_cache,
+                         embeddings=embeddings)
+    return app, llm
+
+
+async def collect(app, query: str):
+    """(tokens, final state, seconds to the first token, seconds to the end)."""
+    tokens, state, first_token = [], None, None
+    start = time.perf_counter()
+    async for kind, value in stream_answer(app, query):
+        if kind == "token":
+            first_token = first_token or time.perf_counter() - start
+            tokens.append(value)
+        else:
+            state = value
+    return tokens, state, first_token, time.perf_counter() - start
+
+
+def test_first_token_arrives_before_the_answer_completes(server, tmp_path):
+    _, url = server
+    app, llm = make_app(url, tmp_path)
+
+    async def scenario():
+        try:
+            # The first call pays the SDK import and the connection
+            await collect(app, "warm up")
+            return await collect(app, QUERY)
+        finally:
+            await llm.aclose()
+
+    tokens, state, first_token, total = asyncio.run(scenario())
+    assert len(tokens) == TOKENS
+    assert "".join(tokens) == state["final_answer"]
+    assert state["cache_hit"] is False
+    # TTFT follows the server's first token delay, not the whole completion
+    assert FIRST_TOKEN_MS / 1000 <= first_token < FIRST_TOKEN_MS / 1000 + 0.5
+    assert total - first_token >= (TOKENS - 1) * TOKEN_MS / 1000 * 0.8
+
+
+def test_answer_cache_hit_emits_one_token(server, tmp_path):
+    fake_server, url = server
+    answer_cache = SemanticAnswerCache()
+    app, llm = make_app(url, tmp_path, answer_cache=answer_cache)
+
+    async def scenario():
+        try:
+            return await collect(app, QUERY), await collect(app, QUERY)
+        finally:
+            await llm.aclose()
+
+    (first_tokens, first, _, _), (tokens, state, _, _) = asyncio.run(scenario())
+    assert first["cache_hit"] is False
+    assert state["cache_hit"] is True
+    assert tokens == [first["final_answer"]]
+    assert state["final_answer"] == "".join(first_tokens)
+    assert fake_server.stats["completions"] == 1
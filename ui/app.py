@@ -1,5 +1,14 @@
+import asyncio
+import queue
+import threading
+import time
+
 import streamlit as st
 
+from utility.answer_cache import SemanticAnswerCache
+from vectordatabases.faiss.faissworkflows import (build_clients, build_workflow, load_stores,
+                                                  stream_answer)
+
 st.title("RAG Similarity Search Agent")
 
 if "llm_url" not in st.session_state:
@@ -8,6 +17,8 @@ if "llm_access_key" not in st.session_state:
     st.session_state.llm_access_key = ""
 if "llm_type" not in st.session_state:
     st.session_state.llm_type = ""
+if "messages" not in st.session_state:
+    st.session_state.messages = []
 
 with st.sidebar:
     st.header("Api Credentials")
@@ -26,3 +37,81 @@ with st.sidebar:
 
     st.divider()
 
+
+@st.cache_resource
+def event_loop():
+    """One loop for the whole server: the async OpenAI clients keep their connections on it."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+@st.cache_resource
+def load_workflow(llm_type: str, llm_url: str, llm_key: str):
+    """One pooled LLM client and workflow per set of credentials, shared by all sessions."""
+    llm, embeddings = build_clients(llm_type, llm_url, llm_key)
+    answer_cache = SemanticAnswerCache()
+    vector_store, bm25_retriever = load_stores(embeddings, answer_cache=answer_cache)
+    return build_workflow(vector_store, bm25_retriever, llm, answer_cache=answer_cache)
+
+
+def stream_events(app, query: str):
+    """Runs stream_answer on the shared loop and yields its events in this script thread."""
+    events = queue.Queue()
+
+    async def pump():
+        try:
+            async for event in stream_answer(app, query):
+                events.put(event)
+        except Exception as error:
+            events.put(("error", error))
+        finally:
+            events.put(None)
+
+    asyncio.run_coroutine_threadsafe(pump(), event_loop())
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        if event[0] == "error":
+            raise event[1]
+        yield event
+
+
+for message in st.session_state.messages:
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+
+if not st.session_state.llm_access_key:
+    st.info("Submit the API credentials in the sidebar to start asking questions.")
+elif query := st.chat_input("Ask a question about the indexed documents"):
+    st.session_state.messages.append({"role": "user", "content": query})
+    with st.chat_message("user"):
+        st.markdown(query)
+
+    app = load_workflow(st.session_state.llm_type, st.session_state.llm_url,
+                        st.session_state.llm_access_key)
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        answer, state, first_token = "", None, None
+        start = time.perf_counter()
+        # Partial output is rendered as every token arrives
+        for kind, value in stream_events(app, query):
+            if kind == "token":
+                first_token = first_token or time.perf_counter() - start
+                answer += value
+                placeholder.markdown(answer + "▌")
+            else:
+                state = value
+        placeholder.markdown(answer)
+        total = time.perf_counter() - start
+        context_stats = (state or {}).get("context_stats") or {}
+        st.caption(f"First token after {(first_token or total) * 1000:.0f} ms, "
+                   f"answer after {total * 1000:.0f} ms, "
+                   f"context {context_stats.get('tokens', 0)} tokens "
+                   f"({context_stats.get('tokens_saved', 0)} saved)"
+                   + (" (cached)" if state and state.get("cache_hit") else ""))
+        with st.expander("Sources"):
+            for doc in (state or {}).get("context", []):
+                st.markdown(f"- {doc.page_content} `{doc.metadata.get('rerank_score', 0):.4f}`")
+    st.session_state.messages.append({"role": "assistant", "content": answer})
@@ -1,31 +1,619 @@
+"""
+@description:
+SelfFaiss - a small persistent FAISS store used by the faiss examples.
+
+Documents are written as append-only segments. Every call to ``store`` encodes
+only the documents that are not yet in the store, writes them to a new segment
+file and then commits the segment by atomically replacing ``manifest.json``.
+A crash before the manifest is replaced leaves the previous state untouched;
+segment files that are not listed in the manifest are simply ignored.
+
+Every document has a stable external id, assigned in order by ``store`` or
+chosen by the caller with ``upsert``; search results and ``get_text`` use
+these ids. ``upsert`` writes the new version to a new segment and ``delete``
+only sets a bit in the tombstone bitmap of the segment holding the old row,
+searches skip tombstoned rows through a faiss ``IDSelector``. ``compact``
+(run in the background once ``compact_threshold`` of the rows are deleted)
+merges all segments into one holding only the live rows and rewrites the doc
+store, reclaiming the space.
+
+Documents can carry a metadata dict (``store(docs, metadatas)``), kept row by
+row in a columnar ``MetadataStore``. ``search(..., filter={...})`` compiles
+the filter to a row bitmap and hands it to faiss together with the
+tombstones, so only matching live rows are scored.
+
+Layout under ``faiss_storage/<faiss_app>/``:
+----------------------------------------------
+File                    Description
+----------------------  --------------------------------------------------
+manifest.json           Committed segments, dimension, counts and next id.
+seg-000001.index        FAISS index holding the vectors of one segment.
+seg-000001.hash         Content hashes of the segment docs (dedupe on reload).
+seg-000001.ids          External id of every segment row (int64).
+seg-000001.del-000004   Tombstone bitmap of the segment, one file per commit.
+docs.offsets/docs.blob  Memory-mapped row -> text store (only with store_mappings),
+                        docs-NNNNNN.* after a compaction.
+meta.schema.json        Metadata fields and row count, meta.fNNN.col their columns,
+                        meta-NNNNNN.* after a compaction.
+
+"""
+import bisect
+import hashlib
+import json
 import os.path
+import threading
+from collections import Counter
+
+import numpy as np
+
+from utility.batcher import MicroBatcher
+from utility.docstore import DocStore
+from utility.embedding_cache import EmbeddingCache
+from utility.metadata import MetadataStore, selector
+from utility.models import DEFAULT_MODEL_NAME, get_model, lazy_import
+
+# faiss and the embedding model are only loaded once they are first used
+faiss = lazy_import("faiss")
+
+MODEL_NAME = DEFAULT_MODEL_NAME
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+def _text_hash(text: str) -> int:
+    """Returns a stable 64 bit hash of a document text."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _atomic_write_bytes(path: str, data: bytes):
+    """Writes data to a temp file next to path and renames it into place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 
-import faiss
-from sentence_transformers import SentenceTransformer
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
 
-class SelfFaiss(faiss):
-    def __init__(self, persist=False, store_mappings=False, faiss_app:str=""):
+
+def _deleted_mask(tombstones: np.ndarray, count: int) -> np.ndarray:
+    return np.unpackbits(tombstones, count=count, bitorder="little").astype(bool)
+
+
+def _atomic_write_index(index, path: str):
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    _fsync_file(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class SelfFaiss:
+    def __init__(self, persist=False, store_mappings=False, faiss_app:str="",
+                 storage_root:str="faiss_storage", cache_embeddings=False,
+                 model_name:str=MODEL_NAME, compact_threshold:float=0.3):
         self.persist = persist
         self.store_mapping = store_mappings
         if persist and faiss_app.strip()=="":
-            raise FileNotFoundError(f"Specify App name to use persistence.")
-        self.faiss_storage = f"faiss_storage/{faiss_app}.bin"
+            raise FileNotFoundError("Specify App name to use persistence.")
+        self.faiss_storage = os.path.join(storage_root, faiss_app)
+        self.manifest_path = os.path.join(self.faiss_storage, MANIFEST_NAME)
+
+        self.model_name = model_name
+        # Known from the manifest on load, otherwise from the model on first store
+        self.dimension = None
+        self.cache_embeddings = cache_embeddings
+        self.cache_dir = os.path.join(storage_root, "embedding_cache")
+        self._embedding_cache = None
+        # Share of deleted rows that starts a background compaction, None disables it
+        self.compact_threshold = compact_threshold
+
+        # Segments are kept in commit order, rows are global across segments
+        # and numbered in write order, external ids map to the live row
+        self.segments: list[dict] = []
+        self.indexes: list = []
+        self.segment_ids: list[np.ndarray] = []
+        self.segment_hashes: list[np.ndarray] = []
+        self.tombstones: list[np.ndarray] = []
+        self.id_rows: dict[int, int] = {}
+        self.docstore = None
+        self.docs_name = "docs"
+        self.texts: list[str] = []
+        self.metadata = None
+        self.meta_name = "meta"
+        self.hashes: Counter = Counter()
+        self.nrows = 0
+        self.next_id = 0
+        self.next_segment = 1
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._compaction = None
+
+        self.storage_exists = self.persist and os.path.exists(self.manifest_path)
+        if self.storage_exists:
+            self.load()
+        else:
+            self.metadata = MetadataStore(self._meta_path(self.meta_name))
+            if self.store_mapping and self.persist:
+                self.docstore = DocStore(os.path.join(self.faiss_storage, self.docs_name))
+
+    @property
+    def model(self):
+        """The shared embedding model, loaded on first use."""
+        return get_model(self.model_name)
+
+    @property
+    def embedding_cache(self):
+        # Shared with every other user of the same storage root and model
+        if self.cache_embeddings and self._embedding_cache is None:
+            if self.dimension is None:
+                self.dimension = self.model.get_sentence_embedding_dimension()
+            self._embedding_cache = EmbeddingCache(self.model_name, self.dimension,
+                                                   cache_dir=self.cache_dir)
+        return self._embedding_cache
+
+    @property
+    def ntotal(self) -> int:
+        """Number of live documents."""
+        return len(self.id_rows)
+
+    def _segment_path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.faiss_storage, f"{name}.{suffix}")
+
+    def _meta_path(self, name: str):
+        return os.path.join(self.faiss_storage, name) if self.persist else None
+
+    def load(self):
+        """Loads the committed segments listed in the manifest."""
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["version"] not in (1, MANIFEST_VERSION):
+            raise ValueError(f"Unsupported manifest version: {manifest['version']}")
+        self.dimension = manifest["dimension"]
+        # Version 1 stores have no ids or tombstones, ids are the row numbers
+        self.nrows = manifest.get("rows", manifest["ntotal"])
+        self.next_id = manifest.get("next_id", self.nrows)
+        self.next_segment = manifest.get("next_segment", len(manifest["segments"]) + 1)
+        self.generation = manifest.get("generation", 0)
+        self.docs_name = manifest.get("docs", "docs")
+        self.meta_name = manifest.get("meta", "meta")
+
+        for segment in manifest["segments"]:
+            name, count = segment["name"], segment["ntotal"]
+            self.indexes.append(faiss.read_index(self._segment_path(name, "index")))
+            self.segment_hashes.append(np.fromfile(self._segment_path(name, "hash"),
+                                                   dtype=np.int64))
+            ids_path = self._segment_path(name, "ids")
+            self.segment_ids.append(np.fromfile(ids_path, dtype=np.int64)
+                                    if os.path.exists(ids_path) else
+                                    np.arange(segment["start"], segment["start"] + count,
+                                              dtype=np.int64))
+            tombstones = segment.get("tombstones")
+            self.tombstones.append(
+                np.fromfile(os.path.join(self.faiss_storage, tombstones), dtype=np.uint8)
+                if tombstones else np.zeros((count + 7) // 8, dtype=np.uint8))
+            segment.setdefault("deleted", 0)
+            self.segments.append(segment)
+        self._rebuild_maps()
+        # Rolls back uncommitted rows, stores without metadata get empty rows
+        self.metadata = MetadataStore(self._meta_path(self.meta_name))
+        self.metadata.resize(self.nrows)
+        if self.store_mapping:
+            self.docstore = DocStore(os.path.join(self.faiss_storage, self.docs_name))
+            # Texts appended after the last committed manifest are rolled back
+            self.docstore.truncate(self.nrows)
 
-        if not os.path.exists(self.faiss_storage):
-            self.storage_exists = False
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+    def _rebuild_maps(self):
+        self.id_rows, self.hashes = {}, Counter()
+        for segment, ids, hashes, tombstones in zip(self.segments, self.segment_ids,
+                                                    self.segment_hashes, self.tombstones):
+            live = np.flatnonzero(~_deleted_mask(tombstones, segment["ntotal"]))
+            self.id_rows.update(zip(ids[live].tolist(), (live + segment["start"]).tolist()))
+            self.hashes.update(hashes[live].tolist())
 
-    def store(self, file):
+    def _write_manifest(self):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "dimension": self.dimension,
+            "ntotal": self.ntotal,
+            "rows": self.nrows,
+            "next_id": self.next_id,
+            "next_segment": self.next_segment,
+            "generation": self.generation,
+            "docs": self.docs_name,
+            "meta": self.meta_name,
+            "segments": self.segments,
+        }
+        _atomic_write_bytes(self.manifest_path,
+                            json.dumps(manifest, indent=2).encode("utf-8"))
 
+    def _commit(self, dirty: set[int] = frozenset()):
+        """Writes the tombstones of the dirty segments, then the manifest."""
+        if not self.persist:
+            return
+        self.generation += 1
+        stale = []
+        for position in dirty:
+            segment = self.segments[position]
+            name = f"{segment['name']}.del-{self.generation:06d}"
+            _atomic_write_bytes(os.path.join(self.faiss_storage, name),
+                                self.tombstones[position].tobytes())
+            if segment.get("tombstones"):
+                stale.append(os.path.join(self.faiss_storage, segment["tombstones"]))
+            segment["tombstones"] = name
+        self._write_manifest()
+        self.storage_exists = True
+        # Superseded bitmaps are only removed once the new manifest is in place
+        _remove_files(stale)
 
-        document_vectors = \
-            self.model.encode(documents, convert_to_numpy=True).astype('float32')
+    def _locate(self, row: int) -> tuple[int, int]:
+        """Returns (segment position, row inside the segment) of a global row."""
+        position = bisect.bisect_right([s["start"] for s in self.segments], row) - 1
+        return position, row - self.segments[position]["start"]
 
-        index = None
+    def _tombstone(self, row: int) -> int:
+        position, local = self._locate(row)
+        self.tombstones[position][local >> 3] |= np.uint8(1 << (local & 7))
+        self.segments[position]["deleted"] += 1
+        text_hash = int(self.segment_hashes[position][local])
+        self.hashes[text_hash] -= 1
+        if self.hashes[text_hash] <= 0:
+            del self.hashes[text_hash]
+        return position
+
+    def _encode(self, documents: list[str]) -> np.ndarray:
+        if self.embedding_cache is not None:
+            document_vectors = self.embedding_cache.encode(self.model, documents)
+        else:
+            document_vectors = \
+                self.model.encode(documents, convert_to_numpy=True).astype('float32')
+        if self.dimension is None:
+            self.dimension = document_vectors.shape[1]
+        elif document_vectors.shape[1] != self.dimension:
+            raise ValueError(f"Stored dimension {self.dimension} does not match "
+                             f"model dimension {document_vectors.shape[1]}.")
+        return document_vectors
+
+    def _add_segment(self, documents: list[str], vectors: np.ndarray, ids: list[int],
+                     hashes: list[int], metadatas: list[dict] = None):
+        index = faiss.IndexFlatL2(self.dimension)
+        index.add(vectors)
+
+        segment = {
+            "name": f"seg-{self.next_segment:06d}",
+            "start": self.nrows,
+            "ntotal": index.ntotal,
+            "deleted": 0,
+        }
+        ids = np.asarray(ids, dtype=np.int64)
+        hashes = np.asarray(hashes, dtype=np.int64)
         if self.persist:
-            if self.storage_exists:
-                index = self.read_index(self.faiss_storage)
+            # Segment files first, the manifest replace is the commit point
+            os.makedirs(self.faiss_storage, exist_ok=True)
+            name = segment["name"]
+            _atomic_write_index(index, self._segment_path(name, "index"))
+            _atomic_write_bytes(self._segment_path(name, "hash"), hashes.tobytes())
+            _atomic_write_bytes(self._segment_path(name, "ids"), ids.tobytes())
+            if self.docstore is not None:
+                self.docstore.truncate(self.nrows)
+                self.docstore.append(documents)
+        elif self.store_mapping:
+            self.texts.extend(documents)
+        self.metadata.resize(self.nrows)
+        self.metadata.append(metadatas or [{}] * len(documents))
+
+        self.segments.append(segment)
+        self.indexes.append(index)
+        self.segment_ids.append(ids)
+        self.segment_hashes.append(hashes)
+        self.tombstones.append(np.zeros((index.ntotal + 7) // 8, dtype=np.uint8))
+        self.id_rows.update(zip(ids.tolist(), range(self.nrows, self.nrows + index.ntotal)))
+        self.hashes.update(hashes.tolist())
+        self.next_segment += 1
+        self.nrows += index.ntotal
+
+    def store(self, documents: list[str], metadatas: list[dict] = None) -> int:
+        """Encodes and appends the documents not yet stored, returns the count added.
+
+        New documents get the next free ids, in order.
+        """
+        if metadatas is not None and len(metadatas) != len(documents):
+            raise ValueError(f"Got {len(metadatas)} metadatas for {len(documents)} documents.")
+        metadatas = metadatas or [{}] * len(documents)
+        with self._lock:
+            new_docs, new_hashes, new_metadatas, seen = [], [], [], set()
+            for doc, metadata in zip(documents, metadatas):
+                doc_hash = _text_hash(doc)
+                if doc_hash in self.hashes or doc_hash in seen:
+                    continue
+                seen.add(doc_hash)
+                new_docs.append(doc)
+                new_hashes.append(doc_hash)
+                new_metadatas.append(metadata)
+            if not new_docs:
+                return 0
+
+            vectors = self._encode(new_docs)
+            ids = list(range(self.next_id, self.next_id + len(new_docs)))
+            self.next_id += len(new_docs)
+            self._add_segment(new_docs, vectors, ids, new_hashes, new_metadatas)
+            self._commit()
+            return len(new_docs)
+
+    def upsert(self, ids: list[int], documents: list[str], metadatas: list[dict] = None) -> int:
+        """Stores documents under the given ids, replacing what they held before.
+
+        Documents whose text and metadata are unchanged are skipped, returns
+        the count written.
+        """
+        if len(ids) != len(documents):
+            raise ValueError(f"Got {len(ids)} ids for {len(documents)} documents.")
+        if metadatas is not None and len(metadatas) != len(documents):
+            raise ValueError(f"Got {len(metadatas)} metadatas for {len(documents)} documents.")
+        metadatas = [m or {} for m in metadatas] if metadatas else [{}] * len(documents)
+        with self._lock:
+            # The last document given for an id wins
+            latest = dict(zip((int(i) for i in ids), zip(documents, metadatas)))
+            changed = {}
+            for doc_id, (doc, metadata) in latest.items():
+                doc_hash = _text_hash(doc)
+                row = self.id_rows.get(doc_id)
+                if row is not None:
+                    position, local = self._locate(row)
+                    if self.segment_hashes[position][local] == doc_hash and \
+                            self.metadata.get(row) == metadata:
+                        continue
+                changed[doc_id] = (doc, doc_hash, metadata)
+            if not changed:
+                return 0
+
+            new_docs = [doc for doc, _, _ in changed.values()]
+            vectors = self._encode(new_docs)
+            dirty = {self._tombstone(self.id_rows.pop(doc_id))
+                     for doc_id in changed if doc_id in self.id_rows}
+            self._add_segment(new_docs, vectors, list(changed),
+                              [doc_hash for _, doc_hash, _ in changed.values()],
+                              [metadata for _, _, metadata in changed.values()])
+            self.next_id = max(self.next_id, max(changed) + 1)
+            self._commit(dirty)
+        self._maybe_compact()
+        return len(changed)
+
+    def delete(self, ids: list[int]) -> int:
+        """Tombstones the documents with the given ids, returns the count deleted."""
+        with self._lock:
+            rows = [self.id_rows.pop(doc_id) for doc_id in {int(i) for i in ids}
+                    if doc_id in self.id_rows]
+            dirty = {self._tombstone(row) for row in rows}
+            if dirty:
+                self._commit(dirty)
+        self._maybe_compact()
+        return len(rows)
+
+    def _maybe_compact(self):
+        deleted = self.nrows - self.ntotal
+        if self.compact_threshold is not None and self.nrows and \
+                deleted / self.nrows >= self.compact_threshold:
+            self.compact(background=True)
+
+    def compact(self, background: bool = False):
+        """Rewrites all segments as one holding only live rows, and the doc store with them.
+
+        In the background, searches and writes keep running on the old segments
+        until the compacted one is swapped in.
+        """
+        if self._compaction is not None and self._compaction.is_alive():
+            if not background:
+                self._compaction.join()
+            return
+        if not background:
+            self._compact()
+            return
+        self._compaction = threading.Thread(target=self._compact, name="faiss-compaction",
+                                            daemon=True)
+        self._compaction.start()
+
+    def _compact(self):
+        with self._lock:
+            if self.nrows == self.ntotal and len(self.segments) <= 1:
+                return
+            snapshot = list(zip(self.segments, self.indexes, self.segment_ids,
+                                self.segment_hashes, [t.copy() for t in self.tombstones]))
+            snapshot_rows = self.nrows
+            name = f"seg-{self.next_segment:06d}"
+            docs_name = f"docs-{self.next_segment:06d}"
+            meta_name = f"meta-{self.next_segment:06d}"
+            self.next_segment += 1
+
+        # Copy the live rows out of the old segments without holding the lock,
+        # the segment indexes never change once written
+        lives, vectors, ids, hashes = [], [], [], []
+        for segment, index, seg_ids, seg_hashes, tombstones in snapshot:
+            live = np.flatnonzero(~_deleted_mask(tombstones, segment["ntotal"]))
+            lives.append(live)
+            vectors.append(index.reconstruct_n(0, index.ntotal)[live])
+            ids.append(seg_ids[live])
+            hashes.append(seg_hashes[live])
+        rows = np.concatenate([live + s["start"] for live, (s, *_) in zip(lives, snapshot)])
+        ids, hashes = np.concatenate(ids), np.concatenate(hashes)
+        live_count = len(rows)
+        compacted = None
+        if live_count:
+            compacted = faiss.IndexFlatL2(self.dimension)
+            compacted.add(np.concatenate(vectors))
+            if self.persist:
+                os.makedirs(self.faiss_storage, exist_ok=True)
+                _atomic_write_index(compacted, self._segment_path(name, "index"))
+                _atomic_write_bytes(self._segment_path(name, "hash"), hashes.tobytes())
+                _atomic_write_bytes(self._segment_path(name, "ids"), ids.tobytes())
+        docstore, texts = None, []
+        if self.store_mapping and self.persist:
+            docstore = DocStore(os.path.join(self.faiss_storage, docs_name))
+            docstore.truncate(0)
+            for start in range(0, live_count, 10000):
+                # The old doc store is remapped by concurrent appends, read under the lock
+                with self._lock:
+                    batch = [self.docstore[int(row)] for row in rows[start:start + 10000]]
+                docstore.append(batch)
+        elif self.store_mapping:
+            texts = [self.texts[int(row)] for row in rows]
+        with self._lock:
+            metadata = self.metadata.take(rows, self._meta_path(meta_name))
+
+        with self._lock:
+            segments = [{"name": name, "start": 0, "ntotal": live_count}] if live_count else []
+            indexes, segment_ids, segment_hashes = [compacted], [ids], [hashes]
+            # Rows deleted while the compacted segment was being built
+            deleted = np.concatenate([_deleted_mask(self.tombstones[position], s["ntotal"])[live]
+                                      for position, (live, (s, *_)) in
+                                      enumerate(zip(lives, snapshot))])
+            tombstones = [np.packbits(deleted, bitorder="little")]
+            if live_count:
+                segments[0]["deleted"] = int(deleted.sum())
+            else:
+                indexes, segment_ids, segment_hashes, tombstones = [], [], [], []
+            # Segments committed while compacting keep their files, their rows move up
+            for position in range(len(snapshot), len(self.segments)):
+                segment = dict(self.segments[position])
+                segment["start"] += live_count - snapshot_rows
+                segments.append(segment)
+                indexes.append(self.indexes[position])
+                segment_ids.append(self.segment_ids[position])
+                segment_hashes.append(self.segment_hashes[position])
+                tombstones.append(self.tombstones[position])
+            tail = range(snapshot_rows, self.nrows)
+            if docstore is not None:
+                docstore.append([self.docstore[row] for row in tail])
+            elif self.store_mapping:
+                texts.extend(self.texts[row] for row in tail)
+            metadata.append([self.metadata.get(row) for row in tail])
+
+            old_docstore, old_metadata = self.docstore, self.metadata
+            old_files = [self._segment_path(s["name"], suffix) for s, *_ in snapshot
+                         for suffix in ("index", "hash", "ids")]
+            old_files += [os.path.join(self.faiss_storage, s["tombstones"])
+                          for s, *_ in snapshot if s.get("tombstones")]
+            self.segments, self.indexes = segments, indexes
+            self.segment_ids, self.segment_hashes = segment_ids, segment_hashes
+            self.tombstones = tombstones
+            self.nrows = live_count + len(tail)
+            if docstore is not None:
+                self.docstore, self.docs_name = docstore, docs_name
             else:
-                index = faiss.IndexFlatL2(d)
-            pass
-    pass
+                self.texts = texts
+            self.metadata, self.meta_name = metadata, meta_name
+            self._rebuild_maps()
+            self._commit({0} if live_count and segments[0]["deleted"] else set())
+            if self.persist:
+                # The old files are only unreachable once the new manifest is in place
+                if old_docstore is not None:
+                    old_docstore.close()
+                    old_files += [old_docstore.offsets_path, old_docstore.blob_path]
+                old_files += old_metadata.files()
+                _remove_files(old_files)
+
+    def search_vectors(self, query_vectors: np.ndarray, k: int = 3, filter: dict = None):
+        """Searches every segment and merges them into (distances, external ids).
+
+        With a metadata filter only the matching rows are scored.
+        """
+        nq = query_vectors.shape[0]
+        with self._lock:
+            segments = list(zip(self.segments, self.indexes, self.segment_ids,
+                                self.tombstones))
+            matches = self.metadata.mask(filter) if filter else None
+        if not segments:
+            return (np.full((nq, k), np.inf, dtype="float32"),
+                    np.full((nq, k), -1, dtype="int64"))
+
+        all_dist, all_ids = [], []
+        for segment, index, seg_ids, tombstones in segments:
+            if segment["deleted"] >= segment["ntotal"]:
+                continue
+            params = None
+            if matches is not None:
+                selected = matches[segment["start"]:segment["start"] + segment["ntotal"]] & \
+                    ~_deleted_mask(tombstones, segment["ntotal"])
+                if not selected.any():
+                    continue
+                sel = selector(selected)
+                params = faiss.SearchParameters(sel=sel)
+            elif segment["deleted"]:
+                # Tombstoned rows are skipped inside the scan, k live hits come back
+                deleted = faiss.IDSelectorBitmap(len(tombstones), faiss.swig_ptr(tombstones))
+                params = faiss.SearchParameters(sel=faiss.IDSelectorNot(deleted))
+            dist, ids = index.search(query_vectors, k, params=params)
+            all_dist.append(dist)
+            all_ids.append(np.where(ids >= 0, seg_ids[np.maximum(ids, 0)], -1))
+        if not all_dist:
+            return (np.full((nq, k), np.inf, dtype="float32"),
+                    np.full((nq, k), -1, dtype="int64"))
+        dist = np.concatenate(all_dist, axis=1)
+        ids = np.concatenate(all_ids, axis=1)
+        dist = np.where(ids >= 0, dist, np.inf)
+
+        order = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        return (np.take_along_axis(dist, order, axis=1),
+                np.take_along_axis(ids, order, axis=1))
+
+    def get_text(self, idx: int) -> str:
+        """Returns the text stored under an external id (requires store_mappings)."""
+        if not self.store_mapping:
+            raise ValueError("Texts are only kept when store_mappings is enabled.")
+        with self._lock:
+            row = self.id_rows.get(int(idx))
+            if row is None:
+                raise IndexError(f"Id {idx} is not present in the store.")
+            if self.docstore is not None:
+                return self.docstore[row]
+            return self.texts[row]
+
+    def get_metadata(self, idx: int) -> dict:
+        """Returns the metadata stored under an external id."""
+        with self._lock:
+            row = self.id_rows.get(int(idx))
+            if row is None:
+                raise IndexError(f"Id {idx} is not present in the store.")
+            return self.metadata.get(row)
+
+    def search_many(self, query_texts: list[str], k: int = 3, batch_size: int = 64,
+                    filter: dict = None):
+        """Returns the k nearest (id, distance) pairs for every query.
+
+        All queries go through one batched encode and one matrix search; with a
+        metadata filter every hit matches it.
+        """
+        if not query_texts:
+            return []
+        query_vectors = self.model.encode(query_texts, batch_size=batch_size,
+                                          convert_to_numpy=True).astype('float32')
+        distances, indices = self.search_vectors(query_vectors, k, filter=filter)
+        return [[(int(idx), float(dist)) for idx, dist in zip(row_ids, row_dist) if idx >= 0]
+                for row_ids, row_dist in zip(indices, distances)]
+
+    def search(self, query_text: str, k: int = 3, filter: dict = None):
+        """Returns the k nearest (id, distance) pairs for a single query."""
+        return self.search_many([query_text], k, filter=filter)[0]
+
+    def micro_batcher(self, max_batch_size: int = 32, max_wait_ms: float = 5.0) -> MicroBatcher:
+        """Returns a MicroBatcher that serves concurrent (query_text, k) requests.
+
+        Each batch runs one search_many with the largest k asked for and trims
+        the results per caller.
+        """
+        def run_batch(requests):
+            max_k = max(k for _, k in requests)
+            results = self.search_many([query_text for query_text, _ in requests], max_k)
+            return [result[:k] for (_, k), result in zip(requests, results)]
+
+        return MicroBatcher(run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
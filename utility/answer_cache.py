@@ -0,0 +1,118 @@
+"""
+@description:
+SemanticAnswerCache - reuses LLM answers for repeated and near-duplicate questions.
+
+An answer is cached under two keys: the query embedding and the documents
+it was generated from. A later query gets the cached answer only when both
+of these hold:
+
+Condition               Check
+----------------------  -----------------------------------------------------
+Same question           cosine(query vector, cached vector) >= threshold
+Same context            the retrieved documents match, same texts, same order
+
+The documents are identified by a 64 bit hash of their text
+(``utility.embedding_cache.text_keys``). So when an index change alters
+what a query retrieves, or edits one of the retrieved texts, that query
+misses on its own. ``invalidate`` covers the other changes: with texts it
+drops the answers built on any of them (say, deleted documents), without
+it drops everything (say, a new prompt or model).
+
+Entries expire ``ttl`` seconds after they were stored. Beyond
+``max_entries`` the least recently used one is evicted. The cache lives in
+memory and is safe to share between threads and concurrent graph runs.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utility.embedding_cache import text_keys
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600.0, max_entries: int = 1024,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._by_context: dict[tuple, set] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def context_key(texts: list[str]) -> tuple:
+        return tuple(text_keys(texts).tolist())
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_context[entry["context"]]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_context[entry["context"]]
+
+    def get(self, query_vector, texts: list[str]):
+        """The cached answer for a similar query over the same texts, or None."""
+        vector = _unit(query_vector)
+        context = self.context_key(texts)
+        now = self.clock()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_context.get(context, ())):
+                entry = self._entries[entry_id]
+                if entry["expires"] <= now:
+                    self._drop(entry_id)
+                    continue
+                score = float(entry["vector"] @ vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id]["answer"]
+
+    def put(self, query_vector, texts: list[str], answer):
+        context = self.context_key(texts)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {"vector": _unit(query_vector), "context": context,
+                                       "answer": answer, "expires": self.clock() + self.ttl}
+            self._by_context.setdefault(context, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, texts: list[str] = None) -> int:
+        """Drops the answers built on any of texts (all answers when None), returns the count."""
+        with self._lock:
+            if texts is None:
+                count = len(self._entries)
+                self._entries.clear()
+                self._by_context.clear()
+                return count
+            stale = set(text_keys(texts).tolist())
+            dropped = [entry_id for entry_id, entry in self._entries.items()
+                       if stale.intersection(entry["context"])]
+            for entry_id in dropped:
+                self._drop(entry_id)
+            return len(dropped)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,106 @@
+"""
+@description:
+MicroBatcher - collects concurrent single requests into one batched call.
+
+Encoding one query and searching one row at a time leaves the encoder and
+FAISS (BLAS) mostly idle. The batcher holds incoming requests for at most
+``max_wait_ms`` or until ``max_batch_size`` are queued, runs ``batch_fn`` once
+on the whole list and hands every caller its own result:
+
+    batcher = MicroBatcher(lambda queries: store.search_many(queries, k=3))
+    results = batcher.submit("AI is changing industries.")   # from any thread
+
+``batch_fn`` receives a list of items and must return one result per item in
+the same order. An exception raised by it is re-raised to every caller of
+that batch.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit_async(self, item) -> Future:
+        """Queues item and returns a Future for its result."""
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed.")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit(self, item, timeout: float = None):
+        """Queues item and blocks until its batch has run."""
+        return self.submit_async(item).result(timeout)
+
+    def close(self):
+        """Runs the requests already queued and stops the worker thread."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _collect(self):
+        """Blocks for the first request, then gathers more until full or timed out."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 \
+                    else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            # Cancelled callers are dropped before the batch runs
+            batch = [(item, future) for item, future in batch
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"batch_fn returned {len(results)} results "
+                                     f"for {len(batch)} items.")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,274 @@
+"""
+@description:
+BM25Index - a persistent, incrementally updated BM25 keyword index.
+
+Texts are tokenized once, when they are added. Their postings go to an
+immutable segment in CSR form: for every term id, a slice of doc ids (int32)
+and term frequencies (uint16). Opening an index memory maps the segments, so
+nothing is re-tokenized or rebuilt at startup. Document frequencies come from
+the segment offsets, and the IDF of every term is precomputed from them
+after each add:
+
+    idf(t)   = ln(1 + (N - df(t) + 0.5) / (df(t) + 0.5))
+    score(d) = sum over query terms of
+               idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(d) / avgdl))
+
+A query only reads the postings of its own terms. Terms are scored in order
+of their best possible contribution. Once the terms left cannot lift a new
+document above the current k-th score, they only update documents that are
+already candidates (MaxScore pruning). The top k then come from
+``argpartition``.
+
+Files under ``directory``:
+----------------------------------------------------------------
+File                     Description
+-----------------------  ---------------------------------------------
+bm25.json                Committed counts, parameters and segments.
+vocab.txt                One term per line, the line number is the term id.
+doclens.bin              Token count of every document (uint32).
+seg-NNNNNN.offsets       int64 postings offsets per term id (CSR).
+seg-NNNNNN.docs/.tfs     Doc ids and term frequencies of the postings.
+docs.offsets/docs.blob   The texts (DocStore), when store_texts is set.
+
+Doc ids number the added texts from 0, in order, so an index filled in
+the same order as a faiss index shares its ids. Every ``max_segments`` adds
+the segments are merged into one.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+from utility.docstore import DocStore
+
+MANIFEST_NAME = "bm25.json"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased word tokens."""
+    return _TOKEN.findall(text.lower())
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _append(path: str, size: int, data: bytes):
+    """Writes data at byte size, dropping anything an uncommitted write left behind."""
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(size)
+        f.truncate()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class BM25Index:
+    def __init__(self, directory: str, k1: float = 1.5, b: float = 0.75,
+                 store_texts: bool = True, max_segments: int = 8):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.segments: list[dict] = []
+        self._postings: list[tuple] = []
+        self.vocab: dict[str, int] = {}
+        self._vocab_bytes = 0
+        self.doclens = np.zeros(0, dtype=np.uint32)
+        self.df = np.zeros(0, dtype=np.int64)
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.next_segment = 1
+        os.makedirs(directory, exist_ok=True)
+        self.docstore = DocStore(os.path.join(directory, "docs")) if store_texts else None
+        if os.path.exists(self.manifest_path):
+            self._load()
+        elif self.docstore is not None:
+            self.docstore.truncate(0)
+
+    def __len__(self) -> int:
+        return len(self.doclens)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open_segment(self, name: str) -> tuple:
+        return tuple(np.memmap(self._path(f"{name}.{suffix}"), dtype=dtype, mode="r")
+                     if os.path.getsize(self._path(f"{name}.{suffix}")) else np.zeros(0, dtype)
+                     for suffix, dtype in (("offsets", np.int64), ("docs", np.int32),
+                                           ("tfs", np.uint16)))
+
+    def _load(self):
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.k1, self.b = manifest["k1"], manifest["b"]
+        self.next_segment = manifest["next_segment"]
+        self._vocab_bytes = manifest["vocab_bytes"]
+        # Anything past the committed sizes belongs to an add that never committed
+        with open(self._path("vocab.txt"), "rb") as f:
+            terms = f.read(self._vocab_bytes).decode("utf-8").split("\n")[:-1]
+        self.vocab = {term: term_id for term_id, term in enumerate(terms)}
+        self.doclens = np.fromfile(self._path("doclens.bin"), dtype=np.uint32,
+                                   count=manifest["documents"])
+        self.segments = manifest["segments"]
+        self._postings = [self._open_segment(segment["name"]) for segment in self.segments]
+        if self.docstore is not None:
+            self.docstore.truncate(len(self.doclens))
+        self._update_idf()
+
+    def _update_idf(self):
+        self.df = np.zeros(len(self.vocab), dtype=np.int64)
+        for offsets, _, _ in self._postings:
+            counts = np.diff(offsets)
+            self.df[:len(counts)] += counts
+        n = max(len(self.doclens), 1)
+        self.idf = np.log1p((n - self.df + 0.5) / (self.df + 0.5)).astype(np.float32)
+        self.avgdl = float(self.doclens.mean()) if len(self.doclens) else 1.0
+
+    def _write_manifest(self):
+        manifest = {"k1": self.k1, "b": self.b, "documents": len(self.doclens),
+                    "vocab_bytes": self._vocab_bytes, "next_segment": self.next_segment,
+                    "segments": self.segments}
+        _atomic_write(self.manifest_path, json.dumps(manifest, indent=2).encode("utf-8"))
+
+    def _write_segment(self, term_ids: np.ndarray, doc_ids: np.ndarray,
+                       tfs: np.ndarray) -> dict:
+        """Writes postings (sorted by term id, then doc id) as a new CSR segment."""
+        name = f"seg-{self.next_segment:06d}"
+        self.next_segment += 1
+        offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocab)), out=offsets[1:])
+        _atomic_write(self._path(f"{name}.offsets"), offsets.tobytes())
+        _atomic_write(self._path(f"{name}.docs"), doc_ids.astype(np.int32).tobytes())
+        _atomic_write(self._path(f"{name}.tfs"),
+                      np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16).tobytes())
+        return {"name": name, "postings": int(len(doc_ids))}
+
+    def add(self, texts: list[str]) -> int:
+        """Indexes texts as the next doc ids, returns the id of the first one."""
+        first_id = len(self.doclens)
+        if not texts:
+            return first_id
+        new_terms, term_ids, doc_ids, tfs, lengths = [], [], [], [], []
+        for doc_id, text in enumerate(texts, start=first_id):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    term_id = self.vocab[token] = len(self.vocab)
+                    new_terms.append(token)
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_ids.extend(counts)
+            tfs.extend(counts.values())
+            doc_ids.extend([doc_id] * len(counts))
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        segment = self._write_segment(term_ids[order], np.asarray(doc_ids)[order],
+                                      np.asarray(tfs)[order])
+        vocab_data = "".join(f"{term}\n" for term in new_terms).encode("utf-8")
+        _append(self._path("vocab.txt"), self._vocab_bytes, vocab_data)
+        _append(self._path("doclens.bin"), first_id * 4,
+                np.asarray(lengths, dtype=np.uint32).tobytes())
+        if self.docstore is not None:
+            self.docstore.truncate(first_id)
+            self.docstore.append(texts)
+
+        # The manifest replace commits the add
+        self._vocab_bytes += len(vocab_data)
+        self.doclens = np.concatenate([self.doclens, np.asarray(lengths, dtype=np.uint32)])
+        self.segments.append(segment)
+        self._postings.append(self._open_segment(segment["name"]))
+        self._write_manifest()
+        if len(self.segments) > self.max_segments:
+            self.merge()
+        else:
+            self._update_idf()
+        return first_id
+
+    def merge(self):
+        """Merges all segments into one, fewer segments means fewer reads per term."""
+        if len(self.segments) <= 1:
+            self._update_idf()
+            return
+        term_ids, doc_ids, tfs = [], [], []
+        for offsets, docs, seg_tfs in self._postings:
+            term_ids.append(np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)))
+            doc_ids.append(np.asarray(docs))
+            tfs.append(np.asarray(seg_tfs))
+        term_ids = np.concatenate(term_ids)
+        # Segments hold increasing doc ids, a stable sort keeps them ordered per term
+        order = np.argsort(term_ids, kind="stable")
+        segment = self._write_segment(term_ids[order], np.concatenate(doc_ids)[order],
+                                      np.concatenate(tfs)[order])
+        old = [old_segment["name"] for old_segment in self.segments]
+        self.segments = [segment]
+        self._postings = [self._open_segment(segment["name"])]
+        self._write_manifest()
+        for name in old:
+            for suffix in ("offsets", "docs", "tfs"):
+                os.remove(self._path(f"{name}.{suffix}"))
+        self._update_idf()
+
+    def _term_postings(self, term_id: int):
+        docs, tfs = [], []
+        for offsets, seg_docs, seg_tfs in self._postings:
+            if term_id + 1 < len(offsets):
+                start, end = offsets[term_id], offsets[term_id + 1]
+                docs.append(seg_docs[start:end])
+                tfs.append(seg_tfs[start:end])
+        if not docs:
+            return np.zeros(0, np.int32), np.zeros(0, np.uint16)
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def search(self, query: str, k: int = 4) -> list[tuple[int, float]]:
+        """Returns the k best (doc id, score) pairs, best first."""
+        term_ids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab},
+                          key=lambda t: -self.idf[t])
+        if not term_ids or k <= 0:
+            return []
+        # Largest contribution a term can make to any document (tf -> infinity)
+        upper = [float(self.idf[t]) * (self.k1 + 1) for t in term_ids]
+        remaining = [sum(upper[i:]) for i in range(len(upper))] + [0.0]
+
+        cand_docs = np.zeros(0, np.int64)
+        cand_scores = np.zeros(0, np.float64)
+        for i, term_id in enumerate(term_ids):
+            docs, tfs = self._term_postings(term_id)
+            if len(cand_docs) >= k:
+                threshold = np.partition(cand_scores, len(cand_scores) - k)[len(cand_scores) - k]
+                if remaining[i] < threshold:
+                    # No document outside the candidates can reach the top k any more
+                    keep = np.isin(docs, cand_docs)
+                    docs, tfs = docs[keep], tfs[keep]
+            tfs = tfs.astype(np.float64)
+            norm = self.k1 * (1 - self.b + self.b * self.doclens[docs] / self.avgdl)
+            contrib = self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + norm)
+            all_docs = np.concatenate([cand_docs, docs.astype(np.int64)])
+            cand_docs, inverse = np.unique(all_docs, return_inverse=True)
+            cand_scores = np.bincount(inverse, weights=np.concatenate([cand_scores, contrib]),
+                                      minlength=len(cand_docs))
+
+        top = min(k, len(cand_docs))
+        best = np.argpartition(-cand_scores, top - 1)[:top]
+        best = best[np.argsort(-cand_scores[best], kind="stable")]
+        return [(int(cand_docs[i]), float(cand_scores[i])) for i in best]
+
+    def get_text(self, doc_id: int) -> str:
+        if self.docstore is None:
+            raise ValueError("Texts are only kept when store_texts is enabled.")
+        return self.docstore[doc_id]
+
+    def close(self):
+        self._postings = []
+        if self.docstore is not None:
+            self.docstore.close()
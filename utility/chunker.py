@@ -0,0 +1,160 @@
+"""
+@description:
+TokenChunker - packs sentences into chunks that fit the embedding model.
+
+Splitting page text on "." turns "e.g." into "e" and "g" and keeps page
+numbers, headers and empty strings as separate fragments, each costing an
+encoder forward pass and an index slot. The chunker instead:
+
+1. splits on sentence boundaries (., ! or ? followed by whitespace and an
+   upper case letter, digit or opening quote/bracket),
+2. drops fragments without any letters (blank lines, page numbers, rules),
+3. counts the word pieces of all sentences of a page in one batch call,
+4. greedily packs sentences into chunks of at most ``max_tokens`` and starts
+   the next chunk with up to ``overlap_tokens`` of trailing sentences.
+
+all-MiniLM-L6-v2 truncates its input at 256 word pieces, which is the
+default budget. Token counts come from the model's fast tokenizer when the
+``tokenizers`` package and the model files are available, otherwise from a
+word/punctuation estimate. ``model_name`` is a hub name, a local
+``tokenizer.json`` or a directory holding one (such as an ``export_onnx``
+directory). With ``HF_HUB_OFFLINE=1`` hub names are only looked up in the
+local Hugging Face cache, so offline runs fall back to the estimate at once
+instead of after the download retries.
+
+Instances are picklable so they can be passed as
+``PdfLoader(split_fn=TokenChunker())``. The tokenizer itself is not pickled:
+``load_tokenizer`` keeps one per model name per process, so every worker
+loads it once, however many tasks it runs.
+"""
+import os
+import re
+import threading
+
+import numpy as np
+
+from utility.models import DEFAULT_MODEL_NAME
+
+_tokenizers: dict = {}
+_tokenizers_lock = threading.Lock()
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[])")
+_HAS_LETTER = re.compile(r"[^\W\d_]")
+_ESTIMATE_TOKENS = re.compile(r"\w+|[^\w\s]")
+
+
+def split_into_sentences(text: str) -> list[str]:
+    """Splits text into sentences and drops fragments without any letters."""
+    sentences = []
+    for sentence in _SENTENCE_BOUNDARY.split(text):
+        sentence = " ".join(sentence.split())
+        if _HAS_LETTER.search(sentence):
+            sentences.append(sentence)
+    return sentences
+
+
+def estimate_tokens(sentences: list[str]) -> np.ndarray:
+    """Word piece estimate: one per word or symbol plus one per 6 chars of long words."""
+    return np.fromiter(
+        (sum(1 + max(0, len(piece) - 1) // 6 for piece in _ESTIMATE_TOKENS.findall(s))
+         for s in sentences),
+        dtype=np.int64, count=len(sentences))
+
+
+def _tokenizer_file(model_name: str):
+    """Local tokenizer.json for model_name, None when it has to be downloaded."""
+    if os.path.isdir(model_name):
+        return os.path.join(model_name, "tokenizer.json")
+    if os.path.isfile(model_name):
+        return model_name
+    if os.environ.get("HF_HUB_OFFLINE", "").lower() in ("1", "true", "yes", "on"):
+        from huggingface_hub import try_to_load_from_cache
+        cached = try_to_load_from_cache(model_name, "tokenizer.json")
+        if not isinstance(cached, str):
+            raise FileNotFoundError(f"{model_name} is not in the local Hugging Face cache.")
+        return cached
+    return None
+
+
+def load_tokenizer(model_name: str = DEFAULT_MODEL_NAME):
+    """Returns the process wide fast tokenizer for model_name, None when it cannot be loaded.
+
+    A failed load is remembered too, so the estimate is used without retrying.
+    """
+    if model_name in _tokenizers:
+        return _tokenizers[model_name]
+    with _tokenizers_lock:
+        if model_name not in _tokenizers:
+            try:
+                from tokenizers import Tokenizer
+                path = _tokenizer_file(model_name)
+                tokenizer = (Tokenizer.from_file(path) if path
+                             else Tokenizer.from_pretrained(model_name))
+                tokenizer.no_truncation()
+            except Exception:
+                tokenizer = None
+            _tokenizers[model_name] = tokenizer
+    return _tokenizers[model_name]
+
+
+class TokenChunker:
+    def __init__(self, max_tokens: int = 256, overlap_tokens: int = 32,
+                 model_name: str = DEFAULT_MODEL_NAME):
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be between 0 and max_tokens.")
+        # Room for the [CLS] and [SEP] tokens the model adds
+        self.max_tokens = max_tokens - 2
+        self.overlap_tokens = overlap_tokens
+        self.model_name = model_name
+
+    def count_tokens(self, sentences: list[str]) -> np.ndarray:
+        """Word piece counts of all sentences, computed in one batch."""
+        tokenizer = load_tokenizer(self.model_name)
+        if tokenizer is None:
+            return estimate_tokens(sentences)
+        encodings = tokenizer.encode_batch(sentences, add_special_tokens=False)
+        return np.fromiter((len(e.ids) for e in encodings), dtype=np.int64,
+                           count=len(sentences))
+
+    def _split_long(self, sentence: str, tokens: int) -> list[str]:
+        """Cuts a sentence longer than the budget into word windows."""
+        words = sentence.split()
+        parts = -(-tokens // self.max_tokens)
+        size = -(-len(words) // parts)
+        return [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+
+    def __call__(self, text: str) -> list[str]:
+        sentences = split_into_sentences(text)
+        if not sentences:
+            return []
+        counts = self.count_tokens(sentences)
+        if (counts > self.max_tokens).any():
+            pieces, piece_counts = [], []
+            for sentence, count in zip(sentences, counts):
+                if count > self.max_tokens:
+                    split = self._split_long(sentence, int(count))
+                    pieces.extend(split)
+                    piece_counts.extend(self.count_tokens(split))
+                else:
+                    pieces.append(sentence)
+                    piece_counts.append(count)
+            sentences, counts = pieces, np.asarray(piece_counts, dtype=np.int64)
+
+        chunks, current, current_tokens = [], [], 0
+        for sentence, count in zip(sentences, counts.tolist()):
+            if current and current_tokens + count > self.max_tokens:
+                chunks.append(" ".join(s for s, _ in current))
+                # Carry trailing sentences over as overlap
+                overlap, overlap_tokens = [], 0
+                for s, c in reversed(current):
+                    if overlap_tokens + c > self.overlap_tokens or \
+                            overlap_tokens + c + count > self.max_tokens:
+                        break
+                    overlap.insert(0, (s, c))
+                    overlap_tokens += c
+                current, current_tokens = overlap, overlap_tokens
+            current.append((sentence, count))
+            current_tokens += count
+        if current:
+            chunks.append(" ".join(s for s, _ in current))
+        return chunks
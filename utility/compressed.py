@@ -0,0 +1,128 @@
+"""
+@description:
+RerankedIndex - compressed codes in RAM, exact distances from disk.
+
+A compressed index (IVF-PQ, IVF-SQ8, IVF-fp16, see ``utility.indexes``)
+shortlists ``k * rerank_factor`` candidates per query from its codes. The
+candidates are then re-ranked with exact L2 distances against the full
+precision vectors, which stay in a memory-mapped float32 file on disk. Only
+the candidate rows are read, so RAM holds the codes (1/32 to 1/2 of the flat
+index) while recall stays close to an exact search.
+
+Files written by ``build``/``save`` for a path ``p``:
+----------------------------------------------------
+File            Description
+--------------  ------------------------------------------------------
+p.index         The compressed faiss index.
+p.vectors       Row-major float32 vectors, row i belongs to faiss id i.
+p.meta.json     Index type, dimension, count and rerank_factor.
+
+``calibrate`` picks the smallest rerank_factor that keeps recall@k within
+``margin`` of the exact flat index on a set of held out queries.
+"""
+import json
+import os
+
+import numpy as np
+
+from utility.indexes import COMPRESSED_TYPES, build_index, exact_ground_truth, recall_at_k
+from utility.models import lazy_import
+
+faiss = lazy_import("faiss")
+
+
+class RerankedIndex:
+    def __init__(self, index, vectors: np.ndarray, rerank_factor: int = 4, kind: str = None):
+        if index.ntotal != len(vectors):
+            raise ValueError(f"Index holds {index.ntotal} vectors, "
+                             f"full precision store holds {len(vectors)}.")
+        self.index = index
+        self.vectors = vectors
+        self.rerank_factor = rerank_factor
+        self.kind = kind
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.index.d
+
+    @classmethod
+    def build(cls, kind: str, vectors: np.ndarray, path: str = None, rerank_factor: int = 4,
+              train_size: int = None, **params) -> "RerankedIndex":
+        """Builds a compressed index of kind, saving it with its vectors when path is set."""
+        if kind not in COMPRESSED_TYPES:
+            raise ValueError(f"Re-ranking needs a compressed index, one of {COMPRESSED_TYPES}.")
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        reranked = cls(build_index(kind, vectors, train_size=train_size, **params),
+                       vectors, rerank_factor, kind)
+        if path is not None:
+            reranked.save(path)
+            # Serve the exact vectors from disk instead of keeping the copy in RAM
+            return cls.open(path)
+        return reranked
+
+    def save(self, path: str):
+        """Writes index, vectors and metadata, each with write-then-rename."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        faiss.write_index(self.index, f"{path}.index.tmp")
+        os.replace(f"{path}.index.tmp", f"{path}.index")
+        with open(f"{path}.vectors.tmp", "wb") as f:
+            for start in range(0, len(self.vectors), 65536):
+                f.write(np.ascontiguousarray(self.vectors[start:start + 65536],
+                                             dtype="float32").tobytes())
+        os.replace(f"{path}.vectors.tmp", f"{path}.vectors")
+        meta = {"kind": self.kind, "d": self.d, "ntotal": self.ntotal,
+                "rerank_factor": self.rerank_factor}
+        with open(f"{path}.meta.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(f"{path}.meta.json.tmp", f"{path}.meta.json")
+
+    @classmethod
+    def open(cls, path: str) -> "RerankedIndex":
+        with open(f"{path}.meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.memmap(f"{path}.vectors", dtype="float32", mode="r",
+                            shape=(meta["ntotal"], meta["d"]))
+        return cls(faiss.read_index(f"{path}.index"), vectors, meta["rerank_factor"],
+                   meta["kind"])
+
+    def search(self, queries: np.ndarray, k: int):
+        """Same contract as faiss Index.search: returns (distances, ids), -1 padded."""
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        shortlist = max(k, k * self.rerank_factor)
+        _, candidates = self.index.search(queries, shortlist)
+        valid = candidates >= 0
+
+        # Read every distinct candidate row once, in file order
+        unique_ids, inverse = np.unique(np.where(valid, candidates, 0), return_inverse=True)
+        rows = np.asarray(self.vectors[unique_ids], dtype="float32")
+        exact = rows[inverse.reshape(candidates.shape)]
+        distances = ((exact - queries[:, None, :]) ** 2).sum(axis=2)
+        distances[~valid] = np.inf
+
+        top = min(k, shortlist)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :top]
+        out_dist = np.take_along_axis(distances, order, axis=1).astype("float32")
+        out_ids = np.take_along_axis(candidates, order, axis=1)
+        out_ids[~np.isfinite(out_dist)] = -1
+        return out_dist, out_ids
+
+    def calibrate(self, queries: np.ndarray, k: int = 10, margin: float = 0.01,
+                  factors=(1, 2, 4, 8, 16, 32)) -> float:
+        """Sets the smallest rerank_factor with recall@k >= 1 - margin, returns that recall.
+
+        The exact flat index has recall 1.0 by definition, so the margin is the
+        recall the compressed index may lose against it.
+        """
+        truth = exact_ground_truth(self.vectors, queries, k)
+        recall = 0.0
+        for factor in factors:
+            self.rerank_factor = factor
+            _, ids = self.search(queries, k)
+            recall = recall_at_k(ids, truth, k)
+            if recall >= 1.0 - margin:
+                break
+        return recall
@@ -0,0 +1,109 @@
+"""
+@description:
+ContextPacker - fits the retrieved passages into a token budget for the answer prompt.
+
+Prompt size drives LLM latency and cost. Without a limit it grows with k,
+with the document length and with the overlap between retrievers and
+chunks. The packer takes the passages in score order (best first) and:
+
+1. splits every passage into sentences (``utility.chunker``) and drops the
+   sentences an earlier passage already contributed. Overlapping chunks and
+   the same text returned by FAISS and BM25 are sent once. A passage left
+   with less than ``min_new_fraction`` of its sentences is dropped whole,
+2. counts tokens locally with the model's tiktoken encoding. When tiktoken
+   or its encoding files are unavailable, it falls back to the chunker's
+   estimate. The encoding is loaded when the packer is created, since the
+   first load may download its files: that must not stall an event loop
+   in the middle of a query,
+3. adds passages while they fit in ``budget`` tokens. A passage that does
+   not fit is cut after its last whole sentence that does. If not even one
+   sentence fits, the packer moves on to the next, possibly shorter,
+   passage.
+
+``pack`` returns the packed texts, the indices of the passages they came
+from and the stats of the query:
+
+Stat           Description
+-------------  ----------------------------------------------------------
+input_tokens   Tokens of all passages, joined as an unpacked prompt would be.
+tokens         Tokens of the packed context.
+tokens_saved   input_tokens - tokens.
+duplicates     Passages dropped as (near) duplicates.
+truncated      Passages cut at a sentence boundary to fit.
+exact          True when the counts come from tiktoken, not the estimate.
+"""
+import numpy as np
+
+from utility.chunker import estimate_tokens, split_into_sentences
+
+DEFAULT_CONTEXT_MODEL = "gpt-3.5-turbo-instruct"
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(sentence.lower().split())
+
+
+class ContextPacker:
+    def __init__(self, budget: int = 1500, model: str = DEFAULT_CONTEXT_MODEL,
+                 min_new_fraction: float = 0.5, separator: str = "\n\n"):
+        self.budget = budget
+        self.model = model
+        self.min_new_fraction = min_new_fraction
+        self.separator = separator
+        self._encoding = self._load_encoding()
+
+    def _load_encoding(self):
+        try:
+            import tiktoken
+            try:
+                return tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or the encoding files can not be downloaded
+            return None
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, texts: list[str]) -> np.ndarray:
+        """Token count of every text."""
+        encoding = self._encoding
+        if encoding is None:
+            return estimate_tokens(texts)
+        return np.fromiter((len(tokens) for tokens in encoding.encode_batch(texts)),
+                           dtype=np.int64, count=len(texts))
+
+    def pack(self, passages: list[str]) -> tuple[list[str], list[int], dict]:
+        """Packs passages (best first) into the budget, returns (texts, passage indices, stats)."""
+        separator_tokens = int(self.count([self.separator])[0]) if passages else 0
+        input_tokens = int(self.count(passages).sum()) + separator_tokens * max(len(passages) - 1, 0)
+        texts, indices, seen = [], [], set()
+        used = duplicates = truncated = 0
+        for i, passage in enumerate(passages):
+            sentences = split_into_sentences(passage)
+            if not sentences:
+                continue
+            fresh = [s for s in sentences if _sentence_key(s) not in seen]
+            if not fresh or len(fresh) < self.min_new_fraction * len(sentences):
+                duplicates += 1
+                continue
+            room = self.budget - used - (separator_tokens if texts else 0)
+            tokens = self.count(fresh)
+            if tokens.sum() > room:
+                fit = int(np.searchsorted(np.cumsum(tokens), room, side="right"))
+                if fit == 0:
+                    continue
+                fresh, tokens = fresh[:fit], tokens[:fit]
+                truncated += 1
+            seen.update(_sentence_key(s) for s in fresh)
+            used += int(tokens.sum()) + (separator_tokens if texts else 0)
+            texts.append(" ".join(fresh))
+            indices.append(i)
+
+        stats = {"passages": len(passages), "packed": len(texts), "budget": self.budget,
+                 "input_tokens": input_tokens, "tokens": used,
+                 "tokens_saved": max(input_tokens - used, 0), "duplicates": duplicates,
+                 "truncated": truncated, "exact": self.exact}
+        return texts, indices, stats
@@ -0,0 +1,126 @@
+"""
+@description:
+DocStore - a memory-mapped id -> text store for faiss ids.
+
+The texts are kept in two files:
+----------------------------------
+File            Description
+--------------  ------------------------------------------------------
+<name>.offsets  int64 array of n + 1 byte offsets into the blob.
+<name>.blob     UTF-8 encoded texts, back to back without separators.
+
+Text ``i`` is ``blob[offsets[i]:offsets[i + 1]]``. Both files are memory
+mapped, so opening a store with millions of texts costs no parsing time and
+a lookup only touches the pages holding that one text. The store only grows:
+``append`` writes the new texts to the end of the blob first and extends the
+offsets afterwards, so the offsets file always describes complete texts.
+"""
+import mmap
+import os
+
+import numpy as np
+
+OFFSET_DTYPE = np.dtype("<i8")
+
+
+class DocStore:
+    def __init__(self, path: str):
+        self.offsets_path = f"{path}.offsets"
+        self.blob_path = f"{path}.blob"
+        self._offsets = None
+        self._blob_file = None
+        self._blob = None
+
+        directory = os.path.dirname(self.offsets_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.offsets_path):
+            with open(self.offsets_path, "wb") as f:
+                f.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+        if not os.path.exists(self.blob_path):
+            open(self.blob_path, "wb").close()
+        # A torn offsets write leaves a partial entry at the end, drop it
+        size = os.path.getsize(self.offsets_path)
+        if size % OFFSET_DTYPE.itemsize:
+            with open(self.offsets_path, "r+b") as f:
+                f.truncate(size - size % OFFSET_DTYPE.itemsize)
+        self._map()
+
+    def _map(self):
+        self._unmap()
+        self._offsets = np.memmap(self.offsets_path, dtype=OFFSET_DTYPE, mode="r")
+        self._blob_file = open(self.blob_path, "rb")
+        if os.fstat(self._blob_file.fileno()).st_size > 0:
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._blob = b""
+
+    def _unmap(self):
+        self._offsets = None
+        if isinstance(self._blob, mmap.mmap):
+            try:
+                self._blob.close()
+            except BufferError:
+                # A caller still holds a view from get_bytes, the map is
+                # released once that view is garbage collected
+                pass
+        self._blob = None
+        if self._blob_file is not None:
+            self._blob_file.close()
+            self._blob_file = None
+
+    def close(self):
+        self._unmap()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get_bytes(self, idx: int) -> memoryview:
+        """Returns a zero-copy view of the UTF-8 bytes of text idx.
+
+        The view is only valid until the next append or truncate.
+        """
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Id {idx} is not present in the doc store.")
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return memoryview(self._blob)[start:end]
+
+    def __getitem__(self, idx: int) -> str:
+        return str(self.get_bytes(idx), "utf-8")
+
+    def append(self, texts: list[str]) -> int:
+        """Appends texts and returns the id of the first one."""
+        first_id = len(self)
+        if not texts:
+            return first_id
+        encoded = [text.encode("utf-8") for text in texts]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=OFFSET_DTYPE, count=len(encoded))
+        end = int(self._offsets[-1])
+        new_offsets = end + np.cumsum(lengths)
+
+        self._unmap()
+        with open(self.blob_path, "r+b") as f:
+            # Bytes past the last offset belong to an append that never committed
+            f.seek(end)
+            f.truncate()
+            f.write(b"".join(encoded))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.offsets_path, "ab") as f:
+            f.write(new_offsets.astype(OFFSET_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._map()
+        return first_id
+
+    def truncate(self, count: int):
+        """Drops every text from id count onwards (used to roll back uncommitted appends)."""
+        if count >= len(self):
+            return
+        end = int(self._offsets[count])
+        self._unmap()
+        with open(self.offsets_path, "r+b") as f:
+            f.truncate((count + 1) * OFFSET_DTYPE.itemsize)
+        with open(self.blob_path, "r+b") as f:
+            f.truncate(end)
+        self._map()
@@ -0,0 +1,181 @@
+"""
+@description:
+EmbeddingCache - a persistent, content-addressed cache of text embeddings.
+
+Vectors are keyed by the embedding model name and a 64 bit hash of the
+normalized text, so re-running an ingestion (or switching between the Flat,
+IVF and HNSW examples) only sends texts that were never embedded to the model.
+
+Layout under ``<cache_dir>/<model name>/``:
+---------------------------------------------
+File            Description
+--------------  ------------------------------------------------------
+meta.json       Model name, dimension and storage dtype of the cache.
+keys.bin        uint64 text hashes, row i of vectors.bin belongs to key i.
+vectors.bin     Row-major float32/float16 matrix, memory mapped on load.
+
+Appends write the vectors before the keys, so the key count always describes
+complete rows; anything past it is dropped on the next load.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = "faiss_storage/embedding_cache"
+KEY_DTYPE = np.dtype("<u8")
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC normalization with whitespace collapsed and stripped."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_keys(texts: list[str]) -> np.ndarray:
+    """Returns the uint64 content hash for every normalized text."""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(normalize_text(t).encode("utf-8"),
+                                        digest_size=8).digest(), "little")
+         for t in texts),
+        dtype=KEY_DTYPE, count=len(texts))
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, dimension: int,
+                 cache_dir: str = DEFAULT_CACHE_DIR, dtype: str = "float32"):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported cache dtype: {dtype}")
+        self.model_name = model_name
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.directory = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.keys_path = os.path.join(self.directory, "keys.bin")
+        self.vectors_path = os.path.join(self.directory, "vectors.bin")
+        self.hits = 0
+        self.misses = 0
+        # Lookups and appends may come from several encode threads at once
+        self._lock = threading.RLock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {"model": model_name, "dimension": dimension, "dtype": dtype}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(f"Embedding cache at {self.directory} was built with "
+                                 f"{stored}, expected {meta}.")
+        else:
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        self._load()
+
+    def _row_bytes(self) -> int:
+        return self.dimension * self.dtype.itemsize
+
+    def _load(self):
+        keys = np.fromfile(self.keys_path, dtype=KEY_DTYPE) \
+            if os.path.exists(self.keys_path) else np.empty(0, dtype=KEY_DTYPE)
+        rows = os.path.getsize(self.vectors_path) // self._row_bytes() \
+            if os.path.exists(self.vectors_path) else 0
+        count = min(len(keys), rows)
+
+        # Drop rows of an append that did not complete
+        if len(keys) != count:
+            with open(self.keys_path, "r+b") as f:
+                f.truncate(count * KEY_DTYPE.itemsize)
+        if os.path.exists(self.vectors_path) and \
+                os.path.getsize(self.vectors_path) != count * self._row_bytes():
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(count * self._row_bytes())
+
+        self._set_keys(keys[:count])
+        self._map_vectors(count)
+
+    def _map_vectors(self, count: int):
+        self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r",
+                                  shape=(count, self.dimension)) if count else \
+            np.empty((0, self.dimension), dtype=self.dtype)
+
+    def _set_keys(self, keys: np.ndarray):
+        self._keys = keys
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _find_rows(self, keys: np.ndarray):
+        """Returns (rows, found) for a batch of keys, rows are only valid where found."""
+        if len(self._sorted_keys) == 0:
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        positions = np.searchsorted(self._sorted_keys, keys)
+        positions = np.minimum(positions, len(self._sorted_keys) - 1)
+        found = self._sorted_keys[positions] == keys
+        return self._order[positions], found
+
+    def lookup(self, texts: list[str]):
+        """Bulk lookup, returns (float32 vectors, hit mask); missing rows are zero."""
+        keys = text_keys(texts)
+        vectors = np.zeros((len(texts), self.dimension), dtype="float32")
+        with self._lock:
+            rows, found = self._find_rows(keys)
+            if found.any():
+                vectors[found] = self._vectors[rows[found]]
+        return vectors, found
+
+    def add(self, texts: list[str], vectors: np.ndarray):
+        """Appends vectors for texts that are not cached yet."""
+        keys = text_keys(texts)
+        with self._lock:
+            self._append(keys, np.asarray(vectors))
+
+    def _append(self, keys: np.ndarray, vectors: np.ndarray):
+        _, found = self._find_rows(keys)
+        keys, unique = np.unique(keys[~found], return_index=True)
+        if len(keys) == 0:
+            return
+        new_vectors = vectors[~found][unique].astype(self.dtype)
+
+        self._vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(new_vectors).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, "ab") as f:
+            f.write(keys.astype(KEY_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        # np.unique returned the new keys sorted, merge them into the sorted view
+        count = len(self._keys)
+        positions = np.searchsorted(self._sorted_keys, keys)
+        self._keys = np.concatenate([self._keys, keys])
+        self._sorted_keys = np.insert(self._sorted_keys, positions, keys)
+        self._order = np.insert(self._order, positions,
+                                np.arange(count, count + len(keys), dtype=self._order.dtype))
+        self._map_vectors(len(self._keys))
+
+    def encode(self, model, texts: list[str], **encode_kwargs) -> np.ndarray:
+        """Returns float32 embeddings for texts, only cache misses go to model.encode."""
+        vectors, found = self.lookup(texts)
+        missing = np.flatnonzero(~found)
+        with self._lock:
+            self.hits += int(found.sum())
+            self.misses += len(missing)
+        if len(missing) == 0:
+            return vectors
+
+        # Encode every distinct missing text once
+        missing_keys = text_keys([texts[i] for i in missing])
+        _, first, inverse = np.unique(missing_keys, return_index=True, return_inverse=True)
+        to_encode = [texts[missing[i]] for i in first]
+        encoded = np.asarray(model.encode(to_encode, convert_to_numpy=True, **encode_kwargs),
+                             dtype="float32")
+        vectors[missing] = encoded[inverse.reshape(-1)]
+        self.add(to_encode, encoded)
+        return vectors
@@ -0,0 +1,276 @@
+"""
+@description:
+Embedding backends with length-bucketed, token-budget batching.
+
+``SentenceTransformer.encode(texts, batch_size=50)`` pads every batch to its
+longest text, and its batch size is fixed whatever the lengths. Sixty short
+titles cost as many forward passes as sixty long paragraphs. The encoders
+here tokenize all the texts first, sort them by token count (longest
+first) into buckets ``bucket_width`` tokens wide, and cut every bucket into
+batches whose padded size (texts x longest text) stays within
+``max_tokens``. So short texts go in large batches, long texts in small
+ones, and no text is padded by more than a bucket width:
+
+Backend   Class         Runs                                  Needs
+--------  ------------  ------------------------------------  --------------------------
+torch     TorchEncoder  the SentenceTransformer model         sentence-transformers
+onnx      OnnxEncoder   an exported graph on onnxruntime,     onnxruntime, tokenizers and
+                        int8 weights when available           a local model directory
+
+Both have ``encode(texts, batch_size=None, convert_to_numpy=True, ...)`` like
+SentenceTransformer and return float32 rows in input order. They can
+replace a model in ``EmbeddingCache.encode`` or an ``IngestionPipeline``.
+``batch_size``, when given, caps the texts per batch. ``name`` includes the
+backend, so caches keep the vectors of different backends apart.
+
+``export_onnx`` writes the local model directory for all-MiniLM-L6-v2 (needs
+torch once, on any machine):
+
+File              Description
+----------------  ------------------------------------------------------
+model.onnx        fp32 graph: input_ids, attention_mask, token_type_ids
+                  -> last_hidden_state.
+model_int8.onnx   The same graph with dynamically quantized int8 weights.
+tokenizer.json    The fast tokenizer.
+encoder.json      Model name, max length, dimension, pooling, normalize.
+
+``vectordatabases/comparison/embedding_benchmark.py`` measures sentences/sec
+of every backend against the plain ``encode(batch_size=50)`` path.
+"""
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from utility.chunker import estimate_tokens
+from utility.models import DEFAULT_MODEL_NAME, get_model, lazy_import
+
+_encoders: dict = {}
+_encoders_lock = threading.Lock()
+
+
+def plan_batches(lengths: np.ndarray, max_tokens: int = 16384, max_batch_size: int = 256,
+                 bucket_width: int = 16) -> list[np.ndarray]:
+    """Index batches, longest texts first, each padding to at most max_tokens tokens.
+
+    Texts are bucketed by length (bucket_width tokens per bucket) and a batch
+    never spans two buckets, so no text is padded by bucket_width or more.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = np.argsort(-lengths, kind="stable")
+    # Negated bucket numbers: ascending along the sorted order, for searchsorted
+    sorted_buckets = -((np.maximum(lengths[order], 1) - 1) // bucket_width)
+    batches, start = [], 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, min(max_batch_size, max_tokens // longest))
+        end = start + int(np.searchsorted(sorted_buckets[start:start + size],
+                                          sorted_buckets[start], side="right"))
+        batches.append(order[start:end])
+        start = end
+    return batches
+
+
+def padding_efficiency(lengths: np.ndarray, batches: list[np.ndarray]) -> float:
+    """Real tokens / padded tokens of a batch plan (1.0: no padding at all)."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    padded = sum(len(batch) * int(lengths[batch].max()) for batch in batches if len(batch))
+    return float(lengths.sum()) / padded if padded else 1.0
+
+
+class _BucketedEncoder(ABC):
+    name: str
+    dimension: int
+
+    def __init__(self, max_tokens: int = 16384, max_batch_size: int = 256,
+                 bucket_width: int = 16):
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.bucket_width = bucket_width
+        self.stats = {"sentences": 0, "batches": 0, "tokens": 0, "padded_tokens": 0,
+                      "seconds": 0.0}
+        # The ingestion pipeline encodes from several worker threads
+        self._stats_lock = threading.Lock()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    @abstractmethod
+    def _prepare(self, texts: list[str]):
+        """Returns (token count per text, whatever _encode_batch needs besides the texts)."""
+
+    @abstractmethod
+    def _encode_batch(self, texts: list[str], batch: np.ndarray, prepared) -> np.ndarray:
+        """float32 embeddings of the texts at the indices in batch."""
+
+    def token_lengths(self, texts: list[str]) -> np.ndarray:
+        """Token count of every text, as the batches are planned."""
+        return self._prepare(list(texts))[0]
+
+    def encode(self, sentences, batch_size: int = None, convert_to_numpy: bool = True,
+               **kwargs) -> np.ndarray:
+        """float32 embeddings of sentences (a str or a list), rows in input order."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return vectors
+        start = time.perf_counter()
+        lengths, prepared = self._prepare(texts)
+        batches = plan_batches(lengths, self.max_tokens, batch_size or self.max_batch_size,
+                               self.bucket_width)
+        for batch in batches:
+            vectors[batch] = self._encode_batch(texts, batch, prepared)
+        padded = sum(len(b) * int(lengths[b].max()) for b in batches)
+        with self._stats_lock:
+            self.stats["sentences"] += len(texts)
+            self.stats["batches"] += len(batches)
+            self.stats["tokens"] += int(np.sum(lengths))
+            self.stats["padded_tokens"] += padded
+            self.stats["seconds"] += time.perf_counter() - start
+        return vectors[0] if single else vectors
+
+
+class TorchEncoder(_BucketedEncoder):
+    """The SentenceTransformer model, fed length-bucketed batches.
+
+    Every text is tokenized twice: once here to plan the batches and again
+    inside model.encode. With the fast (Rust) tokenizers that is small next
+    to the forward pass, and OnnxEncoder tokenizes only once.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, device: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = model_name
+        self.model = get_model(model_name, device)
+        self.name = model_name
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.max_length = getattr(self.model, "max_seq_length", None) or 256
+
+    def _prepare(self, texts: list[str]):
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            # Word piece estimate plus [CLS] and [SEP]
+            lengths = estimate_tokens(texts) + 2
+        else:
+            input_ids = tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+            lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64, count=len(texts))
+        return np.minimum(lengths, self.max_length), None
+
+    def _encode_batch(self, texts: list[str], batch: np.ndarray, prepared) -> np.ndarray:
+        return np.asarray(self.model.encode([texts[i] for i in batch], batch_size=len(batch),
+                                            convert_to_numpy=True, show_progress_bar=False),
+                          dtype=np.float32)
+
+
+class OnnxEncoder(_BucketedEncoder):
+    """An exported transformer on onnxruntime with mean pooling, from a local model directory."""
+
+    def __init__(self, model_dir: str, quantized: bool = True, threads: int = None, **kwargs):
+        super().__init__(**kwargs)
+        ort = lazy_import("onnxruntime")
+        tokenizers = lazy_import("tokenizers")
+        with open(os.path.join(model_dir, "encoder.json"), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        model_path = os.path.join(model_dir, "model_int8.onnx")
+        self.quantized = quantized and os.path.exists(model_path)
+        if not self.quantized:
+            model_path = os.path.join(model_dir, "model.onnx")
+        self.model_dir = model_dir
+        self.name = f"{self.config['model_name']}@onnx-{'int8' if self.quantized else 'fp32'}"
+        self.dimension = self.config["dimension"]
+        self.max_length = self.config.get("max_length", 256)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = tokenizers.Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(self.max_length)
+
+    def _prepare(self, texts: list[str]):
+        encodings = self.tokenizer.encode_batch(texts)
+        lengths = np.fromiter((len(e.ids) for e in encodings), dtype=np.int64, count=len(texts))
+        return lengths, encodings
+
+    def _encode_batch(self, texts: list[str], batch: np.ndarray, prepared) -> np.ndarray:
+        encodings = [prepared[i] for i in batch]
+        width = max(len(e.ids) for e in encodings)
+        input_ids = np.zeros((len(batch), width), dtype=np.int64)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feed)[0]
+
+        # Mean pooling over the real tokens, then L2 normalization like the model's
+        mask = attention_mask[:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config.get("normalize", True):
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.astype(np.float32)
+
+
+def get_encoder(backend: str = "torch", model_name: str = DEFAULT_MODEL_NAME,
+                model_dir: str = None, **kwargs):
+    """Returns the process wide encoder of backend ("torch" or "onnx"), built on first use."""
+    key = (backend, model_name, model_dir, tuple(sorted(kwargs.items())))
+    encoder = _encoders.get(key)
+    if encoder is not None:
+        return encoder
+    with _encoders_lock:
+        encoder = _encoders.get(key)
+        if encoder is None:
+            if backend == "torch":
+                encoder = TorchEncoder(model_name, **kwargs)
+            elif backend == "onnx":
+                if model_dir is None:
+                    raise ValueError("The onnx backend needs model_dir, see export_onnx.")
+                encoder = OnnxEncoder(model_dir, **kwargs)
+            else:
+                raise ValueError(f"Unknown embedding backend: {backend}")
+            _encoders[key] = encoder
+    return encoder
+
+
+def export_onnx(model_dir: str, model_name: str = DEFAULT_MODEL_NAME, quantize: bool = True,
+                opset: int = 17):
+    """Exports model_name's transformer to model_dir in the layout OnnxEncoder loads."""
+    import torch
+
+    model = get_model(model_name, "cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    os.makedirs(model_dir, exist_ok=True)
+    tokenizer.backend_tokenizer.save(os.path.join(model_dir, "tokenizer.json"))
+
+    sample = tokenizer(["an example sentence", "another one"], padding=True, return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    axes = {"batch": 0, "sequence": 1}
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer, tuple(sample[name] for name in names), fp32_path,
+            input_names=names, output_names=["last_hidden_state"], opset_version=opset,
+            dynamic_axes={name: {v: k for k, v in axes.items()}
+                          for name in names + ["last_hidden_state"]})
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(model_dir, "model_int8.onnx"),
+                         weight_type=QuantType.QInt8)
+
+    config = {"model_name": model_name, "max_length": model.max_seq_length,
+              "dimension": model.get_sentence_embedding_dimension(), "pooling": "mean",
+              "normalize": any(type(module).__name__ == "Normalize" for module in model)}
+    with open(os.path.join(model_dir, "encoder.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
@@ -0,0 +1,293 @@
+"""
+@description:
+IncrementalIVF - an IVF index that keeps growing after training, watches its
+clusters drift and retrains itself in the background.
+
+An IVF index is trained once, on whatever sample was at hand, and every later
+``add`` is assigned to those frozen centroids. When the new data does not
+look like the training sample some inverted lists grow far larger than the
+others (searches with the same nprobe then scan more vectors and lose recall)
+and vectors sit further from their centroid. Two measures are tracked:
+
+Measure               Description
+--------------------  --------------------------------------------------------
+imbalance             faiss imbalance factor of the lists, 1.0 = all equal.
+quantization_error    Mean squared distance of the vectors added since the
+                      last training to their assigned centroid.
+
+Each is compared to its value right after the last training; once either
+ratio passes its threshold (and the index has grown by ``min_growth``) a
+background thread trains a new index of the same kind on a sample of all
+vectors (nlist follows the corpus size unless it was fixed), refills it and
+swaps it in with a reference assignment. Searches keep using the old index
+while the new one is built and ids do not change, since vectors are re-added
+in the same order. Additions that arrive during the rebuild are replayed
+onto the new index before the swap.
+
+No copy of the vectors is kept beside the index: only the ``train_size``
+vectors before the first training are buffered, and a retrain reads the
+corpus back from the current index (``reconstruct_n`` over its direct map)
+block by block. For the compressed kinds (ivfpq, ivfsq8) that is the decoded
+approximation of each vector.
+
+Instances are ``add_fn``s for ``utility.pipeline.IngestionPipeline``.
+"""
+import threading
+import time
+
+import numpy as np
+
+from utility.indexes import default_nlist, make_index, set_search_params
+from utility.models import lazy_import
+
+faiss = lazy_import("faiss")
+
+# Vectors read back and re-added per step of a (re)training pass
+REFILL_BLOCK = 65536
+
+
+def _gather(rows, n: int, ids: np.ndarray) -> np.ndarray:
+    """The vectors of the sorted ids, read block by block through rows(start, stop)."""
+    parts = []
+    for start in range(0, n, REFILL_BLOCK):
+        stop = min(start + REFILL_BLOCK, n)
+        lo, hi = np.searchsorted(ids, [start, stop])
+        if hi > lo:
+            parts.append(rows(start, stop)[ids[lo:hi] - start])
+    return np.concatenate(parts)
+
+
+class _ReadWriteLock:
+    """Many concurrent searches or one add; faiss IVF is not safe for both at once.
+
+    Waiting writers go first, so a steady stream of searches cannot starve adds.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class IncrementalIVF:
+    def __init__(self, d: int, kind: str = "ivf", nlist: int = None, nprobe: int = 8,
+                 train_size: int = 5000, imbalance_threshold: float = 1.5,
+                 error_threshold: float = 1.25, min_growth: float = 0.2,
+                 auto_retrain: bool = True, **params):
+        self.d = d
+        self.kind = kind
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.imbalance_threshold = imbalance_threshold
+        self.error_threshold = error_threshold
+        self.min_growth = min_growth
+        self.auto_retrain = auto_retrain
+        self.params = params
+        self.index = None
+        self.retrains = 0
+        self.seconds = 0.0
+        # Vectors waiting for the first training, and the ones added during a retrain
+        self._buffer: list[np.ndarray] = []
+        self._pending: list[np.ndarray] = None
+        self._ntotal = 0
+        self._baseline = {}
+        self._new_error_sum, self._new_count = 0.0, 0
+        self._rw_lock = _ReadWriteLock()
+        self._retrain_thread = None
+
+    @property
+    def ntotal(self) -> int:
+        return self._ntotal
+
+    @property
+    def is_trained(self) -> bool:
+        return self.index is not None
+
+    def _train(self, n: int, rows):
+        """Returns a new trained and filled index with its baseline measures.
+
+        rows(start, stop) returns the vectors with ids start to stop - 1.
+        """
+        nlist = self.nlist or default_nlist(n)
+        index = make_index(self.kind, self.d, n=n, nlist=nlist, **self.params)
+        # k-means wants about 39 points per centroid
+        size = min(n, max(self.train_size, 39 * nlist))
+        order = np.random.default_rng(n).permutation(n)
+        index.train(_gather(rows, n, np.sort(order[:size])))
+        # Lets the next retrain read the vectors back by id
+        index.make_direct_map()
+        for start in range(0, n, REFILL_BLOCK):
+            index.add(rows(start, min(start + REFILL_BLOCK, n)))
+        set_search_params(index, nprobe=self.nprobe)
+        # Baseline error on vectors k-means did not see, like the ones added later
+        held_out = order[size:size + 10000] if size < n else order[:10000]
+        errors, _ = index.quantizer.search(_gather(rows, n, np.sort(held_out)), 1)
+        baseline = {"imbalance": index.invlists.imbalance_factor(),
+                    "quantization_error": float(errors.mean()), "ntotal": n}
+        return index, baseline
+
+    def _train_buffer(self):
+        vectors = np.concatenate(self._buffer)
+        self._buffer = []
+        self.index, self._baseline = self._train(len(vectors), lambda start, stop:
+                                                 vectors[start:stop])
+
+    def add(self, vectors: np.ndarray):
+        start = time.perf_counter()
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        self._rw_lock.acquire_write()
+        try:
+            self._ntotal += len(vectors)
+            if self.index is None:
+                self._buffer.append(vectors)
+                if self._ntotal >= self.train_size:
+                    self._train_buffer()
+            else:
+                # The coarse assignment faiss does in add, repeated to measure the error
+                errors, _ = self.index.quantizer.search(vectors, 1)
+                self._new_error_sum += float(errors.sum())
+                self._new_count += len(vectors)
+                self.index.add(vectors)
+                if self._pending is not None:
+                    self._pending.append(vectors)
+        finally:
+            self._rw_lock.release_write()
+        self.seconds += time.perf_counter() - start
+        if self.auto_retrain and self.needs_retrain():
+            self.retrain(background=True)
+
+    def __call__(self, texts: list[str], vectors: np.ndarray):
+        self.add(vectors)
+
+    def flush(self):
+        """Trains on whatever is buffered when fewer than train_size vectors were added."""
+        self._rw_lock.acquire_write()
+        try:
+            if self.index is None and self._ntotal:
+                self._train_buffer()
+        finally:
+            self._rw_lock.release_write()
+
+    def drift(self) -> dict:
+        """Current measures and their ratio to the values after the last training."""
+        self._rw_lock.acquire_read()
+        try:
+            if self.index is None:
+                return {}
+            imbalance = self.index.invlists.imbalance_factor()
+        finally:
+            self._rw_lock.release_read()
+        error = self._new_error_sum / self._new_count if self._new_count else \
+            self._baseline["quantization_error"]
+        return {
+            "imbalance": imbalance,
+            "imbalance_ratio": imbalance / self._baseline["imbalance"],
+            "quantization_error": error,
+            "error_ratio": error / max(self._baseline["quantization_error"], 1e-12),
+            "growth": self._ntotal / self._baseline["ntotal"] - 1.0,
+        }
+
+    def needs_retrain(self) -> bool:
+        drift = self.drift()
+        if not drift or self.retraining or drift["growth"] < self.min_growth:
+            return False
+        return drift["imbalance_ratio"] > self.imbalance_threshold or \
+            drift["error_ratio"] > self.error_threshold
+
+    @property
+    def retraining(self) -> bool:
+        return self._retrain_thread is not None and self._retrain_thread.is_alive()
+
+    def retrain(self, background: bool = True):
+        """Retrains on all vectors and swaps the new index in, queries keep running meanwhile."""
+        if self.retraining:
+            return
+        if not background:
+            self._retrain()
+            return
+        self._retrain_thread = threading.Thread(target=self._retrain, name="ivf-retrain",
+                                                daemon=True)
+        self._retrain_thread.start()
+
+    def _retrain(self):
+        self._rw_lock.acquire_write()
+        try:
+            if self.index is None:
+                return
+            count, source = self._ntotal, self.index
+            self._pending = []
+        finally:
+            self._rw_lock.release_write()
+
+        def rows(start: int, stop: int) -> np.ndarray:
+            # Blocks adds to the old index only while one block is read
+            self._rw_lock.acquire_read()
+            try:
+                return source.reconstruct_n(start, stop - start)
+            finally:
+                self._rw_lock.release_read()
+
+        try:
+            index, baseline = self._train(count, rows)
+        except BaseException:
+            self._rw_lock.acquire_write()
+            self._pending = None
+            self._rw_lock.release_write()
+            raise
+
+        self._rw_lock.acquire_write()
+        try:
+            # Replay what was added while training, then swap
+            for vectors in self._pending:
+                index.add(vectors)
+            baseline["ntotal"] = self._ntotal
+            self._pending = None
+            self.index, self._baseline = index, baseline
+            self._new_error_sum, self._new_count = 0.0, 0
+            self.retrains += 1
+        finally:
+            self._rw_lock.release_write()
+
+    def wait(self):
+        """Blocks until a running background retrain has swapped its index in."""
+        if self._retrain_thread is not None:
+            self._retrain_thread.join()
+
+    def search(self, queries: np.ndarray, k: int):
+        """Same contract as faiss Index.search."""
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        self._rw_lock.acquire_read()
+        try:
+            if self.index is None:
+                return (np.full((len(queries), k), np.inf, dtype="float32"),
+                        np.full((len(queries), k), -1, dtype="int64"))
+            return self.index.search(queries, k)
+        finally:
+            self._rw_lock.release_read()
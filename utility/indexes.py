@@ -0,0 +1,143 @@
+"""
+@description:
+Shared builders and measurements for the Flat, IVF and HNSW faiss indexes.
+
+Index type   Parameters                     Search parameters
+-----------  -----------------------------  -------------------------
+flat         -                              -
+ivf          nlist                          nprobe
+hnsw         M, ef_construction             ef_search
+ivfpq        nlist, pq_m, pq_nbits          nprobe
+ivfsq8       nlist                          nprobe
+ivffp16      nlist                          nprobe
+
+The last three store compressed codes instead of float32 vectors (IVF-PQ
+with the default pq_m, the largest divisor of d up to d / 8, keeps about
+1/32 of the bytes, SQ8 1/4, fp16 1/2).
+
+``build_index`` creates, trains and fills an index in one call,
+``set_search_params`` applies the query time knobs, and ``exact_ground_truth``
+/ ``recall_at_k`` give the recall of an approximate index against an exact
+``IndexFlatL2`` search. ``synthetic_corpus`` generates clustered, unit length
+vectors that behave like sentence embeddings, so benchmarks run offline.
+"""
+import numpy as np
+
+from utility.models import lazy_import
+
+faiss = lazy_import("faiss")
+
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+COMPRESSED_TYPES = ("ivfpq", "ivfsq8", "ivffp16")
+
+
+def default_nlist(n: int) -> int:
+    """Rule of thumb for IVF: about 4 * sqrt(n) lists, at least 39 points per list."""
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+
+def default_pq_m(d: int) -> int:
+    """Largest divisor of d up to d / 8: faiss needs d to split evenly into pq_m sub-vectors."""
+    return next(m for m in range(max(1, d // 8), 0, -1) if d % m == 0)
+
+
+def make_index(kind: str, d: int, n: int = 0, nlist: int = None, M: int = 16,
+               ef_construction: int = 40, pq_m: int = None, pq_nbits: int = 8):
+    """Returns an empty index of the given kind for d dimensional vectors."""
+    if kind == "flat":
+        return faiss.IndexFlatL2(d)
+    if kind in ("ivf",) + COMPRESSED_TYPES:
+        quantizer = faiss.IndexFlatL2(d)
+        nlist = nlist or default_nlist(n)
+        if kind == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        elif kind == "ivfpq":
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m or default_pq_m(d), pq_nbits)
+        else:
+            qtype = faiss.ScalarQuantizer.QT_8bit if kind == "ivfsq8" else \
+                faiss.ScalarQuantizer.QT_fp16
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, qtype)
+        # The index owns the quantizer once the python reference is gone
+        index.own_fields = True
+        quantizer.this.disown()
+        return index
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, M)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    raise ValueError(f"Unknown index type: {kind}. "
+                     f"Expected one of {INDEX_TYPES + COMPRESSED_TYPES}.")
+
+
+def build_index(kind: str, vectors: np.ndarray, train_size: int = None, **params):
+    """Creates, trains (when needed) and fills an index with vectors."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    index = make_index(kind, vectors.shape[1], n=len(vectors), **params)
+    if not index.is_trained:
+        sample = vectors
+        if train_size is not None and train_size < len(vectors):
+            rng = np.random.default_rng(0)
+            sample = vectors[np.sort(rng.choice(len(vectors), train_size, replace=False))]
+        index.train(sample)
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Applies the query time parameters that apply to index."""
+    index = faiss.downcast_index(index)
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def index_memory_bytes(index) -> int:
+    """Bytes held by the index data structures (codes, ids, graph links, centroids)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        graph = (hnsw.neighbors.size() * 4 + hnsw.levels.size() * 4
+                 + hnsw.offsets.size() * 8)
+        return graph + index_memory_bytes(index.storage)
+    if isinstance(index, faiss.IndexIVF):
+        codes = index.invlists.compute_ntotal() * (index.code_size + 8)
+        return codes + index_memory_bytes(index.quantizer)
+    if hasattr(index, "code_size"):
+        return index.ntotal * index.code_size
+    # Unknown index types: fall back to the serialized size
+    return len(faiss.serialize_index(index))
+
+
+def exact_ground_truth(base: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Ids of the exact k nearest neighbours of every query (IndexFlatL2)."""
+    index = faiss.IndexFlatL2(base.shape[1])
+    index.add(np.ascontiguousarray(base, dtype="float32"))
+    _, ids = index.search(np.ascontiguousarray(queries, dtype="float32"), k)
+    return ids
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    """Fraction of the true top-k neighbours present in the returned top-k."""
+    found, truth = found[:, :k], truth[:, :k]
+    hits = sum(len(np.intersect1d(f[f >= 0], t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def synthetic_corpus(n: int, d: int = 384, n_queries: int = 1000, n_clusters: int = 256,
+                     seed: int = 0, chunk_size: int = 100_000):
+    """Returns (base, queries) drawn from a Gaussian mixture and L2 normalized."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, d)).astype("float32")
+
+    def sample(count: int) -> np.ndarray:
+        out = np.empty((count, d), dtype="float32")
+        for start in range(0, count, chunk_size):
+            size = min(chunk_size, count - start)
+            block = centers[rng.integers(0, n_clusters, size)] + \
+                rng.standard_normal((size, d), dtype="float32") * 0.6
+            block /= np.linalg.norm(block, axis=1, keepdims=True)
+            out[start:start + size] = block
+        return out
+
+    return sample(n), sample(n_queries)
@@ -0,0 +1,209 @@
+"""
+@description:
+LLMClient - one pooled, concurrent completion client for OpenAI and Azure OpenAI.
+
+The workflow calls ``await llm.ainvoke(prompt)`` and ``llm.astream(prompt)``.
+LLMClient serves both calls for either backend, built from the same
+credentials the UI collects (``from_credentials``):
+
+Concern          Handling
+---------------  --------------------------------------------------------------
+Connections      One shared httpx.AsyncClient pool with keep-alive, so requests
+                 skip the TCP and TLS handshake. ``http_client`` can be handed
+                 to the embedding client to share the pool.
+Concurrency      At most max_concurrency requests in flight. The rest wait on a
+                 semaphore instead of piling up 429s.
+Retries          429, 5xx, timeouts and connection errors are retried with full
+                 jitter backoff: uniform(0, min(max_backoff, backoff * 2^n)).
+                 A Retry-After header sets the lower bound. A stream is
+                 never retried once it has produced a token.
+Coalescing       Identical requests (same prompt and parameters) in flight at
+                 the same time share one upstream call. Every caller still
+                 gets the full token stream.
+
+Everything runs on the event loop the client is first used on, like the
+httpx pool underneath, so a server should keep one loop for it (see
+``ui/app.py``). ``vectordatabases/comparison/fake_llm_server.py`` mimics the
+completion API, including injected 429/503 errors, for local testing.
+"""
+import asyncio
+import json
+import random
+
+from utility.models import lazy_import
+
+openai = lazy_import("openai")
+httpx = lazy_import("httpx")
+
+DEFAULT_OPENAI_MODEL = "gpt-3.5-turbo-instruct"
+DEFAULT_AZURE_API_VERSION = "2024-02-01"
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and \
+        (error.status_code == 429 or error.status_code >= 500)
+
+
+def _retry_after(error: Exception) -> float:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+class _SharedStream:
+    """Tokens of one upstream call, replayed to every caller that joined it."""
+
+    def __init__(self):
+        self.tokens: list[str] = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def push(self, token: str):
+        self.tokens.append(token)
+        self._notify()
+
+    def finish(self, error: Exception = None):
+        self.error = error
+        self.done = True
+        self._notify()
+
+    async def follow(self):
+        position = 0
+        while True:
+            while position < len(self.tokens):
+                yield self.tokens[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class LLMClient:
+    def __init__(self, client, model: str, api: str = "completions", max_concurrency: int = 16,
+                 max_retries: int = 4, backoff: float = 0.5, max_backoff: float = 8.0,
+                 coalesce: bool = True, http_client=None, **params):
+        if api not in ("completions", "chat"):
+            raise ValueError(f"Unsupported api: {api}")
+        self.client = client
+        self.http_client = http_client
+        self.model = model
+        self.api = api
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.coalesce = coalesce
+        self.params = params
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+        self._limit = asyncio.Semaphore(max_concurrency)
+        self._inflight: dict[str, _SharedStream] = {}
+        self._tasks: set = set()
+
+    @classmethod
+    def from_credentials(cls, llm_type: str, url: str, key: str, model: str = None,
+                         api_version: str = None, max_connections: int = 32,
+                         timeout: float = 60.0, **kwargs) -> "LLMClient":
+        """Client for llm_type "openai" (url may be empty) or "azure" (url is the endpoint).
+
+        For Azure, model is the deployment name.
+        """
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections, keepalive_expiry=60),
+            timeout=httpx.Timeout(timeout, connect=10.0))
+        # Retries are ours (jittered, stream aware), the SDK must not add its own
+        if llm_type == "azure":
+            client = openai.AsyncAzureOpenAI(
+                azure_endpoint=url, api_key=key, api_version=api_version or DEFAULT_AZURE_API_VERSION,
+                http_client=http_client, max_retries=0)
+        elif llm_type == "openai":
+            client = openai.AsyncOpenAI(api_key=key, base_url=url or None,
+                                        http_client=http_client, max_retries=0)
+        else:
+            raise ValueError(f"Unsupported LLM type: {llm_type}")
+        kwargs.setdefault("max_concurrency", max_connections)
+        return cls(client, model or DEFAULT_OPENAI_MODEL, http_client=http_client, **kwargs)
+
+    def _delay(self, attempt: int, error: Exception) -> float:
+        jitter = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return max(jitter, min(_retry_after(error), self.max_backoff))
+
+    async def _open(self, prompt: str):
+        self.requests += 1
+        if self.api == "chat":
+            return await self.client.chat.completions.create(
+                model=self.model, messages=[{"role": "user", "content": prompt}],
+                stream=True, **self.params)
+        return await self.client.completions.create(model=self.model, prompt=prompt,
+                                                    stream=True, **self.params)
+
+    def _token(self, chunk) -> str:
+        if not chunk.choices:
+            # Azure sends a first chunk with only content filter results
+            return ""
+        if self.api == "chat":
+            return chunk.choices[0].delta.content or ""
+        return chunk.choices[0].text or ""
+
+    async def _run(self, key: str, prompt: str, shared: _SharedStream):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    async with self._limit:
+                        stream = await self._open(prompt)
+                        async for chunk in stream:
+                            token = self._token(chunk)
+                            if token:
+                                shared.push(token)
+                    break
+                except Exception as error:
+                    if shared.tokens or attempt == self.max_retries or not _retryable(error):
+                        raise
+                    self.retries += 1
+                    await asyncio.sleep(self._delay(attempt, error))
+            shared.finish()
+        except Exception as error:
+            shared.finish(error)
+        finally:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+
+    async def astream(self, prompt: str):
+        """Yields the completion of prompt token by token."""
+        key = json.dumps([self.api, self.model, prompt, self.params], sort_keys=True, default=str)
+        shared = self._inflight.get(key) if self.coalesce else None
+        if shared is None:
+            shared = _SharedStream()
+            if self.coalesce:
+                self._inflight[key] = shared
+            # A task, so the call completes for the others even if this caller stops reading
+            task = asyncio.ensure_future(self._run(key, prompt, shared))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.coalesced += 1
+        async for token in shared.follow():
+            yield token
+
+    async def ainvoke(self, prompt: str) -> str:
+        return "".join([token async for token in self.astream(prompt)])
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "retries": self.retries, "coalesced": self.coalesced,
+                "in_flight": len(self._tasks)}
+
+    async def aclose(self):
+        await self.client.close()
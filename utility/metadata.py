@@ -0,0 +1,307 @@
+"""
+@description:
+MetadataStore - columnar metadata for faiss rows, filters compiled to IDSelectors.
+
+Every row of a faiss index (row i = faiss id i) can carry a flat dict of
+metadata, like the ``metadatas`` of Chroma or the ``payload`` of Qdrant. The
+values are stored per field, not per row:
+
+Field kind   Values                 Column                    Index
+-----------  ---------------------  ------------------------  ----------------------
+category     str, bool (any JSON)   int32 code per row        one bitmap per value
+number       int, float             float64 per row, NaN      vectorized comparison
+                                    when missing
+
+Filters use the usual operators and compile to one boolean mask over all
+rows, which ``selector`` turns into a faiss ``IDSelectorBitmap``. Passed in
+the search parameters, the index only computes distances for selected rows,
+so a selective filter returns k matching hits without over-fetching:
+
+    {"source": "x", "year": {"$gt": 2020}}
+    {"$or": [{"category": {"$in": ["a", "b"]}}, {"pinned": True}]}
+
+Operators: $eq $ne $in $nin $gt $gte $lt $lte $exists, and $and $or $not
+(several keys in one dict are and-ed). $ne and $nin also match rows without
+the field.
+
+Files written for a path ``p`` (none when path is None):
+--------------------------------------------------------
+File              Description
+----------------  ----------------------------------------------------
+p.schema.json     Row count, fields with their kind and category values.
+p.fNNN.col        The column of field NNN, appended to as rows arrive.
+"""
+import json
+import os
+
+import numpy as np
+
+from utility.models import lazy_import
+
+faiss = lazy_import("faiss")
+
+_COLUMN_DTYPES = {"category": np.dtype("<i4"), "number": np.dtype("<f8")}
+_RANGE_OPS = {"$gt": np.greater, "$gte": np.greater_equal, "$lt": np.less, "$lte": np.less_equal}
+
+
+def _kind(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "number"
+    return "category"
+
+
+def _value_key(value) -> str:
+    # Category values are compared by their JSON form, so 1 != "1" != True
+    return json.dumps(value, sort_keys=True)
+
+
+def selector(mask: np.ndarray):
+    """IDSelectorBitmap selecting the rows where mask is True."""
+    bitmap = np.packbits(mask, bitorder="little")
+    sel = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    # faiss keeps a raw pointer, the array lives as long as the selector
+    sel.referenced_bitmap = bitmap
+    return sel
+
+
+class MetadataStore:
+    def __init__(self, path: str = None):
+        self.path = path
+        self.rows = 0
+        self.fields: dict[str, dict] = {}
+        # Columns are views of the first rows of buffers that grow by doubling
+        self._columns: dict[str, np.ndarray] = {}
+        self._buffers: dict[str, np.ndarray] = {}
+        self._codes: dict[str, dict[str, int]] = {}
+        self._bitmaps: dict[tuple[str, int], np.ndarray] = {}
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self._schema_path()):
+                self._load()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _schema_path(self) -> str:
+        return f"{self.path}.schema.json"
+
+    def _column_path(self, field: str) -> str:
+        return f"{self.path}.f{self.fields[field]['number']:03d}.col"
+
+    def files(self) -> list[str]:
+        """Paths of the files backing this store."""
+        if self.path is None:
+            return []
+        return [self._schema_path()] + [self._column_path(field) for field in self.fields]
+
+    def _load(self):
+        with open(self._schema_path(), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        self.rows, self.fields = schema["rows"], schema["fields"]
+        for field, spec in self.fields.items():
+            dtype = _COLUMN_DTYPES[spec["kind"]]
+            path = self._column_path(field)
+            # Rows past the schema count belong to an append that never committed
+            self._columns[field] = self._buffers[field] = \
+                np.fromfile(path, dtype=dtype, count=self.rows) \
+                if os.path.exists(path) else np.empty(0, dtype=dtype)
+            self._codes[field] = {_value_key(value): code
+                                  for code, value in enumerate(spec.get("values", []))}
+
+    def _write_schema(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self._schema_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "fields": self.fields}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._schema_path())
+
+    def _add_field(self, field: str, kind: str):
+        self.fields[field] = {"kind": kind, "number": len(self.fields)}
+        if kind == "category":
+            self.fields[field]["values"] = []
+            self._codes[field] = {}
+        self._columns[field] = self._buffers[field] = np.empty(0, dtype=_COLUMN_DTYPES[kind])
+
+    def _extend(self, field: str, block: np.ndarray):
+        """Appends block to the column, copying it only when its buffer has to grow."""
+        filled = len(self._columns[field])
+        buffer = self._buffers[field]
+        if filled + len(block) > len(buffer):
+            grown = np.empty(max(filled + len(block), 2 * len(buffer), 1024), dtype=buffer.dtype)
+            grown[:filled] = buffer[:filled]
+            buffer = self._buffers[field] = grown
+        buffer[filled:filled + len(block)] = block
+        self._columns[field] = buffer[:filled + len(block)]
+
+    def _missing(self, field: str, count: int) -> np.ndarray:
+        if self.fields[field]["kind"] == "number":
+            return np.full(count, np.nan, dtype=_COLUMN_DTYPES["number"])
+        return np.full(count, -1, dtype=_COLUMN_DTYPES["category"])
+
+    def append(self, metadatas: list[dict]):
+        """Appends one row per metadata dict ({} or None for rows without metadata)."""
+        metadatas = [m or {} for m in metadatas]
+        if not metadatas:
+            return
+        for metadata in metadatas:
+            for field, value in metadata.items():
+                if field not in self.fields:
+                    self._add_field(field, _kind(value))
+                elif self.fields[field]["kind"] != _kind(value):
+                    raise ValueError(f"Field {field!r} holds {self.fields[field]['kind']} "
+                                     f"values, got {value!r}.")
+
+        for field, spec in self.fields.items():
+            column = self._columns[field]
+            # Fields first seen in this batch have no values for the earlier rows
+            block = np.concatenate([self._missing(field, self.rows - len(column)),
+                                    self._missing(field, len(metadatas))])
+            offset = self.rows - len(column)
+            for row, metadata in enumerate(metadatas):
+                if field not in metadata:
+                    continue
+                value = metadata[field]
+                if spec["kind"] == "number":
+                    block[offset + row] = value
+                else:
+                    codes = self._codes[field]
+                    key = _value_key(value)
+                    if key not in codes:
+                        codes[key] = len(spec["values"])
+                        spec["values"].append(value)
+                    block[offset + row] = codes[key]
+            self._extend(field, block)
+            if self.path is not None:
+                with open(self._column_path(field), "r+b" if os.path.exists(
+                        self._column_path(field)) else "wb") as f:
+                    f.seek(len(column) * block.itemsize)
+                    f.truncate()
+                    f.write(block.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+        self.rows += len(metadatas)
+        # The schema holds the row count, writing it commits the append
+        self._write_schema()
+
+    def resize(self, count: int):
+        """Drops rows from count onwards, or pads with empty rows up to count."""
+        if count > self.rows:
+            self.append([{}] * (count - self.rows))
+        elif count < self.rows:
+            self.rows = count
+            for field in self.fields:
+                self._columns[field] = self._columns[field][:count]
+            self._bitmaps.clear()
+            self._write_schema()
+
+    def take(self, rows: np.ndarray, path: str = None) -> "MetadataStore":
+        """A new store holding the given rows, in that order (used by compaction)."""
+        taken = MetadataStore(path)
+        if path is not None and os.path.exists(taken._schema_path()):
+            taken.resize(0)
+        rows = np.asarray(rows, dtype=np.int64)
+        metadatas = [{} for _ in range(len(rows))]
+        for field, spec in self.fields.items():
+            values = self._columns[field][rows]
+            for row, value in enumerate(values.tolist()):
+                if spec["kind"] == "number":
+                    if value == value:
+                        metadatas[row][field] = int(value) if value.is_integer() else value
+                elif value >= 0:
+                    metadatas[row][field] = spec["values"][value]
+        taken.append(metadatas)
+        return taken
+
+    def get(self, row: int) -> dict:
+        """The metadata dict of one row."""
+        if not 0 <= row < self.rows:
+            raise IndexError(f"Row {row} is not present in the metadata store.")
+        metadata = {}
+        for field, spec in self.fields.items():
+            value = self._columns[field][row]
+            if spec["kind"] == "number" and value == value:
+                metadata[field] = int(value) if float(value).is_integer() else float(value)
+            elif spec["kind"] == "category" and value >= 0:
+                metadata[field] = spec["values"][value]
+        return metadata
+
+    def _bitmap(self, field: str, code: int) -> np.ndarray:
+        # Bitmaps are built on first use and only extended by rows added since
+        bitmap = self._bitmaps.get((field, code), np.zeros(0, dtype=bool))
+        if len(bitmap) < self.rows:
+            bitmap = np.concatenate([bitmap, self._columns[field][len(bitmap):self.rows] == code])
+            self._bitmaps[(field, code)] = bitmap
+        return bitmap[:self.rows]
+
+    def _equal(self, field: str, value) -> np.ndarray:
+        spec = self.fields[field]
+        if spec["kind"] == "number":
+            if _kind(value) != "number":
+                return np.zeros(self.rows, dtype=bool)
+            return self._columns[field] == value
+        code = self._codes[field].get(_value_key(value))
+        if code is None:
+            return np.zeros(self.rows, dtype=bool)
+        return self._bitmap(field, code)
+
+    def _field_mask(self, field: str, condition) -> np.ndarray:
+        if field not in self.fields:
+            # Nothing has the field: only negations and {"$exists": False} match
+            exists = np.zeros(self.rows, dtype=bool)
+            column = None
+        else:
+            column = self._columns[field]
+            exists = ~np.isnan(column) if self.fields[field]["kind"] == "number" else column >= 0
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        mask = np.ones(self.rows, dtype=bool)
+        for op, value in condition.items():
+            if op == "$exists":
+                mask &= exists if value else ~exists
+            elif column is None:
+                mask &= op in ("$ne", "$nin")
+            elif op == "$eq":
+                mask &= self._equal(field, value)
+            elif op == "$ne":
+                mask &= ~self._equal(field, value)
+            elif op in ("$in", "$nin"):
+                found = np.zeros(self.rows, dtype=bool)
+                for item in value:
+                    found |= self._equal(field, item)
+                mask &= found if op == "$in" else ~found
+            elif op in _RANGE_OPS:
+                if self.fields[field]["kind"] != "number":
+                    raise ValueError(f"{op} needs a numeric field, {field!r} holds categories.")
+                with np.errstate(invalid="ignore"):
+                    mask &= _RANGE_OPS[op](column, value)
+            else:
+                raise ValueError(f"Unknown filter operator: {op}")
+        return mask
+
+    def mask(self, filter: dict) -> np.ndarray:
+        """Boolean mask of the rows matching filter."""
+        mask = np.ones(self.rows, dtype=bool)
+        for key, condition in filter.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self.mask(sub)
+            elif key == "$or":
+                found = np.zeros(self.rows, dtype=bool)
+                for sub in condition:
+                    found |= self.mask(sub)
+                mask &= found
+            elif key == "$not":
+                mask &= ~self.mask(condition)
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+
+    def selector(self, filter: dict):
+        """IDSelector for an index whose faiss ids are the rows of this store."""
+        return selector(self.mask(filter))
@@ -0,0 +1,87 @@
+"""
+@description:
+Lazy imports and a per-process registry of embedding models.
+
+Importing ``sentence_transformers`` pulls in torch and takes seconds, and every
+``SentenceTransformer(...)`` call loads the weights again. The helpers here
+defer both until a model is actually needed and then keep one instance per
+model name for the life of the process:
+
+    from utility.models import get_model
+    model = get_model()              # loads all-MiniLM-L6-v2 once
+    model is get_model()             # True
+
+Worker pools that fork (multiprocessing with the fork start method, gunicorn
+with preload, ...) should call ``prewarm()`` in the parent first so every
+child inherits the loaded libraries and weights instead of loading its own.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_CROSS_ENCODER_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+_models: dict = {}
+_models_lock = threading.Lock()
+
+
+def lazy_import(name: str):
+    """Returns module name, deferring its execution until the first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def _cached(key, factory):
+    """Returns the registry entry for key, created by factory() once per process."""
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = factory()
+    return model
+
+
+def get_model(model_name: str = DEFAULT_MODEL_NAME, device: str = None):
+    """Returns the process wide SentenceTransformer for model_name, loading it on first use."""
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device=device)
+    return _cached((model_name, device), load)
+
+
+def get_cross_encoder(model_name: str = DEFAULT_CROSS_ENCODER_NAME, device: str = None):
+    """Returns the process wide CrossEncoder for model_name, loading it on first use."""
+    def load():
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name, device=device)
+    return _cached((model_name, device), load)
+
+
+def loaded_models() -> list:
+    """Returns the (model name, device) pairs loaded in this process."""
+    return list(_models)
+
+
+def prewarm(model_names=(DEFAULT_MODEL_NAME,), import_faiss: bool = True):
+    """Imports the heavy libraries and loads model_names ahead of a fork.
+
+    A tiny encode runs for every model so lazily initialised kernels and
+    tokenizer caches are built in the parent as well.
+    """
+    if import_faiss:
+        importlib.import_module("faiss")
+    for model_name in model_names:
+        get_model(model_name).encode(["warm up"], convert_to_numpy=True)
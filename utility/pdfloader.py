@@ -0,0 +1,112 @@
+"""
+@description:
+PdfLoader - streams text chunks out of PDFs page by page.
+
+Pages are parsed in a process pool, one task per range of ``pages_per_task``
+pages, while only ``workers * 2`` ranges are in flight at any time. Chunks are
+yielded in page order as soon as their range is done, so whole books and
+directories of PDFs ingest in constant memory:
+
+    loader = PdfLoader(workers=4)
+    for chunk in loader.iter_chunks("books/"):
+        ...
+    print(loader.stats)      # pages, chunks, seconds, pages_per_sec, files
+
+``stats["files"]`` maps every PDF path to its page count.
+
+``split_fn`` turns one page of text into chunks. It runs inside the worker
+processes, so it has to be picklable (a module level function or an object
+such as ``TokenChunker``). It is sent to every worker once, when the worker
+starts, and then split every range that worker parses, so state it loads
+lazily (a tokenizer) is loaded once per worker.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def split_sentences(text: str) -> list[str]:
+    """Splits page text into sentences on '.'."""
+    return text.split(".")
+
+
+def _page_count(pdf_path: str) -> int:
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+# split_fn of the PdfLoader that started this worker process
+_split_fn = None
+
+
+def _init_worker(split_fn) -> None:
+    global _split_fn
+    _split_fn = split_fn
+
+
+def _parse_range(pdf_path: str, first_page: int, last_page: int) -> list[list[str]]:
+    """Extracts and splits pages [first_page, last_page) of one PDF."""
+    import fitz
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        for page_number in range(first_page, last_page):
+            pages.append(_split_fn(doc.load_page(page_number).get_text("text")))
+    return pages
+
+
+def pdf_paths(path: str) -> list[str]:
+    """Returns path itself or every PDF below path when it is a directory."""
+    if not os.path.isdir(path):
+        return [path]
+    found = []
+    for root, _, files in os.walk(path):
+        found.extend(os.path.join(root, name) for name in files
+                     if name.lower().endswith(".pdf"))
+    return sorted(found)
+
+
+class PdfLoader:
+    def __init__(self, workers: int = None, pages_per_task: int = 8, split_fn=split_sentences):
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.split_fn = split_fn
+        self.stats = {"pages": 0, "chunks": 0, "seconds": 0.0, "pages_per_sec": 0.0, "files": {}}
+
+    def _tasks(self, paths: list[str]):
+        for pdf_path in paths:
+            page_count = _page_count(pdf_path)
+            self.stats["files"][pdf_path] = page_count
+            for first in range(0, page_count, self.pages_per_task):
+                yield pdf_path, first, min(first + self.pages_per_task, page_count)
+
+    def iter_pages(self, path: str):
+        """Yields the chunk list of every page, in document and page order."""
+        start = time.perf_counter()
+        self.stats = {"pages": 0, "chunks": 0, "seconds": 0.0, "pages_per_sec": 0.0, "files": {}}
+        tasks = self._tasks(pdf_paths(path))
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.split_fn,)) as pool:
+            for _ in range(self.workers * 2):
+                task = next(tasks, None)
+                if task is None:
+                    break
+                in_flight.append(pool.submit(_parse_range, *task))
+            while in_flight:
+                pages = in_flight.popleft().result()
+                task = next(tasks, None)
+                if task is not None:
+                    in_flight.append(pool.submit(_parse_range, *task))
+                for chunks in pages:
+                    self.stats["pages"] += 1
+                    self.stats["chunks"] += len(chunks)
+                    yield chunks
+                self.stats["seconds"] = time.perf_counter() - start
+                self.stats["pages_per_sec"] = self.stats["pages"] / self.stats["seconds"]
+
+    def iter_chunks(self, path: str):
+        """Yields every chunk of every page of path (a PDF or a directory of PDFs)."""
+        for chunks in self.iter_pages(path):
+            yield from chunks
@@ -0,0 +1,166 @@
+"""
+@description:
+Streaming ingestion - parse, embed and index as overlapping stages.
+
+    source iterable --> [parser thread] --bounded queue--> [encode pool]
+                    --in order--> add_fn(texts, vectors)  (calling thread)
+
+The parser thread groups the source into batches of ``batch_size`` texts, a
+thread or process pool encodes the batches and the calling thread hands each
+encoded batch to ``add_fn`` in source order, so faiss ids still follow the
+order of the input. At most ``queue_depth`` parsed batches plus
+``workers + queue_depth`` encoded batches are alive at once, peak memory is
+therefore bounded by the queue depth and not by the corpus size.
+
+``IndexWriter`` is the usual ``add_fn``: it adds to any faiss index and, for
+indexes that need training (IVF, PQ), buffers the first ``train_size``
+vectors, trains on them and streams everything after that straight in.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from utility.models import DEFAULT_MODEL_NAME, get_model
+
+_DONE = object()
+
+
+def _encode_batch(model_name: str, encode_kwargs: dict, texts: list[str]) -> np.ndarray:
+    # Runs inside the pool, each process loads the shared model once
+    return np.asarray(get_model(model_name).encode(texts, convert_to_numpy=True,
+                                                   **encode_kwargs), dtype="float32")
+
+
+def _timed_encode(encode_fn, texts: list[str]):
+    start = time.perf_counter()
+    vectors = encode_fn(texts)
+    return vectors, time.perf_counter() - start
+
+
+def model_encoder(model_name: str = DEFAULT_MODEL_NAME, **encode_kwargs):
+    """Returns a picklable encode function usable with both pool types."""
+    return partial(_encode_batch, model_name, encode_kwargs)
+
+
+class IndexWriter:
+    def __init__(self, index, train_size: int = 0):
+        self.index = index
+        self.train_size = train_size
+        self.seconds = 0.0
+        self._pending: list[np.ndarray] = []
+        self._pending_rows = 0
+
+    def __call__(self, texts: list[str], vectors: np.ndarray):
+        start = time.perf_counter()
+        if self.index.is_trained:
+            self.index.add(vectors)
+        else:
+            self._pending.append(vectors)
+            self._pending_rows += len(vectors)
+            if self._pending_rows >= self.train_size:
+                self._train_and_flush()
+        self.seconds += time.perf_counter() - start
+
+    def _train_and_flush(self):
+        sample = np.concatenate(self._pending)
+        self.index.train(sample)
+        self.index.add(sample)
+        self._pending, self._pending_rows = [], 0
+
+    def close(self):
+        """Trains on whatever is buffered when the source ran out before train_size."""
+        start = time.perf_counter()
+        if self._pending:
+            self._train_and_flush()
+        self.seconds += time.perf_counter() - start
+
+
+class IngestionPipeline:
+    def __init__(self, encode_fn, add_fn, batch_size: int = 64, queue_depth: int = 4,
+                 workers: int = 2, use_processes: bool = False):
+        self.encode_fn = encode_fn
+        self.add_fn = add_fn
+        self.batch_size = batch_size
+        self.queue_depth = queue_depth
+        self.workers = workers
+        self.use_processes = use_processes
+        self.stats = {}
+
+    def _parse(self, source, parsed: queue.Queue, errors: list, stop: threading.Event):
+        batch = []
+        try:
+            for text in source:
+                if stop.is_set():
+                    return
+                batch.append(text)
+                if len(batch) == self.batch_size:
+                    parsed.put(batch)
+                    batch = []
+            if batch:
+                parsed.put(batch)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            parsed.put(_DONE)
+
+    def run(self, source) -> dict:
+        """Consumes source (any iterable of texts) and returns ingestion stats."""
+        parsed = queue.Queue(maxsize=self.queue_depth)
+        errors, stop = [], threading.Event()
+        parser = threading.Thread(target=self._parse, args=(source, parsed, errors, stop),
+                                  name="ingest-parser", daemon=True)
+        pool_type = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        in_flight = deque()
+        texts_total, batches, add_seconds, encode_seconds = 0, 0, 0.0, 0.0
+        start = time.perf_counter()
+
+        def drain_one():
+            nonlocal texts_total, batches, add_seconds, encode_seconds
+            texts, future = in_flight.popleft()
+            vectors, seconds = future.result()
+            encode_seconds += seconds
+            add_start = time.perf_counter()
+            self.add_fn(texts, vectors)
+            add_seconds += time.perf_counter() - add_start
+            texts_total += len(texts)
+            batches += 1
+
+        parser.start()
+        try:
+            with pool_type(max_workers=self.workers) as pool:
+                while True:
+                    batch = parsed.get()
+                    if batch is _DONE:
+                        break
+                    in_flight.append((batch, pool.submit(_timed_encode, self.encode_fn, batch)))
+                    if len(in_flight) >= self.workers + self.queue_depth:
+                        drain_one()
+                while in_flight:
+                    drain_one()
+        finally:
+            stop.set()
+            # Unblock the parser if it is waiting on a full queue
+            while parser.is_alive():
+                try:
+                    parsed.get_nowait()
+                except queue.Empty:
+                    parser.join(0.01)
+        if errors:
+            raise errors[0]
+
+        elapsed = time.perf_counter() - start
+        self.stats = {
+            "texts": texts_total,
+            "batches": batches,
+            "seconds": elapsed,
+            # Summed over the pool workers, so it can exceed the wall time
+            "encode_seconds": encode_seconds,
+            "add_seconds": add_seconds,
+            "texts_per_sec": texts_total / elapsed if elapsed > 0 else 0.0,
+        }
+        return self.stats
@@ -0,0 +1,165 @@
+"""
+@description:
+QueryEmbeddingCache - an in-memory LRU/TTL cache of query embeddings with single-flight.
+
+Hot queries repeat constantly, and every repeat used to pay a full encoder
+call (a local forward pass, or a round trip to an embedding API). Query
+vectors are cached here under (model name, normalized text). The text is
+normalized like the document cache (``utility.embedding_cache``), so
+whitespace and Unicode variants hit. Case is kept, since embedding APIs
+are case sensitive. Unlike document embeddings, query embeddings
+stay in memory and are bounded:
+
+Setting       Effect
+------------  -------------------------------------------------------------
+max_entries   Least recently used vectors are evicted beyond this count.
+ttl           Vectors expire ttl seconds after they were computed (None: never).
+
+Single-flight: when several threads or coroutines ask for the same uncached
+query at once, the first computes it and the others wait for its result.
+So a burst of identical queries costs one encode. ``stats()`` reports the
+hits, misses, coalesced waits and the hit rate (hits and coalesced waits
+both skip the encoder).
+
+``CachedQueryEmbeddings`` wraps any LangChain ``Embeddings``: queries go
+through the cache, documents go straight to the wrapped model.
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utility.embedding_cache import normalize_text
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries: int = 10_000, ttl: float = None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: dict[tuple, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        vector, expires = entry
+        if expires is not None and expires <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return vector
+
+    def _put(self, key: tuple, vector: np.ndarray):
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (vector, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _join(self, model_name: str, text: str):
+        """Returns (key, cached vector or None, in-flight future, whether this caller leads)."""
+        key = (model_name, normalize_text(text))
+        with self._lock:
+            vector = self._get(key)
+            if vector is not None:
+                self.hits += 1
+                return key, vector, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return key, None, future, False
+            self.misses += 1
+            future = self._inflight[key] = concurrent.futures.Future()
+            return key, None, future, True
+
+    def _settle(self, key: tuple, future: concurrent.futures.Future, vector=None,
+                error: BaseException = None):
+        with self._lock:
+            if error is None:
+                self._put(key, vector)
+            del self._inflight[key]
+        if error is None:
+            future.set_result(vector)
+        else:
+            future.set_exception(error)
+
+    def get_or_compute(self, model_name: str, text: str, compute) -> list[float]:
+        """The cached vector of text, or compute() once for all concurrent callers."""
+        key, vector, future, leader = self._join(model_name, text)
+        if vector is not None:
+            return vector.tolist()
+        if not leader:
+            return future.result().tolist()
+        try:
+            vector = np.asarray(compute(), dtype=np.float32)
+        except BaseException as error:
+            self._settle(key, future, error=error)
+            raise
+        self._settle(key, future, vector)
+        return vector.tolist()
+
+    async def aget_or_compute(self, model_name: str, text: str, acompute) -> list[float]:
+        """Async get_or_compute, acompute() returns an awaitable of the vector."""
+        key, vector, future, leader = self._join(model_name, text)
+        if vector is not None:
+            return vector.tolist()
+        if not leader:
+            return (await asyncio.wrap_future(future)).tolist()
+        try:
+            vector = np.asarray(await acompute(), dtype=np.float32)
+        except BaseException as error:
+            self._settle(key, future, error=error)
+            raise
+        self._settle(key, future, vector)
+        return vector.tolist()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "coalesced": self.coalesced, "evictions": self.evictions,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0}
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """LangChain Embeddings whose query vectors come from a QueryEmbeddingCache."""
+
+    def __init__(self, embeddings: Embeddings, cache: QueryEmbeddingCache = None,
+                 model_name: str = None):
+        self.embeddings = embeddings
+        self.cache = cache or QueryEmbeddingCache()
+        # The cache key: one cache can then serve several models
+        self.model_name = model_name or getattr(embeddings, "model_name", None) or \
+            getattr(embeddings, "model", None) or type(embeddings).__name__
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.cache.get_or_compute(self.model_name, text,
+                                         lambda: self.embeddings.embed_query(text))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.cache.aget_or_compute(self.model_name, text,
+                                                lambda: self.embeddings.aembed_query(text))
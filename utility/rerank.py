@@ -0,0 +1,82 @@
+"""
+@description:
+Local rerankers for hybrid search: rank fusion and a batched cross-encoder.
+
+Both take the candidates the retrievers returned and give them back ordered,
+with a score, without calling an LLM:
+
+Reranker                 Cost per query              Uses
+-----------------------  --------------------------  ---------------------------------
+reciprocal_rank_fusion   microseconds, no model      The ranks of every result list.
+CrossEncoderReranker     one batched forward pass    The query and candidate texts.
+
+Reciprocal rank fusion scores an item by ``sum(weight / (k + rank))`` over the
+lists it appears in (rank from 1). It needs no score calibration between
+FAISS distances and BM25 scores, and items found by both retrievers rise to
+the top. The cross-encoder (``cross-encoder/ms-marco-MiniLM-L-6-v2`` by default,
+loaded once per process through ``utility.models``) reads every (query, text)
+pair. It is slower but more precise. The pairs are sorted by length before
+batching, so a batch pads to similar lengths.
+"""
+import numpy as np
+
+from utility.models import DEFAULT_CROSS_ENCODER_NAME, get_cross_encoder
+
+
+def reciprocal_rank_fusion(rankings: list[list], k: int = 60, weights: list[float] = None,
+                           key=None) -> list[tuple]:
+    """Fuses ranked lists into one list of (item, score), best first.
+
+    key maps an item to its identity (default: the item itself), so the same
+    document coming from two retrievers counts once. The first occurrence of
+    an item is the one returned.
+    """
+    weights = weights or [1.0] * len(rankings)
+    key = key or (lambda item: item)
+    scores, items = {}, {}
+    for ranking, weight in zip(rankings, weights):
+        seen = set()
+        for rank, item in enumerate(ranking, start=1):
+            item_key = key(item)
+            if item_key in seen:
+                continue
+            seen.add(item_key)
+            items.setdefault(item_key, item)
+            scores[item_key] = scores.get(item_key, 0.0) + weight / (k + rank)
+    # sorted is stable: ties keep the order of the first list
+    return [(items[item_key], score)
+            for item_key, score in sorted(scores.items(), key=lambda pair: -pair[1])]
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = DEFAULT_CROSS_ENCODER_NAME, batch_size: int = 32,
+                 device: str = "cpu"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+
+    @property
+    def model(self):
+        return get_cross_encoder(self.model_name, self.device)
+
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        """Relevance score of every text for query, in the order of texts."""
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        sorted_scores = self.model.predict([(query, texts[i]) for i in order],
+                                           batch_size=self.batch_size, convert_to_numpy=True,
+                                           show_progress_bar=False)
+        scores = np.empty(len(texts), dtype=np.float32)
+        scores[order] = np.asarray(sorted_scores, dtype=np.float32).reshape(-1)
+        return scores
+
+    def rerank(self, query: str, items: list, top_k: int = None, text=None) -> list[tuple]:
+        """Orders items by cross-encoder score, as (item, score) pairs, best first.
+
+        text maps an item to the text to score (default: the item itself).
+        """
+        text = text or (lambda item: item)
+        scores = self.score(query, [text(item) for item in items])
+        best = np.argsort(-scores, kind="stable")[:top_k]
+        return [(items[i], float(scores[i])) for i in best]
@@ -0,0 +1,162 @@
+"""
+@description:
+ShardedIndex - a corpus hash-partitioned over N independent faiss indexes.
+
+Every vector has a global id (its row in the corpus unless ids are given);
+``shard_of`` hashes the id to one of ``n_shards`` shards, so shards stay
+balanced whatever the order of the input and an id always lands in the same
+shard. Each shard is a plain Flat/IVF/HNSW index made by ``build_index``.
+
+Files under ``directory``:
+--------------------------------------------------------------------
+File              Description
+----------------  --------------------------------------------------
+shards.json       Index type, build parameters, d and per shard counts.
+shard-NNN.index   The faiss index of shard NNN.
+shard-NNN.ids     int64 global id of every shard row, in faiss id order.
+
+Shards are built one after another, on a thread pool, or on a process pool
+(``use_processes=True``, each worker builds and writes its own shard file).
+``search`` fans a query batch out to all shards on a thread pool (faiss
+releases the GIL while searching) and merges the per shard top-k lists with
+a heap. ``rebuild_shard`` replaces one shard without touching the others.
+"""
+import heapq
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from utility.indexes import build_index, set_search_params
+from utility.models import lazy_import
+
+faiss = lazy_import("faiss")
+
+MANIFEST_NAME = "shards.json"
+
+
+def shard_of(ids: np.ndarray, n_shards: int) -> np.ndarray:
+    """Shard number of every id (splitmix64 finalizer, so ids need not be random)."""
+    x = np.asarray(ids, dtype="int64").astype("uint64")
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x % np.uint64(n_shards)).astype("int64")
+
+
+def _build_shard(directory: str, shard: int, kind: str, vectors: np.ndarray, ids: np.ndarray,
+                 train_size: int, params: dict) -> int:
+    # Runs inside the pool, writes the shard files and returns the shard size
+    index = build_index(kind, vectors, train_size=train_size, **params)
+    path = os.path.join(directory, f"shard-{shard:03d}")
+    faiss.write_index(index, f"{path}.index.tmp")
+    os.replace(f"{path}.index.tmp", f"{path}.index")
+    np.asarray(ids, dtype="int64").tofile(f"{path}.ids.tmp")
+    os.replace(f"{path}.ids.tmp", f"{path}.ids")
+    return index.ntotal
+
+
+class ShardedIndex:
+    def __init__(self, directory: str, n_shards: int = 4, kind: str = "flat",
+                 search_threads: int = None, **params):
+        self.directory = directory
+        self.n_shards = n_shards
+        self.kind = kind
+        self.params = params
+        self.d = None
+        self.shards = []
+        self.shard_ids = []
+        # LazyLoader is not thread safe before Python 3.12, load faiss before the pools use it
+        faiss.omp_get_max_threads()
+        self._pool = ThreadPoolExecutor(max_workers=search_threads or n_shards)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(index.ntotal for index in self.shards)
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard-{shard:03d}")
+
+    def _write_manifest(self, sizes: list[int]):
+        manifest = {"kind": self.kind, "n_shards": self.n_shards, "d": self.d,
+                    "params": self.params, "sizes": sizes}
+        tmp_path = os.path.join(self.directory, f"{MANIFEST_NAME}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST_NAME))
+
+    def _load_shard(self, shard: int):
+        path = self._shard_path(shard)
+        return faiss.read_index(f"{path}.index"), np.fromfile(f"{path}.ids", dtype="int64")
+
+    def build(self, vectors: np.ndarray, ids: np.ndarray = None, workers: int = None,
+              use_processes: bool = False, train_size: int = None) -> "ShardedIndex":
+        """Partitions vectors by id hash, builds every shard and loads them."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        ids = np.arange(len(vectors), dtype="int64") if ids is None else np.asarray(ids, "int64")
+        self.d = vectors.shape[1]
+        os.makedirs(self.directory, exist_ok=True)
+
+        owner = shard_of(ids, self.n_shards)
+        parts = [np.flatnonzero(owner == shard) for shard in range(self.n_shards)]
+        pool_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool_type(max_workers=workers or self.n_shards) as pool:
+            futures = [pool.submit(_build_shard, self.directory, shard, self.kind,
+                                   vectors[rows], ids[rows], train_size, self.params)
+                       for shard, rows in enumerate(parts)]
+            sizes = [future.result() for future in futures]
+        self._write_manifest(sizes)
+        return self.load()
+
+    def rebuild_shard(self, shard: int, vectors: np.ndarray, ids: np.ndarray,
+                      train_size: int = None):
+        """Rebuilds one shard from its full contents, the other shards are untouched."""
+        ids = np.asarray(ids, dtype="int64")
+        if np.any(shard_of(ids, self.n_shards) != shard):
+            raise ValueError(f"Some ids do not hash to shard {shard}.")
+        size = _build_shard(self.directory, shard, self.kind,
+                            np.ascontiguousarray(vectors, dtype="float32"), ids, train_size,
+                            self.params)
+        self._write_manifest([size if i == shard else index.ntotal
+                              for i, index in enumerate(self.shards)])
+        self.shards[shard], self.shard_ids[shard] = self._load_shard(shard)
+
+    def load(self) -> "ShardedIndex":
+        with open(os.path.join(self.directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.kind, self.n_shards = manifest["kind"], manifest["n_shards"]
+        self.d, self.params = manifest["d"], manifest["params"]
+        loaded = list(self._pool.map(self._load_shard, range(self.n_shards)))
+        self.shards = [index for index, _ in loaded]
+        self.shard_ids = [ids for _, ids in loaded]
+        return self
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        for index in self.shards:
+            set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+
+    def _search_shard(self, shard: int, queries: np.ndarray, k: int):
+        distances, rows = self.shards[shard].search(queries, k)
+        ids = np.where(rows >= 0, self.shard_ids[shard][np.maximum(rows, 0)], -1)
+        return distances, ids
+
+    def search(self, queries: np.ndarray, k: int):
+        """Same contract as faiss Index.search, ids are global ids, -1 padded."""
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        results = list(self._pool.map(lambda shard: self._search_shard(shard, queries, k),
+                                      range(self.n_shards)))
+        out_dist = np.full((len(queries), k), np.inf, dtype="float32")
+        out_ids = np.full((len(queries), k), -1, dtype="int64")
+        for q in range(len(queries)):
+            # Every shard list is sorted, a heap merge only reads the first k entries
+            runs = [zip(distances[q], ids[q]) for distances, ids in results]
+            merged = (hit for hit in heapq.merge(*runs) if hit[1] >= 0)
+            for rank, (distance, idx) in enumerate(islice(merged, k)):
+                out_dist[q, rank], out_ids[q, rank] = distance, idx
+        return out_dist, out_ids
+
+    def close(self):
+        self._pool.shutdown()
@@ -0,0 +1,126 @@
+"""
+@description:
+SnapshotStore - versioned, immutable faiss index files with fast cold start.
+
+Every ``save`` writes a new ``index-000001.bin``, ``index-000002.bin``, ...
+(write-then-rename) and then atomically points ``CURRENT.json`` at it, along
+with the index type, vector count and any tuned parameters. Snapshot files
+are never modified after they are written, which makes them safe to memory
+map: ``open`` maps the file read-only instead of reading it, so a new serving
+process can answer queries right away, whatever the index size, and the OS
+page cache is shared between processes serving the same snapshot.
+
+faiss flag           What is mapped
+-------------------  --------------------------------------------------------
+IO_FLAG_MMAP_IFC     Flat codes, HNSW storage/graph and IVF lists, zero-copy
+                     (recent faiss versions).
+IO_FLAG_MMAP         IVF inverted lists only (older faiss versions).
+
+When neither flag applies to an index type, ``open`` falls back to a normal
+``read_index``.
+"""
+import json
+import os
+import re
+import time
+
+from utility.indexes import set_search_params
+from utility.models import lazy_import
+
+faiss = lazy_import("faiss")
+
+CURRENT_NAME = "CURRENT.json"
+_SNAPSHOT_FILE = re.compile(r"^index-(\d{6})\.bin$")
+
+
+def _mmap_flags() -> int:
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None) or faiss.IO_FLAG_MMAP
+    return flag | faiss.IO_FLAG_READ_ONLY
+
+
+class SnapshotStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.current_path = os.path.join(directory, CURRENT_NAME)
+
+    def _snapshot_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"index-{version:06d}.bin")
+
+    def versions(self) -> list[int]:
+        """Versions present on disk, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(m.group(1)) for m in map(_SNAPSHOT_FILE.match,
+                                                   os.listdir(self.directory)) if m)
+
+    def current(self) -> dict:
+        """The CURRENT.json entry, or {} when nothing was saved yet."""
+        if not os.path.exists(self.current_path):
+            return {}
+        with open(self.current_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def exists(self) -> bool:
+        return bool(self.current())
+
+    def save(self, index, params: dict = None) -> int:
+        """Writes index as a new snapshot and makes it current, returns its version."""
+        os.makedirs(self.directory, exist_ok=True)
+        version = max(self.versions(), default=0) + 1
+        path = self._snapshot_path(version)
+        faiss.write_index(index, f"{path}.tmp")
+        with open(f"{path}.tmp", "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+        entry = {
+            "version": version,
+            "file": os.path.basename(path),
+            "type": type(faiss.downcast_index(index)).__name__,
+            "d": index.d,
+            "ntotal": index.ntotal,
+            "params": params or {},
+            "created": time.time(),
+        }
+        tmp_current = f"{self.current_path}.tmp"
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_current, self.current_path)
+        return version
+
+    def open(self, version: int = None, mmap: bool = True):
+        """Opens a snapshot (current by default) and applies its search parameters.
+
+        Returns (index, entry). With mmap the index is read-only and backed by
+        the snapshot file.
+        """
+        entry = self.current()
+        if version is not None and version != entry.get("version"):
+            entry = {"version": version, "file": os.path.basename(self._snapshot_path(version)),
+                     "params": {}}
+        if not entry:
+            raise FileNotFoundError(f"No snapshot saved under {self.directory}.")
+        path = os.path.join(self.directory, entry["file"])
+
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(path, _mmap_flags())
+            except RuntimeError:
+                index = None
+        if index is None:
+            index = faiss.read_index(path)
+
+        params = entry.get("params", {})
+        set_search_params(index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+        return index, entry
+
+    def prune(self, keep: int = 3):
+        """Deletes all but the newest keep snapshots; the current one is always kept."""
+        current = self.current().get("version")
+        versions = self.versions()
+        for version in versions[:max(0, len(versions) - keep)]:
+            if version != current:
+                os.remove(self._snapshot_path(version))
@@ -0,0 +1,151 @@
+"""
+@description:
+Parameter tuning for IVF and HNSW against a recall@k target.
+
+Given a sample of the corpus, ``tune_index`` holds out a set of queries,
+computes their exact neighbours with ``IndexFlatL2`` and sweeps:
+
+Index   Build parameters            Search parameter (swept per build)
+------  --------------------------  ----------------------------------
+ivf     nlist                       nprobe
+hnsw    M, efConstruction           efSearch
+
+For every build the smallest search parameter that reaches the target recall
+is kept, and the fastest of those settings (median query latency) wins. The
+result is a plain dict that ``save_params`` writes next to the index and
+``load_params`` reads back. Parameters tuned on a sample can be carried over
+to the full corpus with ``scale_params``.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from utility.indexes import (build_index, default_nlist, exact_ground_truth, recall_at_k,
+                             set_search_params)
+
+
+def _median_latency_ms(index, queries: np.ndarray, k: int) -> float:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000)
+
+
+def _first_meeting_target(index, queries, truth, k, target_recall, name, values):
+    """Returns (value, recall) for the smallest value reaching the target, else None."""
+    for value in sorted(values):
+        set_search_params(index, **{name: value})
+        _, ids = index.search(queries, k)
+        recall = recall_at_k(ids, truth, k)
+        if recall >= target_recall:
+            return value, recall
+    return None
+
+
+def tune_ivf(base, queries, truth, k, target_recall, nlists=None, nprobes=None,
+             train_size=None) -> list[dict]:
+    """Sweeps nlist/nprobe, returns every setting that met the target."""
+    n = len(base)
+    nlists = nlists or sorted({max(1, default_nlist(n) // 2), default_nlist(n),
+                               min(n // 39, default_nlist(n) * 2)} - {0})
+    candidates = []
+    for nlist in nlists:
+        index = build_index("ivf", base, train_size=train_size, nlist=nlist)
+        # nprobe = nlist scans every list (exact), so small corpora always reach the target
+        probes = nprobes or sorted({p for p in (1, 2, 4, 8, 16, 32, 64, 128, 256) if p < nlist}
+                                   | {nlist})
+        found = _first_meeting_target(index, queries, truth, k, target_recall, "nprobe", probes)
+        if found is None:
+            continue
+        nprobe, recall = found
+        set_search_params(index, nprobe=nprobe)
+        candidates.append({"index": "ivf", "nlist": nlist, "nprobe": nprobe, "recall": recall,
+                           "latency_ms": _median_latency_ms(index, queries, k)})
+    return candidates
+
+
+def tune_hnsw(base, queries, truth, k, target_recall, Ms=(8, 16, 32),
+              ef_constructions=(40, 100, 200), ef_searches=(16, 32, 64, 128, 256, 512)) -> list[dict]:
+    """Sweeps M/efConstruction/efSearch, returns every setting that met the target."""
+    candidates = []
+    for M in Ms:
+        for ef_construction in ef_constructions:
+            index = build_index("hnsw", base, M=M, ef_construction=ef_construction)
+            searches = [ef for ef in ef_searches if ef >= k]
+            found = _first_meeting_target(index, queries, truth, k, target_recall,
+                                          "ef_search", searches)
+            if found is None:
+                continue
+            ef_search, recall = found
+            set_search_params(index, ef_search=ef_search)
+            candidates.append({"index": "hnsw", "M": M, "ef_construction": ef_construction,
+                               "ef_search": ef_search, "recall": recall,
+                               "latency_ms": _median_latency_ms(index, queries, k)})
+    return candidates
+
+
+def tune_index(kind: str, sample: np.ndarray, target_recall: float = 0.95, k: int = 10,
+               n_queries: int = 200, seed: int = 0, **grid) -> dict:
+    """Returns the fastest parameters of kind reaching target_recall on sample."""
+    sample = np.ascontiguousarray(sample, dtype="float32")
+    # At most a fifth of a small sample is held out as queries
+    n_queries = min(n_queries, len(sample) // 5)
+    if n_queries < 1 or len(sample) - n_queries < k:
+        raise ValueError(f"Sample of {len(sample)} vectors is too small to tune for k={k}.")
+    rng = np.random.default_rng(seed)
+    held_out = rng.permutation(len(sample))
+    queries, base = sample[held_out[:n_queries]], sample[np.sort(held_out[n_queries:])]
+    truth = exact_ground_truth(base, queries, k)
+
+    if kind == "ivf":
+        candidates = tune_ivf(base, queries, truth, k, target_recall, **grid)
+    elif kind == "hnsw":
+        candidates = tune_hnsw(base, queries, truth, k, target_recall, **grid)
+    else:
+        raise ValueError(f"Only ivf and hnsw indexes have parameters to tune, got {kind}.")
+    if not candidates:
+        raise ValueError(f"No {kind} setting in the grid reached recall@{k} >= {target_recall}.")
+
+    best = min(candidates, key=lambda c: c["latency_ms"])
+    return {**best, "k": k, "target_recall": target_recall, "sample_size": len(base)}
+
+
+def scale_params(params: dict, n: int) -> dict:
+    """Adapts IVF parameters tuned on a sample to a corpus of n vectors.
+
+    nlist grows with sqrt(n) and nprobe keeps its share of the lists; HNSW
+    parameters do not depend on the corpus size and are returned unchanged.
+    """
+    if params["index"] != "ivf":
+        return dict(params)
+    factor = np.sqrt(n / params["sample_size"])
+    nlist = max(1, min(int(round(params["nlist"] * factor)), max(1, n // 39)))
+    nprobe = max(1, min(nlist, int(round(params["nprobe"] * nlist / params["nlist"]))))
+    return {**params, "nlist": nlist, "nprobe": nprobe}
+
+
+def params_path(index_path: str) -> str:
+    return f"{index_path}.params.json"
+
+
+def save_params(index_path: str, params: dict):
+    """Writes the tuned parameters next to the index file (write-then-rename)."""
+    path = params_path(index_path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_params(index_path: str) -> dict:
+    """Returns the parameters stored next to index_path, or {} when there are none."""
+    path = params_path(index_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,167 @@
+"""
+Throughput benchmark for the embedding backends (utility.encoders).
+
+A synthetic corpus of mixed length texts (short titles up to full 256 token
+chunks, log-normal like real chunker output) is encoded by every backend:
+
+Backend            What runs
+-----------------  -----------------------------------------------------------
+baseline           SentenceTransformer.encode(texts, batch_size=50), the
+                   current path of faiss_ivf_hnsw_large_file.py.
+torch-bucketed     TorchEncoder: the same model, length buckets sized by a
+                   token budget.
+onnx-fp32          OnnxEncoder on model.onnx            (with --onnx-dir)
+onnx-int8          OnnxEncoder on model_int8.onnx       (with --onnx-dir)
+
+Per backend it records:
+
+Metric               Description
+-------------------  --------------------------------------------------------
+sentences_per_sec    Best of --repeat timed runs, after a warm-up encode.
+speedup              sentences_per_sec / the baseline's.
+padding_efficiency   Real tokens / padded tokens of the batches it ran.
+cosine_mean/min      Agreement of its vectors with the baseline's.
+
+The ONNX model directory is written once with --export (needs torch):
+
+    python -m vectordatabases.comparison.embedding_benchmark --onnx-dir models/all-MiniLM-L6-v2-onnx --export
+    python -m vectordatabases.comparison.embedding_benchmark --onnx-dir models/all-MiniLM-L6-v2-onnx --texts 5000
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from utility.encoders import (OnnxEncoder, TorchEncoder, export_onnx, padding_efficiency,
+                              plan_batches)
+from utility.models import DEFAULT_MODEL_NAME
+
+WORDS = ("time series forecasting model trend seasonal component variance data analysis "
+         "autoregressive moving average stationary process estimate residual spectral "
+         "frequency filter regression likelihood parameter sample error prediction interval "
+         "the of and a to in is that for with as by on are this be").split()
+
+
+def synthetic_texts(n: int, seed: int = 0) -> list[str]:
+    """Mixed length sentences: mostly short, a long tail up to ~250 words."""
+    rng = np.random.default_rng(seed)
+    lengths = np.clip(rng.lognormal(mean=3.0, sigma=0.9, size=n), 3, 250).astype(int)
+    return [" ".join(rng.choice(WORDS, size=length)) + "." for length in lengths]
+
+
+def time_encode(encode, texts: list[str], repeat: int) -> tuple[np.ndarray, float]:
+    """(vectors, best seconds) of repeat timed runs after one warm-up."""
+    encode(texts[:32])
+    best, vectors = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = np.asarray(encode(texts), dtype=np.float32)
+        best = min(best, time.perf_counter() - start)
+    return vectors, best
+
+
+def agreement(vectors: np.ndarray, reference: np.ndarray) -> dict:
+    if vectors.shape != reference.shape:
+        # A model directory exported from another model
+        return {"cosine_mean": None, "cosine_min": None}
+
+    def unit(x):
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+    cosine = np.sum(unit(vectors) * unit(reference), axis=1)
+    return {"cosine_mean": float(cosine.mean()), "cosine_min": float(cosine.min())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--batch-size", type=int, default=50, help="Baseline batch size")
+    parser.add_argument("--max-tokens", type=int, default=16384,
+                        help="Padded tokens per bucketed batch")
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--bucket-width", type=int, default=16, help="Tokens per length bucket")
+    parser.add_argument("--onnx-dir", default=None, help="Directory written by export_onnx")
+    parser.add_argument("--export", action="store_true",
+                        help="Export the model to --onnx-dir first")
+    parser.add_argument("--threads", type=int, default=None, help="onnxruntime intra-op threads")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="embedding_benchmark.json")
+    args = parser.parse_args()
+
+    if args.export:
+        if not args.onnx_dir:
+            parser.error("--export needs --onnx-dir")
+        start = time.perf_counter()
+        export_onnx(args.onnx_dir, args.model)
+        print(f"ONNX export Time: {time.perf_counter() - start:.5f} sec")
+
+    texts = synthetic_texts(args.texts, args.seed)
+    bucketed = dict(max_tokens=args.max_tokens, max_batch_size=args.max_batch_size,
+                    bucket_width=args.bucket_width)
+    torch_encoder = TorchEncoder(args.model, **bucketed)
+    model = torch_encoder.model
+    lengths = torch_encoder.token_lengths(texts)
+    print(f"{len(texts)} texts, {int(lengths.sum())} tokens "
+          f"(min {lengths.min()}, median {int(np.median(lengths))}, max {lengths.max()})")
+
+    # sentence-transformers sorts by text length, then cuts fixed size batches
+    order = np.argsort([-len(text) for text in texts], kind="stable")
+    baseline_batches = [order[i:i + args.batch_size]
+                        for i in range(0, len(order), args.batch_size)]
+    backends = [
+        ("baseline", lambda batch: model.encode(batch, batch_size=args.batch_size,
+                                                convert_to_numpy=True, show_progress_bar=False),
+         padding_efficiency(lengths, baseline_batches)),
+        ("torch-bucketed", torch_encoder.encode,
+         padding_efficiency(lengths, plan_batches(lengths, **bucketed))),
+    ]
+    if args.onnx_dir:
+        for quantized in (False, True):
+            encoder = OnnxEncoder(args.onnx_dir, quantized=quantized, threads=args.threads,
+                                  **bucketed)
+            if quantized and not encoder.quantized:
+                continue
+            onnx_lengths = encoder.token_lengths(texts)
+            backends.append((f"onnx-{'int8' if quantized else 'fp32'}", encoder.encode,
+                             padding_efficiency(onnx_lengths,
+                                                plan_batches(onnx_lengths, **bucketed))))
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": vars(args),
+        "runs": [],
+    }
+    reference, baseline_rate = None, None
+    for name, encode, efficiency in backends:
+        vectors, seconds = time_encode(encode, texts, args.repeat)
+        rate = len(texts) / seconds
+        if reference is None:
+            reference, baseline_rate = vectors, rate
+        result = {"backend": name, "seconds": seconds, "sentences_per_sec": rate,
+                  "speedup": rate / baseline_rate, "padding_efficiency": efficiency,
+                  **agreement(vectors, reference)}
+        report["runs"].append(result)
+        cosine = (f"cosine {result['cosine_mean']:.4f} (min {result['cosine_min']:.4f})"
+                  if result["cosine_mean"] is not None else "cosine n/a")
+        print(f"{name:<15} {rate:9.1f} sentences/sec  x{result['speedup']:.2f}  "
+              f"padding efficiency {efficiency:.2f}  {cosine}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,94 +1,161 @@
-import fitz
-import pymupdf
-from numpy import ndarray
-
-
-def load_split(_pdf_path:str):
-    """Loads a PDF and splits its content into lines."""
-    doc:pymupdf.Document = fitz.open(_pdf_path)
-    _lines = []
-    print(f"Total Page Count in the doc: {doc.page_count}")
-    _count = 0
-    for page in doc:
-        text = page.get_text("text")  # Extract text
-        _lines.extend(text.split("."))  # Split into sentences
-        _count +=1
-        if _count==100:
-            break
-    return _lines
-
-# Example usage
-pdf_path = "2008_Book_TimeSeriesAnalysis.pdf"  # Replace with your actual file path
-documents = load_split(pdf_path)
-
-# Setup Faiss and store embeddings
-#----------------------------------------------------------------------@
-import faiss
+import os
 import time
 
-# Model for text embeddings
-from sentence_transformers import SentenceTransformer
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-
-# Embedding creation
-start = time.time()
-documents_vectors:ndarray = model.encode(sentences=documents, batch_size= 50, convert_to_numpy=True).astype("float32")
-end = time.time()
-print(f"\nTotal Document Encoding Time: {end - start:.5f} sec")
-
-# Store document shape
-d = documents_vectors.shape[1]
-
-start = time.time()
-# Set the IVF Indexing
-quantizer = faiss.IndexFlatL2(d)
-
-# Set the number of clusters expected
-nlist = 3
-index_ivf = faiss.IndexIVFFlat(quantizer, d, nlist)
-
-# IVF Index creation
-index_ivf.train(documents_vectors)
-index_ivf.add(documents_vectors)
-end = time.time()
-print(f"\nIVF_PQ Index creation Time: {end - start:.5f} sec")
-
-# HNSW Index creation
-M = 16
-index_hnsw = faiss.IndexHNSWFlat(d, M)
-start = time.time()
-index_hnsw.add(documents_vectors)
-end = time.time()
-print(f"\nHNSW Index creation Time: {end - start:.5f} sec")
-print("HNSW index size:", index_hnsw.ntotal)
-
-#----------------------------------------------------------------------@
-# Query a document
-query_text = "Key points for Forecasting techniques."
-query_vector = model.encode([query_text], convert_to_numpy=True).astype('float32')
-
-# Search for top 3 similar documents
-k = 3
-
-# IVF_PQ Search
-start = time.time()
-index_ivf.nprobe = 5  # Number of clusters to search in IVF
-dist, idx_ivf = index_ivf.search(query_vector, k)
-end = time.time()
-print(f"IVF Search Time: {end - start:.5f} sec")
-
-# HNSW Search
-start = time.time()
-dist_hnsw, idx_hnsw = index_hnsw.search(query_vector, k)
-end = time.time()
-print(f"\nHNSW Search Time for {k} top records: {end - start:.5f} sec")
-
-# Display results
-print("\nQuery:", query_text)
-print("\nTop similar documents:")
-# for i, idx in enumerate(indices_hnsw[0]):
-#     print(f"{i+1}. {documents[idx]} (Distance: {dist_hnsw[0][i]:.4f})")
-# Print Results
-print("\nResults:")
-print("IVF:", [documents[i] for i in idx_ivf[0]])
-print("HNSW:", [documents[i] for i in idx_hnsw[0]])
+import faiss
+import numpy as np
+
+from utility.chunker import TokenChunker
+from utility.docstore import DocStore
+from utility.embedding_cache import EmbeddingCache
+from utility.encoders import get_encoder
+from utility.incremental import IncrementalIVF
+from utility.indexes import set_search_params
+from utility.models import DEFAULT_MODEL_NAME as model_name
+from utility.pdfloader import PdfLoader
+from utility.pipeline import IndexWriter, IngestionPipeline
+from utility.snapshots import SnapshotStore
+from utility.tuning import load_params, save_params, scale_params, tune_index
+
+# Tuned parameters are stored next to these index paths
+IVF_INDEX_PATH = "comparison_storage/ivf_index.bin"
+HNSW_INDEX_PATH = "comparison_storage/hnsw_index.bin"
+TARGET_RECALL = 0.95
+# "torch" (sentence-transformers) or "onnx" (an export_onnx directory, int8 when present)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = "models/all-MiniLM-L6-v2-onnx"
+
+
+def main():
+    # Example usage: a single PDF or a directory of PDFs
+    pdf_path = "2008_Book_TimeSeriesAnalysis.pdf"  # Replace with your actual file path
+    # Pages are parsed in a process pool and streamed chunk by chunk, no page cap.
+    # Sentences are packed into chunks of up to 256 word pieces (the model limit)
+    # with a 32 token overlap instead of embedding every "." fragment.
+    loader = PdfLoader(pages_per_task=8, split_fn=TokenChunker(max_tokens=256, overlap_tokens=32))
+
+    # Setup Faiss and store embeddings
+    #----------------------------------------------------------------------@
+    # Model for text embeddings
+    # Shared, lazily loaded encoder for this process: texts are sorted by token
+    # length and batched by a token budget instead of fixed batches of 50
+    model = get_encoder(EMBEDDING_BACKEND, model_name, model_dir=ONNX_MODEL_DIR)
+    d = model.get_sentence_embedding_dimension()
+    # Keyed by backend too: int8 vectors differ slightly from the torch ones
+    embedding_cache = EmbeddingCache(model.name, d, cache_dir="embedding_cache", dtype="float16")
+
+    # Texts of the indexed chunks, looked up by faiss id for the results
+    documents = DocStore("comparison_storage/documents")
+    documents.truncate(0)
+
+    # Parameters tuned by an earlier run, defaults until the first tuning
+    ivf_params = load_params(IVF_INDEX_PATH)
+    hnsw_params = load_params(HNSW_INDEX_PATH)
+
+    # IVF Indexing: trains on the first 5000 vectors, later batches are added to
+    # the trained index and a background retrain (nlist following the corpus
+    # size until tuned) kicks in when the lists drift from the training sample
+    ivf_writer = IncrementalIVF(d, nlist=ivf_params.get("nlist"),
+                                nprobe=ivf_params.get("nprobe", 8), train_size=5000)
+
+    # HNSW Indexing
+    M = hnsw_params.get("M", 16)
+    index_hnsw = faiss.IndexHNSWFlat(d, M)
+    index_hnsw.hnsw.efConstruction = hnsw_params.get("ef_construction", 40)
+
+    hnsw_writer = IndexWriter(index_hnsw)
+
+    def add_to_indexes(texts, vectors):
+        documents.append(texts)
+        ivf_writer(texts, vectors)
+        hnsw_writer(texts, vectors)
+
+    # Streaming ingestion: parsing, encoding (thread pool, sentences embedded by an
+    # earlier run come from the cache) and index.add run as overlapping stages
+    pipeline = IngestionPipeline(
+        encode_fn=lambda texts: embedding_cache.encode(model, texts),
+        add_fn=add_to_indexes, batch_size=200, queue_depth=4, workers=2)
+    stats = pipeline.run(loader.iter_chunks(pdf_path))
+    ivf_writer.flush()
+    ivf_writer.wait()
+    index_ivf = ivf_writer.index
+    nlist = faiss.downcast_index(index_ivf).nlist
+    for path, page_count in loader.stats["files"].items():
+        print(f"Total Page Count in {os.path.basename(path)}: {page_count}")
+    print(f"\nParsed {loader.stats['pages']} pages in {loader.stats['seconds']:.5f} sec "
+          f"({loader.stats['pages_per_sec']:.1f} pages/sec) into {loader.stats['chunks']} chunks")
+    print(f"\nTotal Document Encoding Time: {stats['encode_seconds']:.5f} sec")
+    print(f"\nTotal ingestion Time: {stats['seconds']:.5f} sec for {stats['texts']} texts "
+          f"({stats['texts_per_sec']:.1f} texts/sec, "
+          f"cache hits: {embedding_cache.hits}, encoded: {embedding_cache.misses})")
+    print(f"\nIVF Index creation Time: {ivf_writer.seconds:.5f} sec "
+          f"(background retrains: {ivf_writer.retrains}, drift: {ivf_writer.drift()})")
+    print(f"\nHNSW Index creation Time: {hnsw_writer.seconds:.5f} sec")
+    print("HNSW index size:", index_hnsw.ntotal)
+
+    # Tune nlist/nprobe and M/efConstruction/efSearch for the target recall on a
+    # sample of the corpus the first time; the search parameters apply right
+    # away, the build parameters from the next run on
+    if not ivf_params or not hnsw_params:
+        vectors = faiss.downcast_index(index_hnsw.storage).reconstruct_n(0, index_hnsw.ntotal)
+        sample = vectors[np.random.default_rng(0).permutation(len(vectors))[:20000]]
+        start = time.time()
+        try:
+            tuned_ivf = scale_params(tune_index("ivf", sample, TARGET_RECALL, k=3), len(vectors))
+            tuned_hnsw = tune_index("hnsw", sample, TARGET_RECALL, k=3)
+        except ValueError as error:
+            # A corpus too small to tune on: keep the defaults, snapshots are still saved
+            print(f"\nParameter tuning skipped: {error}")
+        else:
+            ivf_params, hnsw_params = tuned_ivf, tuned_hnsw
+            save_params(IVF_INDEX_PATH, ivf_params)
+            save_params(HNSW_INDEX_PATH, hnsw_params)
+            print(f"\nParameter tuning Time: {time.time() - start:.5f} sec")
+    ivf_writer.nprobe = ivf_params.get("nprobe", ivf_writer.nprobe)
+    set_search_params(index_ivf, nprobe=ivf_writer.nprobe)
+    set_search_params(index_hnsw, ef_search=hnsw_params.get("ef_search", index_hnsw.hnsw.efSearch))
+    print(f"IVF parameters: nlist={nlist}, nprobe={faiss.downcast_index(index_ivf).nprobe}")
+    print(f"HNSW parameters: M={M}, efSearch={index_hnsw.hnsw.efSearch}")
+
+    # Snapshots (with their parameters) that a serving process can memory map
+    start = time.time()
+    # Build parameters are recorded as built, tuned values may apply from the next run
+    SnapshotStore("comparison_storage/ivf").save(index_ivf, {**ivf_params, "nlist": nlist})
+    SnapshotStore("comparison_storage/hnsw").save(
+        index_hnsw, {**hnsw_params, "M": M, "ef_construction": index_hnsw.hnsw.efConstruction})
+    print(f"\nSnapshot save Time: {time.time() - start:.5f} sec")
+
+    #----------------------------------------------------------------------@
+    # Query a document
+    query_text = "Key points for Forecasting techniques."
+    query_vector = model.encode([query_text], convert_to_numpy=True).astype('float32')
+
+    # Search for top 3 similar documents
+    k = 3
+
+    # IVF Search
+    start = time.time()
+    dist, idx_ivf = index_ivf.search(query_vector, k)
+    end = time.time()
+    print(f"IVF Search Time: {end - start:.5f} sec")
+
+    # HNSW Search
+    start = time.time()
+    dist_hnsw, idx_hnsw = index_hnsw.search(query_vector, k)
+    end = time.time()
+    print(f"\nHNSW Search Time for {k} top records: {end - start:.5f} sec")
+
+    # Display results
+    print("\nQuery:", query_text)
+    print("\nTop similar documents:")
+    # for i, idx in enumerate(indices_hnsw[0]):
+    #     print(f"{i+1}. {documents[idx]} (Distance: {dist_hnsw[0][i]:.4f})")
+    # Print Results
+    print("\nResults:")
+    # faiss pads with -1 when the probed lists hold fewer than k vectors
+    print("IVF:", [documents[i] for i in idx_ivf[0] if i >= 0])
+    print("HNSW:", [documents[i] for i in idx_hnsw[0] if i >= 0])
+
+
+# The loader's process pool re-imports this module on spawn based platforms
+if __name__ == "__main__":
+    main()
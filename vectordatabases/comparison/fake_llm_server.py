@@ -0,0 +1,234 @@
+"""
+An OpenAI-compatible fake LLM server that streams tokens with fixed delays.
+
+It lets the workflow, the UI and the benchmarks run against a real HTTP
+client (langchain_openai, the openai SDK) without an API key or network:
+
+Route                      Answers with
+-------------------------  -------------------------------------------------
+POST .../completions       A text completion, streamed as SSE when asked.
+POST .../chat/completions  A chat completion, streamed as SSE when asked.
+POST .../embeddings        Hashed bag-of-words vectors (--dimension).
+
+Routes match on their suffix, so both OpenAI paths (``/v1/completions``)
+and Azure deployment paths (``/openai/deployments/<name>/completions``)
+work. The first token comes after --first-token-ms, then one token every
+--token-ms. With --error-rate, that fraction of the completion requests fail
+with a 429 (Retry-After: 0) or a 503, to exercise client retries. Counts
+of the requests served are kept in ``server.stats``. Point a client at it
+with any key:
+
+    python -m vectordatabases.comparison.fake_llm_server --port 8001 --first-token-ms 300 --token-ms 20
+    OpenAI(base_url="http://127.0.0.1:8001/v1", api_key="fake", model="fake")
+
+``serve`` starts one in a background thread (port 0 picks a free port).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def fake_answer(prompt: str, tokens: int) -> list[str]:
+    """Word tokens of a deterministic answer echoing the last line of prompt."""
+    lines = [line.strip() for line in prompt.strip().splitlines() if line.strip()]
+    words = f"Fake answer to: {lines[-1] if lines else ''}".split()
+    filler = "this token was streamed by the fake llm server".split()
+    while len(words) < tokens:
+        words.append(filler[len(words) % len(filler)])
+    return [word if i == 0 else f" {word}" for i, word in enumerate(words[:tokens])]
+
+
+def fake_embedding(value, dimension: int) -> list[float]:
+    # langchain's OpenAIEmbeddings may send token id lists instead of text
+    words = value.lower().split() if isinstance(value, str) else [str(t) for t in value]
+    vector = np.zeros(dimension, dtype="float32")
+    for word in words:
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+        vector[int.from_bytes(digest, "little") % dimension] += 1.0
+    return (vector / max(float(np.linalg.norm(vector)), 1e-6)).tolist()
+
+
+def _then(chunks, last: dict):
+    yield from chunks
+    yield last
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set on the subclass built by make_server
+    first_token_ms = 200.0
+    token_ms = 20.0
+    tokens = 40
+    dimension = 256
+    error_rate = 0.0
+    rng = random.Random(0)
+    stats = {"requests": 0, "completions": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _timed_tokens(self, prompt: str):
+        for i, token in enumerate(fake_answer(prompt, self.tokens)):
+            time.sleep((self.first_token_ms if i == 0 else self.token_ms) / 1000)
+            yield token
+
+    def _inject_error(self) -> bool:
+        with self.lock:
+            self.stats["completions"] += 1
+            failing = self.rng.random() < self.error_rate
+            status = self.rng.choice((429, 503)) if failing else None
+            if failing:
+                self.stats["errors"] += 1
+        if failing:
+            body = json.dumps({"error": {"message": "Injected failure", "code": status}}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(body)
+        return failing
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        with self.lock:
+            self.stats["requests"] += 1
+        if path.endswith("/completions") and self._inject_error():
+            return
+        model = request.get("model", "fake")
+        created = int(time.time())
+        response_id = f"fake-{uuid.uuid4().hex[:12]}"
+
+        if path.endswith("/embeddings"):
+            inputs = request.get("input", [])
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            self._send_json({"object": "list", "model": model,
+                             "data": [{"object": "embedding", "index": i,
+                                       "embedding": fake_embedding(value, self.dimension)}
+                                      for i, value in enumerate(inputs)],
+                             "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+        elif path.endswith("/chat/completions"):
+            messages = request.get("messages", [])
+            prompt = str(messages[-1].get("content", "")) if messages else ""
+            base = {"id": response_id, "created": created, "model": model}
+            if request.get("stream"):
+                chunks = ({**base, "object": "chat.completion.chunk",
+                           "choices": [{"index": 0, "delta": {"role": "assistant", "content": token},
+                                        "finish_reason": None}]}
+                          for token in self._timed_tokens(prompt))
+                self._send_events(_then(chunks, {
+                    **base, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+            else:
+                text = "".join(self._timed_tokens(prompt))
+                self._send_json({**base, "object": "chat.completion",
+                                 "choices": [{"index": 0, "finish_reason": "stop",
+                                              "message": {"role": "assistant", "content": text}}],
+                                 "usage": {"prompt_tokens": 0, "completion_tokens": self.tokens,
+                                           "total_tokens": self.tokens}})
+        elif path.endswith("/completions"):
+            prompt = request.get("prompt", "")
+            prompt = prompt[-1] if isinstance(prompt, list) else prompt
+            base = {"id": response_id, "created": created, "model": model,
+                    "object": "text_completion"}
+            if request.get("stream"):
+                chunks = ({**base, "choices": [{"index": 0, "text": token, "logprobs": None,
+                                                "finish_reason": None}]}
+                          for token in self._timed_tokens(prompt))
+                self._send_events(_then(chunks, {
+                    **base, "choices": [{"index": 0, "text": "", "logprobs": None,
+                                         "finish_reason": "stop"}]}))
+            else:
+                text = "".join(self._timed_tokens(prompt))
+                self._send_json({**base, "choices": [{"index": 0, "text": text, "logprobs": None,
+                                                      "finish_reason": "stop"}],
+                                 "usage": {"prompt_tokens": 0, "completion_tokens": self.tokens,
+                                           "total_tokens": self.tokens}})
+        else:
+            self.send_error(404, f"Unknown route {path}")
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    # socketserver's default backlog of 5 drops connections under concurrent clients
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8001, first_token_ms: float = 200.0,
+                token_ms: float = 20.0, tokens: int = 40, dimension: int = 256,
+                error_rate: float = 0.0, seed: int = 0):
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,),
+                   {"first_token_ms": first_token_ms, "token_ms": token_ms,
+                    "tokens": tokens, "dimension": dimension, "error_rate": error_rate,
+                    "rng": random.Random(seed), "lock": threading.Lock(),
+                    "stats": {"requests": 0, "completions": 0, "errors": 0}})
+    server = FakeLLMServer((host, port), handler)
+    server.stats = handler.stats
+    return server
+
+
+def serve(port: int = 0, **settings):
+    """Starts a server in a daemon thread, returns (server, base url ending in /v1)."""
+    server = make_server(port=port, **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-ms", type=float, default=200.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens per answer")
+    parser.add_argument("--dimension", type=int, default=256, help="Embedding dimension")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of completion requests failing with 429/503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.first_token_ms, args.token_ms,
+                         args.tokens, args.dimension, args.error_rate, args.seed)
+    print(f"Fake LLM server on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
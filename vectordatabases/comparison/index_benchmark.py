@@ -0,0 +1,201 @@
+"""
+Recall / latency benchmark for the Flat, IVF and HNSW faiss indexes.
+
+Synthetic, embedding like corpora (clustered, unit length, d=384 by default)
+are generated offline, so results are reproducible without any model or PDF.
+For every corpus size and index type the benchmark records:
+
+Metric              Description
+------------------  ----------------------------------------------------------
+build_sec           Time to create, train and fill the index.
+memory_bytes        Bytes held by the index data structures.
+recall_at_k         Overlap with the exact IndexFlatL2 top-k.
+qps                 Queries per second, per query batch size.
+p50/p95/p99_ms      Latency of one search call, per query batch size.
+
+The compressed types (ivfpq, ivfsq8, ivffp16) can be added with --indexes;
+with --rerank-factor they are measured with exact re-ranking of the shortlist.
+With --shards N the Flat/IVF/HNSW types are also measured as a ShardedIndex of
+N hash partitioned shards, searched in parallel (--shard-processes builds the
+shards in worker processes).
+
+Results are written as JSON so runs can be compared between releases:
+
+    python -m vectordatabases.comparison.index_benchmark --sizes 10000 100000 1000000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import faiss
+import numpy as np
+
+from utility.compressed import RerankedIndex
+from utility.indexes import (COMPRESSED_TYPES, INDEX_TYPES, build_index, exact_ground_truth,
+                             index_memory_bytes, recall_at_k, set_search_params,
+                             synthetic_corpus)
+from utility.shards import ShardedIndex
+
+
+def run_queries(index, queries: np.ndarray, k: int, batch_size: int):
+    """Searches queries in batches, returns (ids, per call latencies in seconds)."""
+    ids = np.empty((len(queries), k), dtype="int64")
+    latencies = []
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        begin = time.perf_counter()
+        _, found = index.search(batch, k)
+        latencies.append(time.perf_counter() - begin)
+        ids[start:start + len(batch)] = found
+    return ids, np.asarray(latencies)
+
+
+def benchmark_index(kind: str, base: np.ndarray, queries: np.ndarray, truth: np.ndarray,
+                    args) -> dict:
+    is_ivf = kind == "ivf" or kind in COMPRESSED_TYPES
+    params = {"M": args.M, "ef_construction": args.ef_construction} if kind == "hnsw" else \
+        {"nlist": args.nlist} if is_ivf else {}
+    start = time.perf_counter()
+    index = build_index(kind, base, train_size=args.train_size if is_ivf else None, **params)
+    build_sec = time.perf_counter() - start
+    set_search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+    memory_bytes = index_memory_bytes(index)
+    if kind in COMPRESSED_TYPES and args.rerank_factor:
+        # Exact vectors are read from the (here in-memory) full precision store
+        index = RerankedIndex(index, base, rerank_factor=args.rerank_factor, kind=kind)
+
+    result = {
+        "index": kind,
+        "params": {**params, "nprobe": args.nprobe if is_ivf else None,
+                   "ef_search": args.ef_search if kind == "hnsw" else None},
+        "build_sec": build_sec,
+        "memory_bytes": memory_bytes,
+        "batches": {},
+    }
+    if is_ivf:
+        ivf = index.index if isinstance(index, RerankedIndex) else index
+        result["params"]["nlist"] = faiss.downcast_index(ivf).nlist
+    if isinstance(index, RerankedIndex):
+        result["params"]["rerank_factor"] = index.rerank_factor
+    for batch_size in args.batch_sizes:
+        ids, latencies = run_queries(index, queries, args.k, batch_size)
+        result["recall_at_k"] = recall_at_k(ids, truth, args.k)
+        result["batches"][str(batch_size)] = {
+            "qps": len(queries) / latencies.sum(),
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        }
+    return result
+
+
+def benchmark_sharded(kind: str, base: np.ndarray, queries: np.ndarray, truth: np.ndarray,
+                      args) -> dict:
+    params = {"M": args.M, "ef_construction": args.ef_construction} if kind == "hnsw" else \
+        {"nlist": args.nlist} if kind == "ivf" else {}
+    with tempfile.TemporaryDirectory() as directory:
+        sharded = ShardedIndex(directory, n_shards=args.shards, kind=kind, **params)
+        start = time.perf_counter()
+        sharded.build(base, use_processes=args.shard_processes,
+                      train_size=args.train_size if kind == "ivf" else None)
+        build_sec = time.perf_counter() - start
+        sharded.set_search_params(nprobe=args.nprobe, ef_search=args.ef_search)
+
+        result = {
+            "index": f"{kind}x{args.shards}",
+            "params": {**params, "shards": args.shards,
+                       "nprobe": args.nprobe if kind == "ivf" else None,
+                       "ef_search": args.ef_search if kind == "hnsw" else None},
+            "build_sec": build_sec,
+            "memory_bytes": sum(index_memory_bytes(index) for index in sharded.shards),
+            "batches": {},
+        }
+        for batch_size in args.batch_sizes:
+            ids, latencies = run_queries(sharded, queries, args.k, batch_size)
+            result["recall_at_k"] = recall_at_k(ids, truth, args.k)
+            result["batches"][str(batch_size)] = {
+                "qps": len(queries) / latencies.sum(),
+                "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                "p95_ms": float(np.percentile(latencies, 95) * 1000),
+                "p99_ms": float(np.percentile(latencies, 99) * 1000),
+            }
+        sharded.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 256])
+    parser.add_argument("--indexes", nargs="+", default=list(INDEX_TYPES),
+                        choices=INDEX_TYPES + COMPRESSED_TYPES)
+    parser.add_argument("--rerank-factor", type=int, default=0,
+                        help="Shortlist k * factor from compressed codes, 0 disables re-ranking")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Also measure Flat/IVF/HNSW split into this many shards")
+    parser.add_argument("--shard-processes", action="store_true",
+                        help="Build the shards in worker processes instead of threads")
+    parser.add_argument("--nlist", type=int, default=None, help="Default: 4 * sqrt(n)")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--train-size", type=int, default=100_000)
+    parser.add_argument("--M", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=40)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None, help="faiss OpenMP threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="index_benchmark.json")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "faiss": faiss.__version__,
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "threads": faiss.omp_get_max_threads(),
+        },
+        "config": vars(args),
+        "runs": [],
+    }
+    for n in args.sizes:
+        print(f"\nCorpus of {n} vectors, d={args.dim}")
+        base, queries = synthetic_corpus(n, args.dim, args.queries, seed=args.seed)
+        start = time.perf_counter()
+        truth = exact_ground_truth(base, queries, args.k)
+        print(f"Ground truth Time: {time.perf_counter() - start:.5f} sec")
+
+        kinds = [(kind, benchmark_index) for kind in args.indexes]
+        if args.shards > 1:
+            kinds += [(kind, benchmark_sharded) for kind in args.indexes if kind in INDEX_TYPES]
+        for kind, benchmark in kinds:
+            result = benchmark(kind, base, queries, truth, args)
+            result["n"] = n
+            report["runs"].append(result)
+            batch_1 = result["batches"].get("1") or next(iter(result["batches"].values()))
+            print(f"{result['index']:<7} build {result['build_sec']:.3f} sec  "
+                  f"memory {result['memory_bytes'] / 2**20:.1f} MiB  "
+                  f"recall@{args.k} {result['recall_at_k']:.4f}  "
+                  f"p99 {batch_1['p99_ms']:.3f} ms  "
+                  + "  ".join(f"qps[{b}] {r['qps']:.0f}" for b, r in result["batches"].items()))
+        del base, queries, truth
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
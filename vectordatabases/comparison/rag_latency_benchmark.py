@@ -0,0 +1,253 @@
+"""
+End-to-end latency benchmark for the hybrid RAG workflow (faissworkflows.py).
+
+Everything runs offline: a stub LLM answers after a fixed delay, like a
+remote completion API would, and a stub embedding model hashes words into
+vectors after a fixed delay per query. FAISS and BM25 run for real on a
+synthetic corpus, the keyword leg on the native ``BM25Index`` (or langchain's
+``BM25Retriever`` with ``--bm25 langchain``). The same queries go through three setups:
+
+Mode          Description
+------------  -----------------------------------------------------------
+sequential    vector_search then keyword_search, one query at a time.
+parallel      Both retrievals in the same graph step, one query at a time.
+concurrent    Parallel graph, --concurrency queries in flight on one loop.
+
+With ``--distinct N`` the queries repeat, drawn from N distinct questions,
+and ``--answer-cache`` puts a SemanticAnswerCache in front of the answer LLM
+call. ``--query-cache`` caches the query embeddings. Each mode gets its own
+caches, so every mode starts cold.
+
+For every mode the benchmark records mean/p50/p95/p99 latency per query, the
+time to the first streamed answer token, the throughput and the mean context
+tokens per query (packed, unpacked and saved), and writes them as JSON:
+
+    python -m vectordatabases.comparison.rag_latency_benchmark --queries 200 --llm-ms 300 --output rag.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from langchain_community.retrievers import BM25Retriever
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain.schema import Document
+
+from utility.answer_cache import SemanticAnswerCache
+from utility.bm25 import BM25Index
+from utility.context_packing import ContextPacker
+from utility.query_embeddings import CachedQueryEmbeddings
+from utility.rerank import CrossEncoderReranker
+from vectordatabases.faiss.faissworkflows import BM25IndexRetriever, build_workflow, stream_answer
+
+WORDS = ("vector search index faiss keyword bm25 hybrid retrieval embedding model "
+         "latency query document cluster graph recall ranking answer context token "
+         "cache shard memory disk batch stream").split()
+
+
+class StubEmbeddings(Embeddings):
+    """Hashed bag of words vectors, queries cost delay_ms like a remote API call."""
+
+    def __init__(self, dimension: int = 256, delay_ms: float = 30.0):
+        self.dimension = dimension
+        self.delay_ms = delay_ms
+
+    def _vector(self, text: str) -> list[float]:
+        vector = np.zeros(self.dimension, dtype="float32")
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+            vector[int.from_bytes(digest, "little") % self.dimension] += 1.0
+        return (vector / max(np.linalg.norm(vector), 1e-6)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.delay_ms / 1000)
+        return self._vector(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.delay_ms / 1000)
+        return self._vector(text)
+
+
+class StubLLM:
+    """Answers every prompt after delay_ms, without any network or model.
+
+    Streamed answers send their first token after delay_ms, then one word
+    every token_ms.
+    """
+
+    def __init__(self, delay_ms: float = 200.0, token_ms: float = 0.0):
+        self.delay_ms = delay_ms
+        self.token_ms = token_ms
+        self.calls = 0
+
+    def invoke(self, prompt: str) -> str:
+        time.sleep(self.delay_ms / 1000)
+        return self._answer(prompt)
+
+    async def ainvoke(self, prompt: str) -> str:
+        await asyncio.sleep(self.delay_ms / 1000)
+        return self._answer(prompt)
+
+    async def astream(self, prompt: str):
+        await asyncio.sleep(self.delay_ms / 1000)
+        for i, word in enumerate(self._answer(prompt).split(" ")):
+            if i:
+                await asyncio.sleep(self.token_ms / 1000)
+            yield word if i == 0 else f" {word}"
+
+    def _answer(self, prompt: str) -> str:
+        self.calls += 1
+        return f"Stub answer #{self.calls} for a prompt of {len(prompt)} characters."
+
+
+def synthetic_texts(n: int, words: int, seed: int) -> list[str]:
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, words)) + "." for _ in range(n)]
+
+
+async def run_mode(app, queries: list[str], concurrency: int) -> dict:
+    latencies, first_tokens, contexts = [], [], []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def timed(query: str):
+        async with limit:
+            start = time.perf_counter()
+            first_token = None
+            async for kind, value in stream_answer(app, query):
+                if kind == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif kind == "done":
+                    contexts.append(value["context_stats"])
+            latencies.append(time.perf_counter() - start)
+            first_tokens.append(first_token if first_token is not None else latencies[-1])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(query) for query in queries))
+    wall = time.perf_counter() - start
+    latencies = np.asarray(latencies)
+    first_tokens = np.asarray(first_tokens)
+    return {
+        "concurrency": concurrency,
+        "queries": len(queries),
+        "wall_sec": wall,
+        "qps": len(queries) / wall,
+        "mean_ms": float(latencies.mean() * 1000),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "ttft_p50_ms": float(np.percentile(first_tokens, 50) * 1000),
+        "ttft_p95_ms": float(np.percentile(first_tokens, 95) * 1000),
+        "context_input_tokens": float(np.mean([c["input_tokens"] for c in contexts])),
+        "context_tokens": float(np.mean([c["tokens"] for c in contexts])),
+        "context_tokens_saved": float(np.mean([c["tokens_saved"] for c in contexts])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--llm-ms", type=float, default=200.0,
+                        help="Stub LLM delay per call, up to the first token")
+    parser.add_argument("--token-ms", type=float, default=0.0,
+                        help="Stub LLM delay between streamed tokens")
+    parser.add_argument("--embed-ms", type=float, default=30.0,
+                        help="Stub embedding delay per query")
+    parser.add_argument("--bm25", choices=("native", "langchain"), default="native",
+                        help="Keyword retriever: utility.bm25.BM25Index or BM25Retriever")
+    parser.add_argument("--rerank", choices=("rrf", "cross-encoder"), default="rrf",
+                        help="Local reranker between retrieval and the answer")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="Draw the queries from this many distinct questions (0: all distinct)")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Cache answers with a SemanticAnswerCache")
+    parser.add_argument("--context-budget", type=int, default=1500,
+                        help="Token budget of the packed answer context")
+    parser.add_argument("--query-cache", action="store_true",
+                        help="Cache query embeddings (LRU with single-flight)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="rag_latency_benchmark.json")
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.docs, 12, args.seed)
+    documents = [Document(page_content=text) for text in texts]
+    stub_embeddings = StubEmbeddings(delay_ms=args.embed_ms)
+    vector_store = FAISS.from_documents(documents, stub_embeddings)
+    bm25_dir = tempfile.TemporaryDirectory()
+    start = time.perf_counter()
+    if args.bm25 == "native":
+        BM25Index(bm25_dir.name).add(texts)
+        build_sec = time.perf_counter() - start
+        # What a restart pays: open the persisted index
+        start = time.perf_counter()
+        bm25_retriever = BM25IndexRetriever(index=BM25Index(bm25_dir.name), k=args.k)
+        open_sec = time.perf_counter() - start
+    else:
+        bm25_retriever = BM25Retriever.from_documents(documents, k=args.k)
+        # BM25Retriever keeps nothing on disk, every start rebuilds it
+        build_sec = open_sec = time.perf_counter() - start
+    print(f"BM25 ({args.bm25}) on {args.docs} documents: build {build_sec:.3f} sec, "
+          f"startup {open_sec:.3f} sec")
+    queries = synthetic_texts(args.distinct or args.queries, 4, args.seed + 1)
+    if args.distinct:
+        rng = np.random.default_rng(args.seed + 2)
+        queries = [queries[i] for i in rng.integers(0, args.distinct, args.queries)]
+    llm = StubLLM(delay_ms=args.llm_ms, token_ms=args.token_ms)
+    reranker = CrossEncoderReranker() if args.rerank == "cross-encoder" else "rrf"
+
+    modes = [("sequential", False, 1), ("parallel", True, 1),
+             ("concurrent", True, args.concurrency)]
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": vars(args),
+        "bm25": {"build_sec": build_sec, "startup_sec": open_sec},
+        "runs": [],
+    }
+    for name, parallel_retrieval, concurrency in modes:
+        answer_cache = SemanticAnswerCache() if args.answer_cache else None
+        embeddings = CachedQueryEmbeddings(stub_embeddings) if args.query_cache else stub_embeddings
+        app = build_workflow(vector_store, bm25_retriever, llm, k=args.k, embeddings=embeddings,
+                             parallel_retrieval=parallel_retrieval, reranker=reranker,
+                             answer_cache=answer_cache,
+                             context_packer=ContextPacker(budget=args.context_budget))
+        calls = llm.calls
+        result = asyncio.run(run_mode(app, queries, concurrency))
+        result["mode"] = name
+        result["llm_calls_per_query"] = (llm.calls - calls) / len(queries)
+        if answer_cache is not None:
+            result["answer_cache"] = answer_cache.stats()
+        if args.query_cache:
+            result["query_cache"] = embeddings.cache.stats()
+        report["runs"].append(result)
+        print(f"{name:<11} p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  "
+              f"p99 {result['p99_ms']:.1f} ms  first token p50 {result['ttft_p50_ms']:.1f} ms  "
+              f"{result['qps']:.1f} queries/sec  context {result['context_tokens']:.0f} tokens "
+              f"({result['context_tokens_saved']:.0f} saved)")
+
+    bm25_dir.cleanup()
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Startup time benchmark for the lazy imports and the shared model registry.
+
+Every scenario runs in a fresh interpreter so import caches do not leak
+between measurements:
+
+Scenario            What is timed
+------------------  --------------------------------------------------------
+eager_import        import faiss + sentence_transformers and build the model
+                    at top level, the way the example scripts used to.
+lazy_import         import utility and open a SelfFaiss store; nothing heavy
+                    is loaded until the first encode or search.
+first_encode_lazy   lazy_import followed by the first encode.
+worker_cold         a spawned worker loading the model by itself.
+worker_prewarmed    a worker forked after prewarm() in the parent.
+
+Run from the repo root:  python -m vectordatabases.comparison.startup_benchmark --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = str(Path(__file__).resolve().parents[2])
+
+SCENARIOS = {
+    "eager_import": """
+import faiss
+from sentence_transformers import SentenceTransformer
+model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+""",
+    "lazy_import": """
+from utility import SelfFaiss
+store = SelfFaiss(persist=True, faiss_app="startup_benchmark", storage_root=STORAGE)
+""",
+    "first_encode_lazy": """
+from utility.models import get_model
+get_model().encode(["first query"], convert_to_numpy=True)
+""",
+}
+
+WORKER_TEMPLATE = """
+import multiprocessing as mp
+import time
+from utility.models import get_model, prewarm
+
+def work(queue):
+    start = time.perf_counter()
+    get_model().encode(["worker query"], convert_to_numpy=True)
+    queue.put(time.perf_counter() - start)
+
+if __name__ == "__main__":
+    context = mp.get_context("{method}")
+    if {prewarm}:
+        prewarm()
+    queue = context.Queue()
+    worker = context.Process(target=work, args=(queue,))
+    worker.start()
+    elapsed = queue.get(timeout=600)
+    worker.join()
+    print(elapsed)
+"""
+
+
+def _run_timed(code: str, storage: str) -> float:
+    """Runs code in a fresh interpreter and returns its wall time in seconds."""
+    wrapped = (f"import time\nSTORAGE = {storage!r}\n_start = time.perf_counter()\n"
+               f"{code}\nprint(time.perf_counter() - _start)\n")
+    return _run(wrapped)
+
+
+def _run(code: str) -> float:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])))
+    # Written to a file so spawned workers can re-import the __main__ module
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        script = os.path.join(tmp_dir, "scenario.py")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write(code)
+        output = subprocess.run([sys.executable, script], env=env, check=True,
+                                capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--storage", default="faiss_storage")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    timings = {name: [_run_timed(code, args.storage) for _ in range(args.repeat)]
+               for name, code in SCENARIOS.items()}
+    if sys.platform != "win32":
+        # fork is not available on Windows, the prewarm path only applies to fork
+        timings["worker_cold"] = [
+            _run(WORKER_TEMPLATE.format(method="spawn", prewarm=False))
+            for _ in range(args.repeat)]
+        timings["worker_prewarmed"] = [
+            _run(WORKER_TEMPLATE.format(method="fork", prewarm=True))
+            for _ in range(args.repeat)]
+
+    results = {name: {"median_sec": statistics.median(values), "runs": values}
+               for name, values in timings.items()}
+    for name, result in results.items():
+        print(f"{name:<20} {result['median_sec']:.4f} sec")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,9 @@ import time
 
 import faiss
 
+from utility.embedding_cache import EmbeddingCache
+from utility.indexes import set_search_params
+
 documents = [
     "Artificial Intelligence is transforming the world.",
     "Machine learning is a subset of AI.",
@@ -10,11 +13,10 @@ documents = [
     "Natural Language Processing enables machines to understand human language."
 ]
 
-from sentence_transformers import SentenceTransformer
-
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-documents_vectors = (
-    model.encode(documents, convert_to_numpy=True).astype('float32'))
+from utility.models import DEFAULT_MODEL_NAME as model_name, get_model
+model = get_model(model_name)
+embedding_cache = EmbeddingCache(model_name, model.get_sentence_embedding_dimension())
+documents_vectors = embedding_cache.encode(model, documents)
 
 # Define vector dimension
 d = documents_vectors.shape[1]
@@ -52,7 +54,8 @@ print(f"\nFlat Search Time: {end - start:.5f} sec")
 
 # IVF Search
 start = time.time()
-index_ivf.nprobe = 5  # Number of clusters to search in IVF
+# Number of clusters to search in IVF, capped at nlist
+set_search_params(index_ivf, nprobe=5)
 dist, idx_ivf = index_ivf.search(query_vector, k)
 end = time.time()
 print(f"IVF Search Time: {end - start:.5f} sec")
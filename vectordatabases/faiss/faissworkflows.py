@@ -1,129 +1,399 @@
-from langgraph.graph import StateGraph
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import OpenAI
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain_community.retrievers import BM25Retriever
-from langchain.schema import Document
-
+"""
+@description:
+Hybrid RAG workflow on a LangGraph StateGraph: FAISS vector search and BM25
+keyword search, local re-ranking of the merged hits and a final LLM answer.
+
+    START --> vector_search  --+
+      |                        +--> rerank_results --> pack_context --> generate_answer
+      +-----> keyword_search --+
+
+Every node is async. Both retrievals start from START, so LangGraph runs them
+in the same step and they overlap (the blocking FAISS and BM25 calls go to
+the event loop's thread pool through ``ainvoke``), and the LLM calls await
+the network instead of blocking a thread. One event loop can therefore serve
+many queries at once, see ``answer_many``.
+
+``rerank_results`` runs locally (``utility.rerank``), so a query makes one LLM
+call. It fuses the two result lists with reciprocal rank fusion, or scores
+the candidates with a ``CrossEncoderReranker``. ``pack_context``
+(``utility.context_packing.ContextPacker``) then fills a token budget with
+the ranked documents, best first. It drops sentences that an earlier
+document already brought and cuts the last document at a sentence boundary.
+It records the tokens saved per query in ``context_stats``.
+
+With an ``answer_cache`` (``utility.answer_cache.SemanticAnswerCache``),
+``generate_answer`` first looks for an answer to a similar query over the
+same packed context, and only calls the LLM on a miss. The query vector
+for that lookup is the one ``vector_search`` already computed, so a cache
+check adds no embedding call. A query whose retrieved documents changed
+misses through the context key. When ``load_stores`` (re)builds the stores
+it also calls ``answer_cache.invalidate()``, so no answer outlives the
+corpus it was generated from.
+
+The keyword leg reads a persistent ``utility.bm25.BM25Index`` kept next to
+the saved FAISS index, through ``BM25IndexRetriever``. A restart opens both
+from disk instead of re-embedding and re-tokenizing the corpus. The FAISS
+store records the embedding model and dimension it was built with
+(``embeddings.json``), and ``load_stores`` rebuilds both stores when the
+embeddings passed in differ, say after switching openai/azure or the
+embedding deployment.
+
+``generate_answer`` streams the completion and hands every token to the
+graph's stream writer as it arrives. ``stream_answer`` exposes them as an
+async iterator, so a client can show the first token as soon as the LLM
+sends it, while the full answer still lands in the final state:
+
+    async for kind, value in stream_answer(app, "What is Faiss used for?"):
+        if kind == "token":
+            print(value, end="", flush=True)    # value: the next piece of text
+        else:
+            state = value                       # kind == "done": the final state
+
+``ui/app.py`` renders answers this way (``python -m streamlit run ui/app.py``
+from the repo root). To try it without an API key, run
+``python -m vectordatabases.comparison.fake_llm_server``. It is an
+OpenAI-compatible server that streams tokens with configurable delays.
+
+``build_clients`` turns the credentials the UI collects (azure or openai, URL,
+key) into a pooled ``utility.llm_client.LLMClient``. The LLMClient handles
+keep-alive, the concurrency limit, jittered retries and coalescing of
+identical prompts. The embedding client shares its connection pool. Its
+query vectors are cached (``utility.query_embeddings``), so a repeated
+question skips the embedding call, and identical concurrent questions share
+one call.
+
+``build_workflow`` takes the vector store, the BM25 retriever and the LLM, so
+the same graph runs against OpenAI here and against a local stub LLM in
+``vectordatabases/comparison/rag_latency_benchmark.py``.
+"""
+import asyncio
+import json
 import os
+import shutil
+from typing import Any
 
-# Set api-key
-self_api_key = os.getenv("OPENAI_API_KEY")
-if self_api_key is None or self_api_key == "":
-     self_api_key = os.environ.get("OPENAI_API_KEY")
-
-# Step 1: Load Data & Initialize Components
-docs = ["Artificial Intelligence is transforming the world.",
-        "Faiss is a powerful library for fast similarity search.",
-        "BM25 is a strong keyword-based retrieval technique.",
-        "Hybrid search combines vector search and lexical search."]
+from langgraph.graph import START, StateGraph
+from langgraph.types import StreamWriter
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
+from langchain.schema import Document
 
-# Convert text to LangChain Document objects
-documents = [Document(page_content=text) for text in docs]
+from utility.answer_cache import SemanticAnswerCache
+from utility.bm25 import BM25Index
+from utility.context_packing import ContextPacker
+from utility.llm_client import DEFAULT_AZURE_API_VERSION, LLMClient
+from utility.query_embeddings import CachedQueryEmbeddings
+from utility.rerank import CrossEncoderReranker, reciprocal_rank_fusion
 
-# Initialize OpenAI embeddings
-embeddings = OpenAIEmbeddings(api_key=self_api_key)
+STORAGE_DIR = "faiss_storage/workflow"
+SAMPLE_DOCS = ["Artificial Intelligence is transforming the world.",
+               "Faiss is a powerful library for fast similarity search.",
+               "BM25 is a strong keyword-based retrieval technique.",
+               "Hybrid search combines vector search and lexical search."]
 
-# Create FAISS index
-vector_store = FAISS.from_documents(documents, embeddings)
 
-# Initialize BM25 keyword retriever
-bm25_retriever = BM25Retriever.from_documents(documents)
+class BM25IndexRetriever(BaseRetriever):
+    """LangChain retriever over a BM25Index, the documents come from its stored texts."""
+    index: Any
+    k: int = 4
 
-# Initialize LLM
-llm = OpenAI(api_key= self_api_key, model="gpt-3.5-turbo-instruct")
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return [Document(page_content=self.index.get_text(doc_id),
+                         metadata={"id": doc_id, "bm25_score": score})
+                for doc_id, score in self.index.search(query, self.k)]
 
-# Initialize Langchain with the Gemini API key
-# google_llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
 
 # Define StateGraph Workflow
 class RAGState:
     query: str
+    query_vector: list
     faiss_results: list
     bm25_results: list
     reranked_results: list
+    context: list
+    context_stats: dict
     final_answer: str
+    cache_hit: bool
 
-    def __init__(self, query:str=None, faiss_results:list =None,
-                 bm25_results:list =None, reranked_results:list=None, final_answer:str=None):
+    def __init__(self, query:str=None, query_vector:list=None, faiss_results:list =None,
+                 bm25_results:list =None, reranked_results:list=None, context:list=None,
+                 context_stats:dict=None, final_answer:str=None, cache_hit:bool=False):
         self.query = query
+        self.query_vector = query_vector
         self.faiss_results = faiss_results
         self.bm25_results = bm25_results
         self.reranked_results = reranked_results
+        self.context = context
+        self.context_stats = context_stats
         self.final_answer = final_answer
+        self.cache_hit = cache_hit
         pass
 
-workflow = StateGraph(RAGState)
-
-
-# Step 2: Vector Search Node (FAISS)
-def vector_search(state):
-    query = state.query
-    retriever = vector_store.as_retriever(search_k=3)
-    faiss_results = retriever.invoke(query)
-    return {"faiss_results": faiss_results}
-
-
-workflow.add_node("vector_search", vector_search)
-
-
-# Step 3: BM25 Keyword Search Node
-def keyword_search(state):
-    query = state.query
-    bm25_results = bm25_retriever.invoke(query)
-    return {"bm25_results": bm25_results}
-
-
-workflow.add_node("keyword_search", keyword_search)
-
-
-# Step 4: Merge & Re-rank Results Node
-def rerank_results(state):
-    combined_results = state.faiss_results + state.bm25_results
-    unique_results = {doc.page_content: doc for doc in combined_results}.values()
-
-    # Use LLM to re-rank documents
-    prompt_template = """Given the query: {query}, rank the following documents in order of relevance:
-
-    {documents}
-
-    Return the top-ranked document."""
-
-    prompt = PromptTemplate.from_template(prompt_template)
-    formatted_prompt = prompt.format(query=state.query,
-                                     documents="\n".join([doc.page_content for doc in unique_results]))
-
-    best_doc = llm.invoke(formatted_prompt)
-    return {"reranked_results": [best_doc]}
-
-
-workflow.add_node("rerank_results", rerank_results)
-
-
-# Step 5: Generate Final Answer
-def generate_answer(state):
-    context = state.reranked_results[0] if state.reranked_results else "No relevant information found."
-    prompt = f"Based on the following document:\n\n{context}\n\nAnswer the user's query: {state.query}"
-    final_answer = llm.invoke(prompt)
-    return {"final_answer": final_answer}
-
-
-workflow.add_node("generate_answer", generate_answer)
-
-# Define Execution Edges (Flow of the Workflow)
-workflow.add_edge("vector_search", "rerank_results")
-workflow.add_edge("keyword_search", "rerank_results")
-workflow.add_edge("rerank_results", "generate_answer")
-
-# Define Input & Output
-workflow.set_entry_point("vector_search")
-workflow.set_entry_point("keyword_search")
-workflow.set_finish_point("generate_answer")
 
-# Compile & Run
-app = workflow.compile()
-input_query = "How does hybrid search work?"
-result = app.invoke({"query": input_query})
-print("\n🔹 Final Answer:", result["final_answer"])
+def build_workflow(vector_store, bm25_retriever, llm, k: int = 3,
+                   parallel_retrieval: bool = True, reranker="rrf",
+                   answer_cache: SemanticAnswerCache = None,
+                   context_packer: ContextPacker = None, embeddings=None):
+    """Compiles the RAG graph; parallel_retrieval=False chains the two searches (baseline).
+
+    reranker is "rrf" for reciprocal rank fusion or a CrossEncoderReranker.
+    context_packer defaults to a ContextPacker with a 1500 token budget.
+    embeddings, when given, embeds the queries instead of the vector store's
+    own model (say, the same model behind a different query cache).
+    """
+    workflow = StateGraph(RAGState)
+    context_packer = context_packer or ContextPacker()
+    embeddings = embeddings or vector_store.embeddings
+
+    # Step 2: Vector Search Node (FAISS)
+    async def vector_search(state):
+        # Embedded here rather than in a retriever, the answer cache reuses the vector
+        query_vector = await embeddings.aembed_query(state.query)
+        faiss_results = await vector_store.asimilarity_search_by_vector(query_vector, k=k)
+        return {"query_vector": query_vector, "faiss_results": faiss_results}
+
+    workflow.add_node("vector_search", vector_search)
+
+    # Step 3: BM25 Keyword Search Node
+    async def keyword_search(state):
+        bm25_results = await bm25_retriever.ainvoke(state.query)
+        return {"bm25_results": bm25_results}
+
+    workflow.add_node("keyword_search", keyword_search)
+
+    # Step 4: Merge & Re-rank Results Node
+    async def rerank_results(state):
+        if reranker == "rrf":
+            ranked = reciprocal_rank_fusion([state.faiss_results, state.bm25_results],
+                                            key=lambda doc: doc.page_content)
+        else:
+            combined_results = state.faiss_results + state.bm25_results
+            unique_results = list({doc.page_content: doc for doc in combined_results}.values())
+            # The forward pass is CPU bound, run it off the event loop
+            ranked = await asyncio.to_thread(reranker.rerank, state.query, unique_results,
+                                             text=lambda doc: doc.page_content)
+        reranked_results = [Document(page_content=doc.page_content,
+                                     metadata={**doc.metadata, "rerank_score": score})
+                            for doc, score in ranked]
+        return {"reranked_results": reranked_results}
+
+    workflow.add_node("rerank_results", rerank_results)
+
+    # Step 5: Pack the best documents into the prompt's token budget
+    async def pack_context(state):
+        docs = state.reranked_results or []
+        texts, indices, context_stats = context_packer.pack([doc.page_content for doc in docs])
+        context = [Document(page_content=text, metadata=docs[i].metadata)
+                   for text, i in zip(texts, indices)]
+        return {"context": context, "context_stats": context_stats}
+
+    workflow.add_node("pack_context", pack_context)
+
+    # Step 6: Generate Final Answer
+    async def generate_answer(state, writer: StreamWriter):
+        texts = [doc.page_content for doc in state.context or []]
+        if answer_cache is not None:
+            cached = answer_cache.get(state.query_vector, texts)
+            if cached is not None:
+                writer({"token": cached})
+                return {"final_answer": cached, "cache_hit": True}
+        context = "\n\n".join(texts) if texts else "No relevant information found."
+        prompt = f"Based on the following documents:\n\n{context}\n\nAnswer the user's query: {state.query}"
+        tokens = []
+        async for chunk in llm.astream(prompt):
+            # Completion models stream str, chat models stream message chunks
+            token = chunk if isinstance(chunk, str) else chunk.content
+            if token:
+                tokens.append(token)
+                writer({"token": token})
+        final_answer = "".join(tokens)
+        if answer_cache is not None:
+            answer_cache.put(state.query_vector, texts, final_answer)
+        return {"final_answer": final_answer, "cache_hit": False}
+
+    workflow.add_node("generate_answer", generate_answer)
+
+    # Define Execution Edges (Flow of the Workflow)
+    if parallel_retrieval:
+        # Both searches start in the same step, rerank waits for the two of them
+        workflow.add_edge(START, "vector_search")
+        workflow.add_edge(START, "keyword_search")
+        workflow.add_edge(["vector_search", "keyword_search"], "rerank_results")
+    else:
+        workflow.add_edge(START, "vector_search")
+        workflow.add_edge("vector_search", "keyword_search")
+        workflow.add_edge("keyword_search", "rerank_results")
+    workflow.add_edge("rerank_results", "pack_context")
+    workflow.add_edge("pack_context", "generate_answer")
+    workflow.set_finish_point("generate_answer")
+
+    # Compile
+    return workflow.compile()
+
+
+async def answer_many(app, queries: list[str], concurrency: int = 16) -> list[dict]:
+    """Runs the graph for every query on the current event loop, at most concurrency at once."""
+    limit = asyncio.Semaphore(concurrency)
+
+    async def answer(query: str):
+        async with limit:
+            return await app.ainvoke({"query": query})
+
+    return await asyncio.gather(*(answer(query) for query in queries))
+
+
+async def stream_answer(app, query: str):
+    """Yields ("token", text) for every answer token, then ("done", final state)."""
+    state = None
+    async for mode, chunk in app.astream({"query": query}, stream_mode=["custom", "values"]):
+        if mode == "custom":
+            yield "token", chunk["token"]
+        else:
+            state = chunk
+    yield "done", state
+
+
+def embedding_signature(embeddings) -> dict:
+    """Model and dimension of embeddings, the vectors of a store built with others don't fit.
+
+    The dimension costs one embed_query call.
+    """
+    # CachedQueryEmbeddings wraps the client, on Azure the deployment names the model
+    client = getattr(embeddings, "embeddings", embeddings)
+    if isinstance(client, AzureOpenAIEmbeddings):
+        model = client.deployment
+    else:
+        model = getattr(client, "model", None) or getattr(client, "model_name", None)
+    return {"embeddings": type(client).__name__, "model": model,
+            "dimension": len(embeddings.embed_query("dimension"))}
+
+
+def load_stores(embeddings, texts: list[str] = SAMPLE_DOCS, storage_dir: str = STORAGE_DIR,
+                k: int = 3, answer_cache: SemanticAnswerCache = None):
+    """Opens the saved FAISS store and BM25 index under storage_dir, building them from texts on first use.
+
+    Both are rebuilt from texts when the FAISS store was embedded by another
+    model (or one of another dimension) than embeddings. Building them drops
+    every answer in answer_cache.
+    """
+    # Create FAISS index, or open the one saved by an earlier run with the same model
+    faiss_dir = os.path.join(storage_dir, "faiss")
+    signature_path = os.path.join(faiss_dir, "embeddings.json")
+    signature = embedding_signature(embeddings)
+    saved = None
+    if os.path.exists(signature_path):
+        with open(signature_path, encoding="utf-8") as f:
+            saved = json.load(f)
+    if saved == signature and os.path.exists(os.path.join(faiss_dir, "index.faiss")):
+        vector_store = FAISS.load_local(faiss_dir, embeddings,
+                                       allow_dangerous_deserialization=True)
+    else:
+        # Convert text to LangChain Document objects
+        documents = [Document(page_content=text) for text in texts]
+        vector_store = FAISS.from_documents(documents, embeddings)
+        vector_store.save_local(faiss_dir)
+        with open(signature_path, "w", encoding="utf-8") as f:
+            json.dump(signature, f)
+        # Rebuilt from texts, the keyword index must hold the same documents
+        shutil.rmtree(os.path.join(storage_dir, "bm25"), ignore_errors=True)
+        if answer_cache is not None:
+            answer_cache.invalidate()
+
+    # Initialize BM25 keyword retriever, persisted next to the FAISS index
+    bm25_index = BM25Index(os.path.join(storage_dir, "bm25"))
+    if len(bm25_index) == 0:
+        bm25_index.add(texts)
+    return vector_store, BM25IndexRetriever(index=bm25_index, k=k)
+
+
+def build_clients(llm_type: str, url: str, key: str, **llm_kwargs):
+    """Returns (llm, embeddings) for llm_type "openai" or "azure", sharing one connection pool.
+
+    The embeddings cache query vectors in a QueryEmbeddingCache (embeddings.cache).
+
+    Azure deployments come from AZURE_OPENAI_COMPLETION_DEPLOYMENT and
+    AZURE_OPENAI_EMBEDDING_DEPLOYMENT, the API version from OPENAI_API_VERSION.
+    """
+    if llm_type == "azure":
+        api_version = os.getenv("OPENAI_API_VERSION", DEFAULT_AZURE_API_VERSION)
+        llm = LLMClient.from_credentials(
+            "azure", url, key, api_version=api_version,
+            model=os.getenv("AZURE_OPENAI_COMPLETION_DEPLOYMENT", "gpt-35-turbo-instruct"),
+            **llm_kwargs)
+        embeddings = AzureOpenAIEmbeddings(
+            azure_endpoint=url, api_key=key, api_version=api_version,
+            azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002"),
+            http_async_client=llm.http_client)
+    else:
+        # An empty URL means api.openai.com
+        llm = LLMClient.from_credentials("openai", url, key, **llm_kwargs)
+        embeddings = OpenAIEmbeddings(api_key=key, base_url=url or None,
+                                      http_async_client=llm.http_client)
+    return llm, CachedQueryEmbeddings(embeddings)
+
+
+async def print_streamed(app, query: str) -> dict:
+    """Prints the answer to query as it streams, returns the final state."""
+    print(f"\n🔹 {query}\n🔹 Final Answer: ", end="", flush=True)
+    state = None
+    async for kind, value in stream_answer(app, query):
+        if kind == "token":
+            print(value, end="", flush=True)
+        else:
+            state = value
+    print()
+    return state
+
+
+async def run_queries(app, answer_cache: SemanticAnswerCache, llm: LLMClient,
+                      embeddings: CachedQueryEmbeddings):
+    # Stream one answer token by token
+    result = await print_streamed(app, "What is a vector database?")
+    print(f"🔹 Context: {result['context_stats']}")
+
+    # Run: every query shares the one event loop, their retrievals and LLM calls overlap
+    input_queries = ["How does hybrid search work?",
+                     "What is Faiss used for?",
+                     "Why use BM25?"]
+    results = await answer_many(app, input_queries)
+    for input_query, result in zip(input_queries, results):
+        print(f"\n🔹 {input_query}\n🔹 Final Answer:", result["final_answer"])
+
+    # Asked again, the answers come from the cache without an LLM call
+    results = await answer_many(app, input_queries)
+    print(f"\n🔹 Cached answers: {sum(r['cache_hit'] for r in results)} of {len(results)}, "
+          f"{answer_cache.stats()}, LLM client {llm.stats()}, "
+          f"query embeddings {embeddings.cache.stats()}")
+    await llm.aclose()
+
+
+def main():
+    # Set api-key
+    self_api_key = os.getenv("OPENAI_API_KEY")
+    if self_api_key is None or self_api_key == "":
+         self_api_key = os.environ.get("OPENAI_API_KEY")
+
+    # Step 1: Load Data & Initialize Components
+    # LLM_TYPE=azure with LLM_URL set to the Azure endpoint switches backends
+    llm, embeddings = build_clients(os.getenv("LLM_TYPE", "openai"), os.getenv("LLM_URL", ""),
+                                    self_api_key)
+    answer_cache = SemanticAnswerCache(threshold=0.95, ttl=3600)
+    vector_store, bm25_retriever = load_stores(embeddings, answer_cache=answer_cache)
+
+    # Initialize Langchain with the Gemini API key
+    # google_llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
+
+    # RAG_RERANKER=cross-encoder swaps rank fusion for the cross-encoder
+    reranker = CrossEncoderReranker() if os.getenv("RAG_RERANKER") == "cross-encoder" else "rrf"
+    app = build_workflow(vector_store, bm25_retriever, llm, reranker=reranker,
+                         answer_cache=answer_cache)
+
+    # One event loop for all queries: the pooled client's connections live on it
+    asyncio.run(run_queries(app, answer_cache, llm, embeddings))
+
+
+if __name__ == "__main__":
+    main()
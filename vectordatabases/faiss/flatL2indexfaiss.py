@@ -25,7 +25,8 @@ Feature	                Description
 
 """
 
-import faiss
+
+from utility import SelfFaiss
 
 documents = [
     "Artificial Intelligence is transforming the world.",
@@ -35,61 +36,42 @@ documents = [
     "Natural Language Processing enables machines to understand human language."
 ]
 
-# Store the actual doc for id to text reference
-import pickle
-
-doc_store = "faiss_storage/index_to_text.pkl"
-try:
-    with open(doc_store, "rb") as f:
-        index_to_text = pickle.load(f)
-except FileNotFoundError as e:
-    index_to_text : list[str] = []
-    pass
-
-# Add to existing list of docs
-[index_to_text.append(x) for x in documents]
-
-# Create vectors
-from sentence_transformers import SentenceTransformer
-
-model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-document_vectors = (
-    model.encode(documents, convert_to_numpy=True).astype('float32'))
-
-# Define vector dimension
-d = document_vectors.shape[1]
-
-# Create a Faiss index (L2 distance-based search)
-import os
-if os.path.exists("faiss_storage/faiss_index.bin"):
-    index = faiss.read_index('faiss_storage/faiss_index.bin')
-else:
-    index = faiss.IndexFlatL2(d)
+# Metadata kept in columns next to the index, filters are applied inside faiss
+metadatas = [
+    {"source": "overview", "year": 2023},
+    {"source": "ml", "year": 2019},
+    {"source": "ml", "year": 2021},
+    {"source": "tools", "year": 2017},
+    {"source": "nlp", "year": 2022},
+]
 
-# Add document vectors to the index
-index.add(document_vectors)
-faiss.write_index(index, "faiss_storage/faiss_index.bin")
+# Persistent Flat L2 store, the existing segments under faiss_storage/flatl2/
+# are loaded at startup and only documents not stored yet are encoded and
+# appended as a new segment - nothing is rebuilt or rewritten.
+# Vectors come from the embedding cache shared with the IVF and HNSW examples.
+store = SelfFaiss(persist=True, store_mappings=True, faiss_app="flatl2",
+                  cache_embeddings=True)
+added = store.store(documents, metadatas)
 
-print(f"Total documents stored in index: {index.ntotal}")
+print(f"Documents added in this run: {added}")
+print(f"Total documents stored in index: {store.ntotal}")
 
 # Query a document
 query_text = "AI is changing industries."
-query_vector = model.encode([query_text], convert_to_numpy=True).astype('float32')
 
 # Search for top 3 similar documents
 k = 3
-distances, indices = index.search(query_vector, k)
-
-
-with open(doc_store, 'wb') as fid:
-    pickle.dump(index_to_text, fid)
-
-# import pprint
-# pprint.pprint(indices)
-# pprint.pprint(index_to_text)
+results = store.search(query_text, k)
 
-# Display results
+# Display results, texts come from the memory-mapped doc store so only the
+# pages holding the hits are read from disk
 print("\nQuery:", query_text)
 print("\nTop similar documents:")
-for i, idx in enumerate(indices[0]):
-    print(f"{i+1}. {index_to_text[idx]} (Distance: {distances[0][i]:.4f})")
+for i, (idx, distance) in enumerate(results):
+    print(f"{i+1}. {store.get_text(idx)} (Distance: {distance:.4f})")
+
+# Only rows matching the filter are scored, no over-fetching and post-filtering
+filter = {"source": "ml", "year": {"$gt": 2020}}
+print("\nFiltered by", filter)
+for i, (idx, distance) in enumerate(store.search(query_text, k, filter=filter)):
+    print(f"{i+1}. {store.get_text(idx)} {store.get_metadata(idx)} (Distance: {distance:.4f})")
@@ -46,6 +46,11 @@ When to Use HNSW?
 """
 
 import faiss
+import hashlib
+import time
+
+from utility.embedding_cache import EmbeddingCache, text_keys
+from utility.snapshots import SnapshotStore
 
 documents = [
     "Artificial Intelligence is transforming the world.",
@@ -55,16 +60,37 @@ documents = [
     "Natural Language Processing enables machines to understand human language."
 ]
 
-from sentence_transformers import SentenceTransformer
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-
-documents_vectors = model.encode(documents, convert_to_numpy=True).astype("float32")
-
-d = documents_vectors.shape[1]
+from utility.models import DEFAULT_MODEL_NAME as model_name, get_model
+model = get_model(model_name)
 
+# The graph is saved as a versioned snapshot, later runs memory map it
+# read-only instead of rebuilding it
+snapshots = SnapshotStore("faiss_storage/hnsw")
 M = 16
-index_hnsw = faiss.IndexHNSWFlat(d, M)
-index_hnsw.add(documents_vectors)
+# Edited documents or another model invalidate the snapshot, not only a new count
+documents_hash = hashlib.blake2b(text_keys(documents).tobytes(), digest_size=16).hexdigest()
+params = snapshots.current().get("params", {})
+
+if params.get("documents") == documents_hash and params.get("model") == model_name:
+    start = time.time()
+    index_hnsw, snapshot = snapshots.open()
+    end = time.time()
+    print(f"Opened HNSW snapshot v{snapshot['version']} in {end - start:.5f} sec")
+else:
+    # Texts embedded by any earlier run (or by another index example) are served
+    # from the shared on-disk cache, only new texts are encoded
+    embedding_cache = EmbeddingCache(model_name, model.get_sentence_embedding_dimension())
+    documents_vectors = embedding_cache.encode(model, documents)
+
+    d = documents_vectors.shape[1]
+
+    index_hnsw = faiss.IndexHNSWFlat(d, M)
+    index_hnsw.add(documents_vectors)
+    version = snapshots.save(index_hnsw, params={"M": M, "ef_search": index_hnsw.hnsw.efSearch,
+                                                 "model": model_name,
+                                                 "documents": documents_hash})
+    snapshots.prune(keep=3)
+    print(f"Saved HNSW snapshot v{version}")
 
 print("HNSW index size:", index_hnsw.ntotal)
 
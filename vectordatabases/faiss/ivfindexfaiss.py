@@ -41,9 +41,23 @@ Large-scale datasets where brute-force search is too slow.
 Fast, approximate similarity search.
 When you can afford slight accuracy trade-offs for better performance.
 
+Compressed mode:
+IVF_KIND=ivfpq (or ivfsq8, ivffp16) builds a compressed index instead of
+IndexIVFFlat, wrapped in utility.compressed.RerankedIndex: the codes stay in
+RAM and the shortlist is re-ranked with exact distances against the full
+vectors, memory mapped from faiss_storage/ivf_compressed.
+
 """
 
-import faiss
+import os
+
+import numpy as np
+
+from utility.compressed import RerankedIndex
+from utility.embedding_cache import EmbeddingCache
+from utility.incremental import IncrementalIVF
+from utility.indexes import COMPRESSED_TYPES
+from utility.snapshots import SnapshotStore
 
 documents = [
     "Artificial Intelligence is transforming the world.",
@@ -53,25 +67,45 @@ documents = [
     "Natural Language Processing enables machines to understand human language."
 ]
 
-from sentence_transformers import SentenceTransformer
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+from utility.models import DEFAULT_MODEL_NAME as model_name, get_model
+model = get_model(model_name)
 
-documents_vectors = model.encode(documents, convert_to_numpy=True).astype("float32")
+# Texts embedded by any earlier run (or by another index example) are served
+# from the shared on-disk cache, only new texts are encoded
+embedding_cache = EmbeddingCache(model_name, model.get_sentence_embedding_dimension())
+documents_vectors = embedding_cache.encode(model, documents)
 
 # Get the dimension of the vectors created
 d = documents_vectors.shape[1]
 
-quantizer = faiss.IndexFlatL2(d)
-
 # Set the number of clusters expected
 nlist = 3
-index_ivf = faiss.IndexIVFFlat(quantizer, d, nlist)
-
-index_ivf.train(documents_vectors)
-index_ivf.add(documents_vectors)
 
-faiss.write_index(index_ivf, "faiss_storage/faiss_ivf_index.bin")
-print(f"Total documents stored in index: {index_ivf.ntotal}")
+# "ivf" (IndexIVFFlat) or one of the compressed types
+IVF_KIND = os.getenv("IVF_KIND", "ivf")
+
+if IVF_KIND in COMPRESSED_TYPES:
+    # PQ codebooks need 2^pq_nbits training points, this sample has only a few
+    pq_nbits = min(8, int(np.log2(len(documents))))
+    index_ivf = RerankedIndex.build(IVF_KIND, documents_vectors,
+                                    path="faiss_storage/ivf_compressed/index",
+                                    nlist=nlist, pq_nbits=pq_nbits)
+    print(f"Total documents stored in {IVF_KIND} index: {index_ivf.ntotal}")
+else:
+    # Trains once train_size vectors arrived (flush trains on fewer); documents
+    # added later go to the trained index, which is retrained in the background
+    # when its lists drift away from the training sample
+    ivf = IncrementalIVF(d, nlist=nlist, nprobe=1, train_size=len(documents))
+    ivf.add(documents_vectors)
+    ivf.flush()
+    index_ivf = ivf.index
+
+    # Versioned snapshot, a serving process opens it memory mapped with
+    # SnapshotStore("faiss_storage/ivf").open()
+    snapshots = SnapshotStore("faiss_storage/ivf")
+    snapshots.save(index_ivf, params={"nlist": nlist, "nprobe": index_ivf.nprobe})
+    snapshots.prune(keep=3)
+    print(f"Total documents stored in index: {index_ivf.ntotal}")
 
 # Query a document
 query_text = "AI is changing industries."
@@ -91,5 +125,7 @@ distances, indices = index_ivf.search(query_vector, k)
 # Display results
 print("\nQuery:", query_text)
 print("\nTop similar documents:")
-for i, idx in enumerate(indices[0]):
-    print(f"{i+1}. {documents[idx]} (Distance: {distances[0][i]:.4f})")
+# faiss pads with -1 when the probed lists hold fewer than k vectors
+hits = [(idx, distance) for idx, distance in zip(indices[0], distances[0]) if idx >= 0]
+for i, (idx, distance) in enumerate(hits):
+    print(f"{i+1}. {documents[idx]} (Distance: {distance:.4f})")
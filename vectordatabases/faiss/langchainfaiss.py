@@ -1,10 +1,14 @@
+
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.docstore.document import Document
 from langgraph.graph import StateGraph, END
 
-embedding_model = HuggingFaceEmbeddings(
-    model_name = "all-MiniLM-L6-v2")
+from utility.query_embeddings import CachedQueryEmbeddings
+
+# Repeated queries are answered from the query embedding cache, not the model
+embedding_model = CachedQueryEmbeddings(HuggingFaceEmbeddings(
+    model_name = "all-MiniLM-L6-v2"))
 
 # Sample documents
 docs = [
@@ -45,3 +49,7 @@ query_input = RAGState("Tell me about AI.")
 output = app.invoke(query_input)
 
 print(f"\n🔹 Retrieved Documents:\n{output['result']}")
+
+# The same question again (spacing differs) skips the encoder
+output = app.invoke(RAGState("  Tell me about  AI. "))
+print(f"\n🔹 Query embedding cache: {embedding_model.cache.stats()}")